@@ -0,0 +1,4 @@
+"""
+Microbenchmarks for performance critical parts of the training pipelines.
+Each module can be run directly, e.g. python -m src.benchmarks.gae
+"""
@@ -0,0 +1,131 @@
+"""
+Microbenchmark of FCAgent's fused actor-critic forward (FusedActorCritic)
+against the separate actor and critic networks.
+
+Checks that both paths give the same logits and values, then reports the
+time of an inference forward (as in rollout) and of a forward and backward
+(as in learn) for a range of batch sizes.
+"""
+import argparse
+import time
+
+import gymnasium as gym
+import pandas as pd
+import torch as t
+
+from src.config import EnvironmentConfig
+from src.environments.environments import make_env
+from src.ppo.agent import FCAgent
+
+
+def make_agents(env_id, hidden_dim, device):
+    """Returns an unfused and a fused FCAgent with the same weights."""
+    environment_config = EnvironmentConfig(env_id=env_id, device=device)
+    envs = gym.vector.SyncVectorEnv(
+        [make_env(environment_config, 0, 0, "benchmark")]
+    )
+    agents = [
+        FCAgent(
+            envs,
+            environment_config=environment_config,
+            device=device,
+            hidden_dim=hidden_dim,
+            fused=fused,
+        )
+        for fused in (False, True)
+    ]
+    agents[1].load_state_dict(agents[0].state_dict())
+    envs.close()
+    return agents
+
+
+def check_parity(agent, fused_agent, obs, atol=1e-5, rtol=1e-4):
+    """Raises an AssertionError if the fused path disagrees with the separate networks."""
+    with t.inference_mode():
+        logits, values = agent.get_logits_and_values(obs)
+        fused_logits, fused_values = fused_agent.get_logits_and_values(obs)
+    assert t.allclose(logits, fused_logits, atol=atol, rtol=rtol), (
+        "fused logits differ, max abs error "
+        f"{(logits - fused_logits).abs().max().item()}"
+    )
+    assert t.allclose(values, fused_values, atol=atol, rtol=rtol), (
+        "fused values differ, max abs error "
+        f"{(values - fused_values).abs().max().item()}"
+    )
+
+
+def time_inference(agent, obs, repeats):
+    """Returns the mean wall clock time of one forward, as in rollout."""
+    with t.inference_mode():
+        agent.get_logits_and_values(obs)
+        if obs.device.type == "cuda":
+            t.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            agent.get_logits_and_values(obs)
+        if obs.device.type == "cuda":
+            t.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def time_training(agent, obs, repeats):
+    """Returns the mean wall clock time of one forward and backward, as in learn."""
+
+    def step():
+        logits, values = agent.get_logits_and_values(obs)
+        (logits.logsumexp(-1).mean() + values.mean()).backward()
+        agent.zero_grad()
+
+    step()
+    if obs.device.type == "cuda":
+        t.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    if obs.device.type == "cuda":
+        t.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(env_id, hidden_dim, batch_sizes, device, repeats) -> pd.DataFrame:
+    agent, fused_agent = make_agents(env_id, hidden_dim, device)
+    results = []
+    for batch_size in batch_sizes:
+        obs = t.rand(batch_size, *agent.obs_shape, device=device)
+        check_parity(agent, fused_agent, obs)
+        for name, a in (("separate", agent), ("fused", fused_agent)):
+            inference = time_inference(a, obs, repeats)
+            training = time_training(a, obs, repeats)
+            results.append(
+                {
+                    "path": name,
+                    "batch_size": batch_size,
+                    "inference_us": 1e6 * inference,
+                    "training_us": 1e6 * training,
+                    "inference_obs_per_s": batch_size / inference,
+                }
+            )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Actor-Critic Benchmark",
+        description="Compare FCAgent's fused and separate actor-critic forward.",
+    )
+    parser.add_argument(
+        "--env_id", type=str, default="MiniGrid-Dynamic-Obstacles-8x8-v0"
+    )
+    parser.add_argument("--hidden_dim", type=int, default=256)
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", default=[4, 16, 128, 1024]
+    )
+    parser.add_argument("--repeats", type=int, default=200)
+    parser.add_argument("--cuda", action="store_true", default=False)
+    args = parser.parse_args()
+
+    device = t.device("cuda" if args.cuda else "cpu")
+    df = benchmark(
+        args.env_id, args.hidden_dim, args.batch_sizes, device, args.repeats
+    )
+    print(df.to_string(index=False))
@@ -0,0 +1,134 @@
+"""
+Microbenchmark of the compile modes in src.utils.compilation.
+
+Reports the per-step latency on the cpu of
+- a FCAgent rollout step (actor and critic forward, inference mode),
+- a FCAgent learn step (forward, PPO objective and backward),
+- a DecisionTransformer training forward,
+for each compile mode. Modes a model can't be compiled with fall back to
+eager and are reported as such.
+"""
+import argparse
+import time
+import warnings
+
+import gymnasium as gym
+import pandas as pd
+import torch as t
+
+from src.config import EnvironmentConfig, TransformerModelConfig
+from src.decision_transformer.utils import (
+    get_example_inputs,
+    get_max_len_from_model_type,
+)
+from src.environments.environments import make_env
+from src.models.trajectory_transformer import DecisionTransformer
+from src.ppo.agent import FCAgent
+from src.utils.compilation import COMPILE_MODES, compile_module
+
+
+def time_step(step, repeats, warmup=3):
+    """Returns the mean wall clock time of step, after a few warm-up calls."""
+    for _ in range(warmup):
+        step()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        step()
+    return (time.perf_counter() - start) / repeats
+
+
+def agent_steps(environment_config, compile_mode, batch_size):
+    envs = gym.vector.SyncVectorEnv(
+        [make_env(environment_config, 0, 0, "benchmark")]
+    )
+    t.manual_seed(0)
+    agent = FCAgent(
+        envs, environment_config=environment_config, compile_mode=compile_mode
+    )
+    envs.close()
+    obs = t.rand(batch_size, *agent.obs_shape)
+    actions = t.randint(0, agent.num_actions, (batch_size,))
+    advantages, logprobs, returns = t.randn(3, batch_size)
+
+    def rollout_step():
+        with t.inference_mode():
+            agent.get_logits_and_values(obs)
+
+    def learn_step():
+        logits, values = agent.get_logits_and_values(obs)
+        objective = agent.ppo_objective(
+            logits, values, actions, advantages, logprobs, returns, 0.2, 0.5, 0.01
+        )[0]
+        objective.backward()
+        agent.zero_grad()
+
+    return {"fc_rollout_step": rollout_step, "fc_learn_step": learn_step}
+
+
+def transformer_step(environment_config, compile_mode, batch_size, n_ctx):
+    transformer_config = TransformerModelConfig(n_ctx=n_ctx)
+    t.manual_seed(0)
+    model = DecisionTransformer(
+        environment_config=environment_config,
+        transformer_config=transformer_config,
+    )
+    max_len = get_max_len_from_model_type("decision_transformer", n_ctx)
+    inputs = get_example_inputs(model, batch_size, max_len)
+    model = compile_module(model, compile_mode, inputs)
+
+    def step():
+        model(*inputs)
+
+    return step
+
+
+def benchmark(env_id, batch_size, n_ctx, repeats) -> pd.DataFrame:
+    environment_config = EnvironmentConfig(env_id=env_id)
+    results = []
+    for compile_mode in COMPILE_MODES:
+        models = {
+            "fc_agent": lambda: agent_steps(
+                environment_config, compile_mode, batch_size
+            ),
+            "decision_transformer": lambda: {
+                "dt_forward": transformer_step(
+                    environment_config, compile_mode, batch_size, n_ctx
+                )
+            },
+        }
+        for model_name, make_steps in models.items():
+            # compile_module warns when it runs a model eagerly instead
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                latencies = {
+                    name: 1e6 * time_step(step, repeats)
+                    for name, step in make_steps().items()
+                }
+            fell_back = any("eagerly" in str(w.message) for w in caught)
+            for name, latency in latencies.items():
+                results.append(
+                    {
+                        "compile_mode": compile_mode,
+                        "step": name,
+                        "latency_us": latency,
+                        "fell_back_to_eager": fell_back,
+                    }
+                )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Compilation Benchmark",
+        description="Compare the per-step cpu latency of the compile modes.",
+    )
+    parser.add_argument(
+        "--env_id", type=str, default="MiniGrid-Dynamic-Obstacles-8x8-v0"
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--n_ctx", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=100)
+    args = parser.parse_args()
+
+    df = benchmark(args.env_id, args.batch_size, args.n_ctx, args.repeats)
+    print(df.to_string(index=False))
@@ -0,0 +1,109 @@
+"""
+Microbenchmark of the GAE backends in src.ppo.compute_adv_vectorized.
+
+Checks that every backend matches the reference loop, then reports the
+throughput (env steps per second) of each backend for a grid of rollout
+lengths and numbers of environments.
+"""
+import argparse
+import time
+
+import pandas as pd
+import torch as t
+
+from src.ppo.compute_adv_vectorized import GAE_BACKENDS, compute_advantages
+
+
+def make_rollout(num_steps, num_envs, device, done_prob=0.02, seed=0):
+    """Returns random (next_value, next_done, rewards, values, dones) tensors."""
+    generator = t.Generator().manual_seed(seed)
+    rewards = t.randn(num_steps, num_envs, generator=generator)
+    values = t.randn(num_steps, num_envs, generator=generator)
+    dones = (t.rand(num_steps, num_envs, generator=generator) < done_prob).float()
+    next_value = t.randn(num_envs, generator=generator)
+    next_done = (t.rand(num_envs, generator=generator) < done_prob).float()
+    return [
+        x.to(device) for x in (next_value, next_done, rewards, values, dones)
+    ]
+
+
+def check_parity(rollout, device, gamma, gae_lambda, atol=1e-4, rtol=1e-4):
+    """Raises an AssertionError if any backend disagrees with the reference loop."""
+    reference = compute_advantages(
+        *rollout, device, gamma, gae_lambda, backend="loop"
+    )
+    for backend in GAE_BACKENDS:
+        advantages = compute_advantages(
+            *rollout, device, gamma, gae_lambda, backend=backend
+        )
+        assert t.allclose(advantages, reference, atol=atol, rtol=rtol), (
+            f"{backend} GAE differs from the reference loop, max abs error "
+            f"{(advantages - reference).abs().max().item()}"
+        )
+
+
+def time_backend(backend, rollout, device, gamma, gae_lambda, repeats):
+    """Returns the mean wall clock time of one advantage computation."""
+    # warm up (compiles the TorchScript scan on first use)
+    compute_advantages(*rollout, device, gamma, gae_lambda, backend=backend)
+    if device.type == "cuda":
+        t.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        compute_advantages(
+            *rollout, device, gamma, gae_lambda, backend=backend
+        )
+    if device.type == "cuda":
+        t.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+
+def benchmark(
+    num_steps_list, num_envs_list, device, gamma, gae_lambda, repeats
+) -> pd.DataFrame:
+    results = []
+    for num_steps in num_steps_list:
+        for num_envs in num_envs_list:
+            rollout = make_rollout(num_steps, num_envs, device)
+            check_parity(rollout, device, gamma, gae_lambda)
+            for backend in GAE_BACKENDS:
+                seconds = time_backend(
+                    backend, rollout, device, gamma, gae_lambda, repeats
+                )
+                results.append(
+                    {
+                        "backend": backend,
+                        "num_steps": num_steps,
+                        "num_envs": num_envs,
+                        "ms_per_call": 1000 * seconds,
+                        "env_steps_per_s": num_steps * num_envs / seconds,
+                    }
+                )
+    return pd.DataFrame(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="GAE Benchmark",
+        description="Compare the throughput of the GAE backends.",
+    )
+    parser.add_argument(
+        "--num_steps", type=int, nargs="+", default=[128, 512, 2048]
+    )
+    parser.add_argument("--num_envs", type=int, nargs="+", default=[8, 64])
+    parser.add_argument("--gamma", type=float, default=0.99)
+    parser.add_argument("--gae_lambda", type=float, default=0.95)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--cuda", action="store_true", default=False)
+    args = parser.parse_args()
+
+    device = t.device("cuda" if args.cuda else "cpu")
+    df = benchmark(
+        args.num_steps,
+        args.num_envs,
+        device,
+        args.gamma,
+        args.gae_lambda,
+        args.repeats,
+    )
+    print(df.to_string(index=False))
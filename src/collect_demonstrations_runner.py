@@ -13,6 +13,8 @@ def runner(
     num_envs: int,
     trajectory_path: str,
     sampling_configs: list,
+    shard_size: int = None,
+    background_compression: bool = False,
 ):
     register_envs()
     agent = load_saved_checkpoint(checkpoint_path, num_envs)
@@ -26,6 +28,8 @@ def runner(
         environment_config=agent.environment_config,
         online_config=OnlineTrainConfig(num_envs=num_envs),
         model_config=agent.model_config,
+        shard_size=shard_size,
+        background_compression=background_compression,
     )
 
     i = 0
@@ -66,6 +70,18 @@ def main():
         default=None,
         help="Path to save trajectory data.",
     )
+    parser.add_argument(
+        "--shard_size",
+        type=int,
+        default=None,
+        help="If set, stream trajectories to a directory of shards with this many steps each.",
+    )
+    parser.add_argument(
+        "--background_compression",
+        action="store_true",
+        default=False,
+        help="Compress and write shards in a background thread.",
+    )
     parser.add_argument(
         "--basic", type=int, help="Number of steps for basic sampling"
     )
@@ -127,7 +143,12 @@ def main():
             )
 
     runner(
-        args.checkpoint, args.num_envs, args.trajectory_path, sampling_configs
+        args.checkpoint,
+        args.num_envs,
+        args.trajectory_path,
+        sampling_configs,
+        shard_size=args.shard_size,
+        background_compression=args.background_compression,
     )
 
 
@@ -17,6 +17,8 @@ from minigrid.wrappers import (
 )
 
 from src.environments.wrappers import ViewSizeWrapper
+from src.ppo.compute_adv_vectorized import GAE_BACKENDS
+from src.utils.compilation import COMPILE_MODES
 
 
 @dataclass
@@ -36,28 +38,37 @@ class EnvironmentConfig:
     video_dir: str = "videos"
     video_frequency: int = 47
     render_mode: str = "rgb_array"
+    vector_env: str = "sync"
     action_space: None = None
     observation_space: None = None
     device: str = "cpu"
 
     def __post_init__(self):
-        env = gym.make(self.env_id)
-
-        if self.env_id.startswith("MiniGrid"):
-            if self.fully_observed:
-                env = FullyObsWrapper(env)
-            elif self.one_hot_obs:
-                env = OneHotPartialObsWrapper(env)
-            elif self.img_obs:
-                env = RGBImgPartialObsWrapper(env)
-
-            if self.view_size != 7:
-                env = ViewSizeWrapper(env, self.view_size)
-
-        self.action_space = self.action_space or env.action_space
-        self.observation_space = (
-            self.observation_space or env.observation_space
-        )
+        assert self.vector_env in [
+            "sync",
+            "async",
+            "shared_memory",
+        ], "vector_env must be one of sync, async or shared_memory"
+
+        # only make the environment if its spaces weren't given
+        if self.action_space is None or self.observation_space is None:
+            env = gym.make(self.env_id)
+
+            if self.env_id.startswith("MiniGrid"):
+                if self.fully_observed:
+                    env = FullyObsWrapper(env)
+                elif self.one_hot_obs:
+                    env = OneHotPartialObsWrapper(env)
+                elif self.img_obs:
+                    env = RGBImgPartialObsWrapper(env)
+
+                if self.view_size != 7:
+                    env = ViewSizeWrapper(env, self.view_size)
+
+            self.action_space = self.action_space or env.action_space
+            self.observation_space = (
+                self.observation_space or env.observation_space
+            )
         if isinstance(self.device, str):
             self.device = torch.device(self.device)
 
@@ -157,12 +168,21 @@ class OfflineTrainConfig:
     eval_episodes: int = 10
     model_type: str = "decision_transformer"
     convert_to_one_hot: bool = False
+    cache_preprocessed_observations: bool = False
     initial_rtg: list[float] = (0.0, 1.0)
     eval_max_time_steps: int = 100
     eval_num_envs: int = 8
+    compile_mode: str = "none"
+    num_workers: int = 0
+    persistent_workers: bool = False
+    prefetch_factor: int = 2
+    pin_memory: bool = False
 
     def __post_init__(self):
         assert self.model_type in ["decision_transformer", "clone_transformer"]
+        assert self.compile_mode in COMPILE_MODES
+        assert self.num_workers >= 0
+        assert self.prefetch_factor >= 1
         if isinstance(self.device, str):
             self.device = torch.device(self.device)
 
@@ -189,12 +209,24 @@ class OnlineTrainConfig:
     vf_coef: float = 0.5
     max_grad_norm: float = 2
     trajectory_path: str = None
+    trajectory_shard_size: int = None
+    trajectory_background_compression: bool = False
     fully_observed: bool = False
     prob_go_from_end: float = 0.0
     num_checkpoints: int = 10
+    memory_storage: str = "list"
+    gae_backend: str = "loop"
+    pipeline_rollouts: bool = False
+    max_policy_lag: int = 1
+    fused_actor_critic: bool = False
+    compile_mode: str = "none"
     device: str = "cpu"
 
     def __post_init__(self):
+        assert self.memory_storage in ["list", "preallocated"]
+        assert self.compile_mode in COMPILE_MODES
+        assert self.gae_backend in GAE_BACKENDS
+        assert self.max_policy_lag >= 0, "max_policy_lag must be non-negative"
         self.batch_size = int(self.num_envs * self.num_steps)
         self.minibatch_size = self.batch_size // self.num_minibatches
 
@@ -1,38 +1,254 @@
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import gymnasium.vector
 import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import torch as t
 from tqdm import tqdm
 
-from .train import evaluate_dt_agent
+from src.models.trajectory_transformer import DecisionTransformer
+
+from .eval import EvalContext
+from .utils import get_max_len_from_model_type
+
+
+def rtg_result_path(results_dir, initial_rtg):
+    return os.path.join(results_dir, f"rtg_{float(initial_rtg):+.6f}.json")
+
+
+def write_rtg_result(results_dir, statistics):
+    """Writes the statistics of one rtg atomically, so partial sweeps can be resumed."""
+    path = rtg_result_path(results_dir, statistics["initial_rtg"])
+    with open(path + ".tmp", "w") as f:
+        json.dump(statistics, f)
+    os.replace(path + ".tmp", path)
+
+
+def read_rtg_result(results_dir, initial_rtg):
+    path = rtg_result_path(results_dir, initial_rtg)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def summarize_rtg(initial_rtg, traj_lengths, returns, terminated):
+    n = len(traj_lengths)
+    returns = np.array(returns, dtype=float)
+    return {
+        "initial_rtg": float(initial_rtg),
+        "prop_completed": sum(terminated) / n,
+        "prop_truncated": 1 - sum(terminated) / n,
+        "mean_reward": float(returns.sum()) / n,
+        "prop_positive_reward": int((returns > 0).sum()) / n,
+        "mean_traj_length": sum(traj_lengths) / n,
+        "traj_lengths": traj_lengths,
+        "rewards": returns.tolist(),
+    }
+
+
+def rtg_sweep(
+    dt,
+    env_func,
+    initial_rtgs,
+    trajectories=100,
+    envs_per_rtg=8,
+    results_dir=None,
+    asynchronous=False,
+    use_tqdm=True,
+    device="cpu",
+):
+    """
+    Evaluates dt at every initial rtg in a single vector env.
+
+    Each rtg gets envs_per_rtg env slots and all slots go through the model
+    in one forward pass per step. Once an rtg has collected trajectories
+    episodes its statistics are final (and written to results_dir, if
+    given) and its slots are handed over to the rtgs with the most episodes
+    left, starting from their next episode.
+
+    Args:
+    - dt (TrajectoryTransformer): the model to evaluate.
+    - env_func (callable): returns one environment.
+    - initial_rtgs (list[float]): the rtgs to evaluate.
+    - trajectories (int): the number of episodes per rtg.
+    - envs_per_rtg (int): env slots per rtg at the start of the sweep.
+    - results_dir (str): if set, one json file per rtg is written there as soon as it finishes.
+    - asynchronous (bool): step the envs in subprocesses (AsyncVectorEnv).
+
+    Returns:
+    - list[dict]: the statistics of each rtg (as evaluate_dt_agent), in the order of initial_rtgs.
+    """
+    dt.eval()
+    initial_rtgs = [float(rtg) for rtg in initial_rtgs]
+    n_rtgs = len(initial_rtgs)
+    num_envs = n_rtgs * envs_per_rtg
+    linear_time = dt.transformer_config.time_embedding_type == "linear"
+    max_len = get_max_len_from_model_type(
+        dt.model_type, dt.transformer_config.n_ctx
+    )
+
+    vector_env = (
+        gymnasium.vector.AsyncVectorEnv
+        if asynchronous
+        else gymnasium.vector.SyncVectorEnv
+    )
+    env = vector_env([env_func for _ in range(num_envs)])
+
+    # the rtg index each env slot is currently collecting episodes for
+    slot_rtg = np.repeat(np.arange(n_rtgs), envs_per_rtg)
+    slot_return = np.zeros(num_envs)
+    traj_lengths = [[] for _ in range(n_rtgs)]
+    returns = [[] for _ in range(n_rtgs)]
+    terminations = [[] for _ in range(n_rtgs)]
+    finished = np.zeros(n_rtgs, dtype=bool)
+    statistics = [None] * n_rtgs
+
+    obs, _ = env.reset(seed=0)
+    context = EvalContext(
+        num_envs=num_envs,
+        max_len=max_len,
+        obs_shape=obs["image"].shape[1:],
+        initial_rtg=np.array(initial_rtgs)[slot_rtg],
+        action_pad_token=env.single_action_space.n,
+        timestep_dtype=t.float32 if linear_time else t.long,
+        device=device,
+    )
+    context.reset(obs["image"])
+
+    pbar = tqdm(total=n_rtgs * trajectories, disable=not use_tqdm)
+    while not finished.all():
+        obs, actions, rtg, timesteps = context.window()
+        with t.no_grad():
+            if isinstance(dt, DecisionTransformer):
+                _, action_preds, _ = dt.forward(
+                    states=obs, actions=actions, rtgs=rtg, timesteps=timesteps
+                )
+            else:
+                _, action_preds = dt.forward(
+                    states=obs, actions=actions, timesteps=timesteps
+                )
+        new_action = t.argmax(action_preds, dim=-1)[:, -1]
+
+        new_obs, new_reward, terminated, truncated, _ = env.step(
+            new_action.cpu().numpy()
+        )
+        slot_return += new_reward
+        current_trajectory_length = timesteps[:, -1, 0].cpu().numpy() + 1
+        dones = np.logical_or(terminated, truncated)
+
+        for slot in np.flatnonzero(dones):
+            i = slot_rtg[slot]
+            if not finished[i]:
+                traj_lengths[i].append(int(current_trajectory_length[slot]))
+                returns[i].append(float(slot_return[slot]))
+                terminations[i].append(bool(terminated[slot]))
+                pbar.update(1)
+
+                if len(traj_lengths[i]) == trajectories:
+                    finished[i] = True
+                    statistics[i] = summarize_rtg(
+                        initial_rtgs[i],
+                        traj_lengths[i],
+                        returns[i],
+                        terminations[i],
+                    )
+                    if results_dir is not None:
+                        write_rtg_result(results_dir, statistics[i])
+
+            # hand the slot over to the rtg with the most episodes left
+            if finished[i] and not finished.all():
+                remaining = np.array(
+                    [trajectories - len(lengths) for lengths in traj_lengths]
+                )
+                remaining[finished] = -1
+                slot_rtg[slot] = int(np.argmax(remaining))
+                context.initial_rtg[slot] = initial_rtgs[slot_rtg[slot]]
+        slot_return[dones] = 0
+
+        context.append(new_obs["image"], new_action, new_reward)
+        context.reset(new_obs["image"], dones)
+
+    pbar.close()
+    env.close()
+    return statistics
+
+
+# set before forking the sweep workers, which inherit it instead of
+# receiving the model and env_func by pickle
+_SWEEP_ARGS = None
+
+
+def _run_sweep_shard(initial_rtgs):
+    t.set_num_threads(1)
+    dt, env_func, kwargs = _SWEEP_ARGS
+    return rtg_sweep(dt, env_func, initial_rtgs, use_tqdm=False, **kwargs)
 
 
 def calibration_statistics(
     dt,
-    env_id,
     env_func,
     initial_rtg_range=np.linspace(-1, 1, 21),
     trajectories=100,
     num_envs=8,
+    results_dir=None,
+    num_workers=1,
+    asynchronous=False,
 ):
-    statistics = []
-    pbar = tqdm(initial_rtg_range, desc="initial_rtg")
-    for initial_rtg in pbar:
-        statistics.append(
-            evaluate_dt_agent(
-                env_id=env_id,
-                model=dt,
-                env_func=env_func,
-                track=False,
-                batch_number=0,
-                initial_rtg=initial_rtg,
-                trajectories=trajectories,
-                use_tqdm=False,
-                num_envs=num_envs,
-            )
-        )
-        pbar.set_description(f"initial_rtg: {initial_rtg}")
-    return statistics
+    """
+    Evaluates dt at every initial rtg in initial_rtg_range (see rtg_sweep).
+
+    With num_workers > 1 the rtgs are split between forked worker processes,
+    each running its own sweep (the model must be on the cpu). If
+    results_dir is set, rtgs whose results are already there are not
+    evaluated again.
+
+    Returns:
+    - list[dict]: the statistics of each rtg, in the order of initial_rtg_range.
+    """
+    initial_rtgs = [float(rtg) for rtg in initial_rtg_range]
+    cached = {}
+    if results_dir is not None:
+        os.makedirs(results_dir, exist_ok=True)
+        for rtg in initial_rtgs:
+            result = read_rtg_result(results_dir, rtg)
+            if result is not None:
+                cached[rtg] = result
+    todo = [rtg for rtg in initial_rtgs if rtg not in cached]
+
+    kwargs = dict(
+        trajectories=trajectories,
+        envs_per_rtg=num_envs,
+        results_dir=results_dir,
+        asynchronous=asynchronous,
+    )
+    results = []
+    if todo and num_workers > 1:
+        global _SWEEP_ARGS
+        _SWEEP_ARGS = (dt, env_func, kwargs)
+        shards = [todo[i::num_workers] for i in range(num_workers)]
+        with ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            for shard_results in tqdm(
+                executor.map(_run_sweep_shard, [s for s in shards if s]),
+                total=len([s for s in shards if s]),
+                desc="rtg sweep shards",
+            ):
+                results.extend(shard_results)
+        _SWEEP_ARGS = None
+    elif todo:
+        results = rtg_sweep(dt, env_func, todo, **kwargs)
+
+    for result in results:
+        cached[result["initial_rtg"]] = result
+    return [cached[rtg] for rtg in initial_rtgs]
 
 
 def plot_calibration_statistics(statistics, show_spread=False, CI=0.95):
@@ -4,9 +4,7 @@ from argparse import Namespace
 import gymnasium.vector
 import numpy as np
 import torch as t
-from einops import rearrange
 from tqdm import tqdm
-from copy import deepcopy
 
 import wandb
 from src.models.trajectory_transformer import (
@@ -14,8 +12,127 @@ from src.models.trajectory_transformer import (
     DecisionTransformer,
     TrajectoryTransformer,
 )
+from src.utils.ring_buffer import RingBuffer
+
+from .utils import get_max_len_from_model_type
+
+
+class EvalContext:
+    """
+    The context windows (obs, actions, rtg, timesteps) of every env during
+    evaluation, preallocated and written in place.
+
+    Each field is a RingBuffer of max_len steps per env, so the window passed
+    to the model is a view and nothing is reallocated as the episodes go on.
+    Actions are stored with the state they were taken from, the newest state
+    having none yet.
+
+    initial_rtg can be a float or one value per env, e.g. to evaluate
+    several rtgs at once (see calibration.rtg_sweep).
+    """
+
+    def __init__(
+        self,
+        num_envs,
+        max_len,
+        obs_shape,
+        initial_rtg,
+        action_pad_token,
+        timestep_dtype=t.long,
+        device="cpu",
+    ):
+        self.max_len = max_len
+        self.device = t.device(device)
+        # (num_envs,), can be changed per env before a reset
+        self.initial_rtg = (
+            t.as_tensor(initial_rtg, dtype=t.float, device=self.device)
+            .expand(num_envs)
+            .clone()
+        )
+        self.action_pad_token = action_pad_token
+
+        self.obs = RingBuffer(
+            t.zeros(
+                (num_envs, max_len, *obs_shape),
+                dtype=t.float32,
+                device=self.device,
+            )
+        )
+        self.actions = RingBuffer(
+            t.full(
+                (num_envs, max_len, 1),
+                action_pad_token,
+                dtype=t.long,
+                device=self.device,
+            )
+        )
+        self.rtg = RingBuffer(
+            self.initial_rtg[:, None, None].repeat(1, max_len, 1)
+        )
+        self.timesteps = RingBuffer(
+            t.zeros(
+                (num_envs, max_len, 1),
+                dtype=timestep_dtype,
+                device=self.device,
+            )
+        )
 
-from .utils import get_max_len_from_model_type, initialize_padding_inputs
+    def window(self):
+        """
+        Returns views of the last max_len steps: obs, actions (None if max_len
+        is 1), rtg and timesteps, in the layout of initialize_padding_inputs.
+        """
+        actions = self.actions.window()[:, :-1] if self.max_len > 1 else None
+        return (
+            self.obs.window(),
+            actions,
+            self.rtg.window(),
+            self.timesteps.window(),
+        )
+
+    def append(self, new_obs, new_action, new_reward):
+        """
+        Appends one step for every env, evicting the oldest one.
+
+        Args:
+        - new_obs (np.ndarray): (num_envs, *obs_shape) the observations after the step.
+        - new_action (torch.Tensor): (num_envs,) the actions taken at the current states.
+        - new_reward (np.ndarray): (num_envs,) the rewards received.
+        """
+        next_rtg = self.rtg.last() - t.as_tensor(
+            new_reward, dtype=t.float, device=self.device
+        ).unsqueeze(-1)
+        next_timestep = self.timesteps.last() + 1
+        self.actions.write_last(new_action.to(self.device)[:, None])
+
+        self.obs.append(t.as_tensor(new_obs, device=self.device))
+        self.rtg.append(next_rtg)
+        self.timesteps.append(next_timestep)
+        self.actions.append(self.action_pad_token)
+
+    def reset(self, initial_obs, dones=None):
+        """
+        Restarts the windows of the envs in dones (all if None) as padding
+        followed by initial_obs at timestep 0, as in initialize_padding_inputs.
+
+        Args:
+        - initial_obs (np.ndarray): (num_envs, *obs_shape) observations, only those of the reset envs are used.
+        - dones (np.ndarray): (num_envs,) bool mask of the envs to reset.
+        """
+        if dones is None:
+            dones = np.ones(len(self.initial_rtg), dtype=bool)
+        elif not np.any(dones):
+            return
+        rows = t.as_tensor(np.flatnonzero(dones), device=self.device)
+
+        obs = self.obs.buffer.new_zeros(
+            (len(rows), self.max_len, *self.obs.buffer.shape[2:])
+        )
+        obs[:, -1] = t.as_tensor(initial_obs[dones], device=self.device)
+        self.obs.reset(rows, obs)
+        self.actions.reset(rows, self.action_pad_token)
+        self.rtg.reset(rows, self.initial_rtg[rows][:, None, None])
+        self.timesteps.reset(rows, 0)
 
 
 def evaluate_dt_agent(
@@ -69,82 +186,39 @@ def evaluate_dt_agent(
 
     # each env will get its own seed by incrementing on the given seed
     obs, _ = env.reset(seed=0)
-    action_pad_token = (
-        env.single_action_space.n
-    )  # current pad token for actions
-    obs, actions, reward, rtg, timesteps, mask = initialize_padding_inputs(
+    if not isinstance(model, (DecisionTransformer, CloneTransformer)):
+        raise NotImplementedError("Model type not supported for evaluation.")
+
+    context = EvalContext(
+        num_envs=num_envs,
         max_len=max_len,
-        initial_obs=obs,
+        obs_shape=obs["image"].shape[1:],
         initial_rtg=initial_rtg,
-        action_pad_token=action_pad_token,
-        batch_size=num_envs,
+        action_pad_token=env.single_action_space.n,
+        timestep_dtype=t.float32
+        if model.transformer_config.time_embedding_type == "linear"
+        else t.long,
         device=device,
     )
+    context.reset(obs["image"])
 
-    if model.transformer_config.time_embedding_type == "linear":
-        timesteps = timesteps.to(t.float32)
-
-    # get first action
-    if isinstance(model, DecisionTransformer):
-        _, action_preds, _ = model.forward(
-            states=obs, actions=actions, rtgs=rtg, timesteps=timesteps
-        )
-    elif isinstance(model, CloneTransformer):
-        _, action_preds = model.forward(
-            states=obs, actions=actions, timesteps=timesteps
-        )
-    else:
-        raise ValueError("Model type not supported")
-
-    new_action = t.argmax(action_preds[:, -1], dim=-1).squeeze(-1)
-    new_obs, new_reward, terminated, truncated, info = env.step(new_action)
-    dones = np.logical_or(terminated, truncated)
     while n_terminated + n_truncated < trajectories:
-        # concat init obs to new obs
-        obs = t.cat(
-            [obs, t.tensor(new_obs["image"]).unsqueeze(1).to(device)], dim=1
-        )
-
-        # add new reward to init reward
-        new_rtg = rtg[:, -1:, :] - new_reward[None, :, None]
-        rtg = t.cat([rtg, new_rtg], dim=1)
-
-        # add new timesteps
-        # if we are done, we don't want to increment the timestep,
-        # so we use the not operator to flip the done bit
-        new_timestep = timesteps[:, -1:, :] + np.invert(dones)[:, None, None]
-        timesteps = t.cat([timesteps, new_timestep], dim=1)
-
-        if model.transformer_config.time_embedding_type == "linear":
-            timesteps = timesteps.to(t.float32)
-
-        if max_len > 1:
-            actions = t.cat(
-                [actions, rearrange(new_action, "e -> e 1 1")], dim=1
-            )
-
-        # truncations:
-        obs = obs[:, -max_len:]
-        actions = actions[:, -(max_len - 1) :] if max_len > 1 else None
-        timesteps = timesteps[:, -max_len:]
-        rtg = rtg[:, -max_len:]
-
-        if isinstance(model, DecisionTransformer):
-            state_preds, action_preds, reward_preds = model.forward(
-                states=obs, actions=actions, rtgs=rtg, timesteps=timesteps
-            )
-        elif isinstance(model, CloneTransformer):
-            state_preds, action_preds = model.forward(
-                states=obs, actions=actions, timesteps=timesteps
-            )
-        else:
-            raise NotImplementedError(
-                "Model type not supported for evaluation."
-            )
+        obs, actions, rtg, timesteps = context.window()
+        with t.no_grad():
+            if isinstance(model, DecisionTransformer):
+                state_preds, action_preds, reward_preds = model.forward(
+                    states=obs, actions=actions, rtgs=rtg, timesteps=timesteps
+                )
+            else:
+                state_preds, action_preds = model.forward(
+                    states=obs, actions=actions, timesteps=timesteps
+                )
 
-        new_action = t.argmax(action_preds, dim=-1)[:, -1].squeeze(-1)
+        new_action = t.argmax(action_preds, dim=-1)[:, -1]
 
-        new_obs, new_reward, terminated, truncated, info = env.step(new_action)
+        new_obs, new_reward, terminated, truncated, info = env.step(
+            new_action.cpu().numpy()
+        )
 
         n_positive = n_positive + sum(new_reward > 0)
         reward_total += sum(new_reward)
@@ -164,43 +238,11 @@ def evaluate_dt_agent(
 
         traj_lengths.extend(current_trajectory_length[dones].tolist())
         rewards.extend(new_reward[dones])
-        current_trajectory_length[dones] = 0
-
-        # for each done, replace the obs, rtg, action, timestep with the new obs, rtg, action, timestep
-        batch_reset_indexes = np.where(dones)
-        if sum(dones) > 0:
-            _new_obs = deepcopy(new_obs)
-            _new_obs["image"] = _new_obs["image"][batch_reset_indexes]
-            (
-                _obs,
-                _actions,
-                reward[batch_reset_indexes],
-                _rtg,
-                timesteps[batch_reset_indexes],
-                mask[batch_reset_indexes],
-            ) = initialize_padding_inputs(
-                max_len=max_len,
-                initial_obs=_new_obs,
-                initial_rtg=initial_rtg,
-                action_pad_token=action_pad_token,
-                batch_size=sum(dones),
-                device=device,
-            )
-
-            # TODO: annoying dtype issues I'll solve another day...
-            obs[batch_reset_indexes] = _obs.to(dtype=obs.dtype)
-            rtg[batch_reset_indexes] = _rtg.to(dtype=rtg.dtype)
-
-            # hack, obs, action, timesteps and rtg will all be modified on
-            # next loop iteration so pad them appropriate to counteract this
-            if actions is not None:
-                actions[batch_reset_indexes] = _actions
-                new_action[batch_reset_indexes] = action_pad_token  # pad token
 
-            obs[batch_reset_indexes, -1] = 0  # pad token
-            new_reward[
-                batch_reset_indexes
-            ] = 0  # effectively removes reward which would be added
+        context.append(new_obs["image"], new_action, new_reward)
+        # the vector env has already reset finished episodes, so new_obs
+        # holds their first observation
+        context.reset(new_obs["image"], dones)
 
         if np.any(dones):
             if use_tqdm:
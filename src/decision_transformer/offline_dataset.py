@@ -11,6 +11,17 @@ from einops import rearrange
 from minigrid.core.constants import COLOR_TO_IDX, OBJECT_TO_IDX, STATE_TO_IDX
 from torch.utils.data import Dataset
 
+from src.utils.columnar_trajectories import (
+    is_columnar_path,
+    read_columnar_trajectories,
+)
+from src.utils.sharded_trajectories import (
+    is_sharded_path,
+    iter_shards,
+    read_sharded_trajectories,
+)
+from src.utils.trajectory_utils import compact_observations
+
 
 class TrajectoryReader:
     """
@@ -21,8 +32,14 @@ class TrajectoryReader:
         self.path = path.strip()
 
     def read(self):
+        # columnar directory, memory mapped rather than loaded
+        if is_columnar_path(self.path):
+            data = read_columnar_trajectories(self.path, mmap=True)
+        # directory of shards written while collecting, concatenated along time
+        elif is_sharded_path(self.path):
+            data = read_sharded_trajectories(self.path)
         # if path ends in .pkl, read as pickle
-        if self.path.endswith(".pkl"):
+        elif self.path.endswith(".pkl"):
             with open(self.path, "rb") as f:
                 data = pickle.load(f)
         # if path ends in .xz, read as lzma
@@ -39,6 +56,15 @@ class TrajectoryReader:
 
         return data
 
+    def iter_shards(self):
+        """
+        Yields the data of each shard of a sharded trajectory directory without
+        loading the others. Episodes may continue from one shard into the next.
+        """
+        if not is_sharded_path(self.path):
+            raise ValueError(f"Path {self.path} is not a sharded trajectory directory")
+        yield from iter_shards(self.path)
+
 
 class TrajectoryDataset(Dataset):
     def __init__(
@@ -50,6 +76,7 @@ class TrajectoryDataset(Dataset):
         rtg_scale=1,
         normalize_state=False,
         preprocess_observations: Callable = None,
+        cache_preprocessed_observations: bool = False,
         device="cpu",
     ):
         self.trajectory_path = trajectory_path
@@ -60,20 +87,108 @@ class TrajectoryDataset(Dataset):
         self.normalize_state = normalize_state
         self.rtg_scale = rtg_scale
         self.preprocess_observations = preprocess_observations
+        self.cache_preprocessed_observations = cache_preprocessed_observations
         self.load_trajectories()
 
     def load_trajectories(self) -> None:
         traj_reader = TrajectoryReader(self.trajectory_path)
         data = traj_reader.read()
 
-        observations = data["data"].get("observations")
-        actions = data["data"].get("actions")
-        rewards = data["data"].get("rewards")
-        dones = data["data"].get("dones")
-        truncated = data["data"].get("truncated")
-        infos = data["data"].get("infos")
+        if "episode_offsets" in data["data"]:
+            self.split_columnar_trajectories(data["data"])
+        else:
+            self.split_trajectories(data["data"])
+
+        self.returns = [r.sum() for r in self.rewards]
+        self.timesteps = [torch.arange(len(i)) for i in self.states]
+        self.traj_lens = np.array([len(i) for i in self.states])
 
-        observations = np.array(observations)
+        # remove trajs with length 0
+        traj_len_mask = self.traj_lens > 0
+        self.actions = [i for i, m in zip(self.actions, traj_len_mask) if m]
+        self.rewards = [i for i, m in zip(self.rewards, traj_len_mask) if m]
+        self.dones = [i for i, m in zip(self.dones, traj_len_mask) if m]
+        self.truncated = [
+            i for i, m in zip(self.truncated, traj_len_mask) if m
+        ]
+        self.states = [i for i, m in zip(self.states, traj_len_mask) if m]
+        self.returns = [i for i, m in zip(self.returns, traj_len_mask) if m]
+        self.timesteps = [
+            i for i, m in zip(self.timesteps, traj_len_mask) if m
+        ]
+        self.traj_lens = self.traj_lens[traj_len_mask]
+        # start of each trajectory in the packed buffers (empty ones take no space)
+        self.traj_starts = np.cumsum(self.traj_lens) - self.traj_lens
+
+        self.num_timesteps = sum(self.traj_lens)
+        self.num_trajectories = len(self.states)
+
+        self.state_dim = list(self.states[0][0].shape)
+        self.act_dim = list(self.actions[0][0].shape)
+        self.max_ep_len = max([len(i) for i in self.states])
+        self.metadata = data["metadata"]
+
+        self.indices = self.get_indices_of_top_p_trajectories(self.pct_traj)
+        self.sampling_probabilities = self.get_sampling_probabilities()
+
+        if self.normalize_state:
+            self.state_mean, self.state_std = self.get_state_mean_std()
+        else:
+            self.state_mean = 0
+            self.state_std = 1
+
+        # TODO Make this way less hacky
+        if self.preprocess_observations == one_hot_encode_observation:
+            self.observation_type = "one_hot"
+
+        if (
+            self.cache_preprocessed_observations
+            and self.preprocess_observations is not None
+        ):
+            self.preprocess_packed_states()
+
+    def preprocess_packed_states(self, chunk_size=65536) -> None:
+        """
+        Applies preprocess_observations once to every state, instead of to every
+        sampled window, and drops it from __getitem__. States are kept as uint8
+        when that is lossless (as for one-hot encodings).
+        """
+        assert (
+            not self.normalize_state
+        ), "Can't cache preprocessed observations with state normalization."
+
+        states = self.packed["states"]
+        processed = np.concatenate(
+            [
+                compact_observations(
+                    self.preprocess_observations(
+                        torch.from_numpy(np.array(states[i : i + chunk_size]))
+                    ).numpy()
+                )
+                for i in range(0, len(states), chunk_size)
+            ]
+        )
+
+        self.packed["states"] = processed
+        t_processed = torch.from_numpy(processed)
+        self.states = [
+            t_processed[start : start + length]
+            for start, length in zip(self.traj_starts, self.traj_lens)
+        ]
+        self.state_dim = list(processed.shape[1:])
+        self.preprocess_observations = None
+
+    def split_trajectories(self, data: dict) -> None:
+        """Splits (t, b) arrays read from a pickled trajectory file into episodes."""
+        observations = data.get("observations")
+        actions = data.get("actions")
+        rewards = data.get("rewards")
+        dones = data.get("dones")
+        truncated = data.get("truncated")
+        infos = data.get("infos")
+
+        # older files store float observations, kept as uint8 in memory
+        observations = compact_observations(observations)
         actions = np.array(actions)
         rewards = np.array(rewards)
         dones = np.array(dones)
@@ -112,45 +227,60 @@ class TrajectoryDataset(Dataset):
         self.dones = torch.tensor_split(t_dones, done_indices + 1)
         self.truncated = torch.tensor_split(t_truncated, done_indices + 1)
         self.states = torch.tensor_split(t_observations, done_indices + 1)
-        self.returns = [r.sum() for r in self.rewards]
-        self.timesteps = [torch.arange(len(i)) for i in self.states]
-        self.traj_lens = np.array([len(i) for i in self.states])
 
-        # remove trajs with length 0
-        traj_len_mask = self.traj_lens > 0
-        self.actions = [i for i, m in zip(self.actions, traj_len_mask) if m]
-        self.rewards = [i for i, m in zip(self.rewards, traj_len_mask) if m]
-        self.dones = [i for i, m in zip(self.dones, traj_len_mask) if m]
-        self.truncated = [
-            i for i, m in zip(self.truncated, traj_len_mask) if m
-        ]
-        self.states = [i for i, m in zip(self.states, traj_len_mask) if m]
-        self.returns = [i for i, m in zip(self.returns, traj_len_mask) if m]
-        self.timesteps = [
-            i for i, m in zip(self.timesteps, traj_len_mask) if m
-        ]
-        self.traj_lens = self.traj_lens[traj_len_mask]
+        # the episodes above are views of these contiguous buffers
+        self.packed = {
+            "states": t_observations.numpy(),
+            "actions": t_actions.numpy(),
+            "rewards": t_rewards.numpy(),
+            "dones": t_dones.numpy(),
+        }
 
-        self.num_timesteps = sum(self.traj_lens)
-        self.num_trajectories = len(self.states)
-
-        self.state_dim = list(self.states[0][0].shape)
-        self.act_dim = list(self.actions[0][0].shape)
-        self.max_ep_len = max([len(i) for i in self.states])
-        self.metadata = data["metadata"]
+    def split_columnar_trajectories(self, data: dict) -> None:
+        """
+        Splits the columns of a columnar trajectory directory into episodes.
 
-        self.indices = self.get_indices_of_top_p_trajectories(self.pct_traj)
-        self.sampling_probabilities = self.get_sampling_probabilities()
+        Observations stay memory mapped, each episode is a tensor view of the
+        file, as split_trajectories returns for the pickle formats.
+        """
+        observations = data["observations"]
+        offsets = np.asarray(data["episode_offsets"])
 
-        if self.normalize_state:
-            self.state_mean, self.state_std = self.get_state_mean_std()
+        # check whether observations are flat or an image
+        if observations.shape[-1] == 3:
+            self.observation_type = "index"
+        elif observations.shape[-1] == 20:
+            self.observation_type = "one_hot"
         else:
-            self.state_mean = 0
-            self.state_std = 1
+            raise ValueError(
+                "Observations are not flat or images, check the shape of the observations: ",
+                observations.shape,
+            )
 
-        # TODO Make this way less hacky
-        if self.preprocess_observations == one_hot_encode_observation:
-            self.observation_type = "one_hot"
+        splits = torch.from_numpy(offsets[1:-1])
+        self.actions = torch.tensor_split(
+            torch.from_numpy(np.asarray(data["actions"])), splits
+        )
+        self.rewards = torch.tensor_split(
+            torch.from_numpy(np.asarray(data["rewards"])), splits
+        )
+        self.dones = torch.tensor_split(
+            torch.from_numpy(np.asarray(data["dones"])), splits
+        )
+        self.truncated = torch.tensor_split(
+            torch.from_numpy(np.asarray(data["truncated"])), splits
+        )
+        self.states = torch.tensor_split(
+            torch.from_numpy(observations), splits
+        )
+
+        # the episodes above are views of these contiguous buffers
+        self.packed = {
+            "states": observations,
+            "actions": np.asarray(data["actions"]),
+            "rewards": np.asarray(data["rewards"]),
+            "dones": np.asarray(data["dones"]),
+        }
 
     def get_indices_of_top_p_trajectories(self, pct_traj):
         num_timesteps = max(int(pct_traj * self.num_timesteps), 1)
@@ -204,35 +334,71 @@ class TrajectoryDataset(Dataset):
             p=self.sampling_probabilities,  # reweights so we sample according to timesteps
         )
 
-        # initialize np arrays not lists
-        states, actions, rewards, dones, rewards_to_gos, timesteps, mask = (
-            [],
-            [],
-            [],
-            [],
-            [],
-            [],
-            [],
+        return self.get_windows(
+            sorted_inds[batch_inds], max_len, prob_go_from_end=prob_go_from_end
         )
-        for i in range(batch_size):
-            # get the trajectory
-            traj_index = sorted_inds[batch_inds[i]]
 
-            s, a, r, d, rtg, ti, m = self.get_traj(
-                traj_index, max_len, prob_go_from_end=prob_go_from_end
-            )
+    def get_windows(
+        self, traj_indices, max_len=100, prob_go_from_end=None, end_indices=None
+    ):
+        """
+        Batched version of get_traj: samples a window from each trajectory and
+        gathers all of them from the packed buffers with one fancy index per field.
+
+        Args:
+        - traj_indices (array of int): the trajectories to sample windows from.
+        - max_len (int): the window length, shorter windows are left padded.
+        - prob_go_from_end (float, optional): probability of taking the last window of a trajectory.
+        - end_indices (array of int, optional): instead of sampling, take the windows ending at these timesteps of the trajectories.
+
+        Returns:
+        - (s, a, r, d, rtg, timesteps, mask) tensors with leading dimensions (batch, max_len).
+        """
+        traj_indices = np.asarray(traj_indices)
+        lens = self.traj_lens[traj_indices]
+        starts = self.traj_starts[traj_indices]
+        batch_size = len(traj_indices)
+
+        if end_indices is not None:
+            end_indices = np.asarray(end_indices)
+            si = np.maximum(end_indices - max_len + 1, 0)
+            tlen = end_indices - si + 1
+        else:
+            # start index
+            si = np.floor(np.random.random(batch_size) * lens).astype(np.int64)
+            if prob_go_from_end is not None:
+                from_end = np.random.random(batch_size) < prob_go_from_end
+                si = np.where(from_end, np.maximum(lens - max_len, 0), si)
+            tlen = np.minimum(lens - si, max_len)
+
+        # windows are left padded up to max_len, offsets < 0 are padding
+        offsets = np.arange(max_len)[None, :] - (max_len - tlen)[:, None]
+        m = offsets >= 0
+        offsets = np.where(m, offsets, 0)
+        flat = starts[:, None] + si[:, None] + offsets
+
+        states = self.packed["states"]
+        s = np.asarray(states[flat.reshape(-1)]).reshape(
+            batch_size, max_len, *self.state_dim
+        )
+        s = s * m.reshape(batch_size, max_len, *[1] * len(self.state_dim))
+        a = np.where(m, self.packed["actions"][flat], -10)
+        r = np.where(m, self.packed["rewards"][flat], 0)[..., None]
+        d = np.where(m, self.packed["dones"][flat], 2)
+        ti = np.where(m, si[:, None] + offsets, 0)
 
-            rewards.append(r)
-            actions.append(a)
-            states.append(s)
-            dones.append(d)
-            rewards_to_gos.append(rtg)
-            mask.append(m)
-            timesteps.append(ti)
+        # TODO: configure this so non-sparse tasks are dealt with correctly!
+        # rtg (padding included) is the final reward of the trajectory
+        last_rewards = self.packed["rewards"][starts + lens - 1]
+        rtg = np.broadcast_to(
+            last_rewards[:, None, None], (batch_size, max_len, 1)
+        ).copy()
 
-        return self.return_tensors(
-            states, actions, rewards, rewards_to_gos, dones, timesteps, mask
-        )
+        # state + reward normalization
+        s = (s - self.state_mean) / self.state_std
+        rtg = rtg / self.rtg_scale
+
+        return self.return_tensors(s, a, r, rtg, d, ti, m, squeeze=False)
 
     def get_traj(self, traj_index, max_len=100, prob_go_from_end=None):
         traj_rewards = self.rewards[traj_index]
@@ -295,7 +461,7 @@ class TrajectoryDataset(Dataset):
             )
         return tokens
 
-    def return_tensors(self, s, a, r, rtg, d, timesteps, mask):
+    def return_tensors(self, s, a, r, rtg, d, timesteps, mask, squeeze=True):
         if isinstance(s, torch.Tensor):
             s = s.to(dtype=torch.float32, device=self.device)
         else:
@@ -327,6 +493,9 @@ class TrajectoryDataset(Dataset):
         )
         mask = torch.from_numpy(mask).to(dtype=torch.bool, device=self.device)
 
+        if not squeeze:
+            return s, a, r, d, rtg, timesteps, mask
+
         # squeeze out the batch dimension
         s = s.squeeze(0)
         a = a.squeeze(0)
@@ -343,6 +512,18 @@ class TrajectoryDataset(Dataset):
         return len(self.indices)
 
     def __getitem__(self, idx):
+        # a list of indices (e.g. from a BatchSampler) is gathered in one go
+        if isinstance(idx, (list, np.ndarray, torch.Tensor)):
+            s, a, r, d, rtg, ti, m = self.get_windows(
+                self.indices[np.asarray(idx)],
+                max_len=self.max_len,
+                prob_go_from_end=self.prob_go_from_end,
+            )
+            if self.preprocess_observations is not None:
+                processed = self.preprocess_observations(s.flatten(0, 1))
+                s = processed.reshape(*s.shape[:2], *processed.shape[1:])
+            return s, a, r, d, rtg, ti, m
+
         traj_index = self.indices[idx]
         s, a, r, d, rtg, ti, m = self.get_traj(
             traj_index,
@@ -405,26 +586,20 @@ class TrajectoryVisualizer:
 
 
 def one_hot_encode_observation(img: torch.Tensor) -> torch.Tensor:
-    """Converts a batch of observations into one-hot encoded numpy arrays."""
-
-    img = img.to(int).numpy()
-    batch_size, height, width, num_channels = img.shape
-    num_bits = 20
-    new_observation_space = (batch_size, height, width, num_bits)
-
-    out = np.zeros(new_observation_space, dtype="uint8")
-
-    for b in range(batch_size):
-        for i in range(height):
-            for j in range(width):
-                value = img[b, i, j, 0]
-                color = img[b, i, j, 1]
-                state = img[b, i, j, 2]
-
-                out[b, i, j, value] = 1
-                out[b, i, j, len(OBJECT_TO_IDX) + color] = 1
-                out[
-                    b, i, j, len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + state
-                ] = 1
+    """
+    Converts a batch of (object, color, state) observations into 20 channel
+    one-hot encodings.
 
-    return torch.from_numpy(out).float()
+    Works on any leading dimensions and stays on the device of img, so it can
+    also be applied to batches already on the GPU.
+    """
+    img = torch.as_tensor(img).long()
+    offsets = torch.tensor(
+        [0, len(OBJECT_TO_IDX), len(OBJECT_TO_IDX) + len(COLOR_TO_IDX)],
+        device=img.device,
+    )
+    num_bits = len(OBJECT_TO_IDX) + len(COLOR_TO_IDX) + len(STATE_TO_IDX)
+
+    out = torch.zeros(*img.shape[:-1], num_bits, device=img.device)
+    out.scatter_(-1, img + offsets, 1.0)
+    return out
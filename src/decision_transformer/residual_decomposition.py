@@ -0,0 +1,231 @@
+"""
+Residual decompositions of every state of a trajectory dataset.
+
+residual_decomposition computes the contribution of every residual stream
+component (input tokens, position embedding, each attention head and
+attention bias, each mlp) to a logit direction for a whole batch at once;
+get_residual_decomp in the streamlit app is built on it. Over a dataset,
+each state is the last token of the window ending at it.
+
+Results are written to a directory of chunks, each a .npz file with one
+column per component (named as in get_residual_decomp), the total (the
+output projected on the logit direction, which the components sum to unless
+the model has layer norm) and the trajectory, timestep and state index of
+every row:
+
+    chunk_00000.npz
+    chunk_00001.npz
+    ...
+    metadata.json   the model, dataset, logit direction and chunk size
+
+Chunks are written atomically and existing ones are skipped, so an
+interrupted run can be resumed with the same arguments.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import torch as t
+from tqdm import tqdm
+
+from .offline_dataset import TrajectoryDataset
+
+METADATA = "metadata.json"
+
+# the activations residual_decomposition reads, as hook name suffixes
+RESIDUAL_DECOMP_SPEC = (
+    "hook_pos_embed",
+    "blocks.0.hook_resid_pre",
+    "attn.hook_z",
+    "hook_mlp_out",
+)
+
+
+def chunk_path(output_dir, chunk):
+    return os.path.join(output_dir, f"chunk_{chunk:05d}.npz")
+
+
+def residual_component_names(dt):
+    """Returns the names of the components residual_decomposition returns, in order."""
+    names = ["input_tokens", "hook_pos_embed"]
+    for layer in range(dt.transformer_config.n_layers):
+        names += [
+            f"blocks.{layer}.attn.hook_z.{head}"
+            for head in range(dt.transformer_config.n_heads)
+        ]
+        names.append(f"transformer.blocks.{layer}.attn.b_O")
+        names.append(f"blocks.{layer}.hook_mlp_out")
+    return names
+
+
+def residual_decomposition(dt, cache, logit_dir, seq_pos=-1):
+    """
+    Returns the contribution of every residual component to logit_dir at
+    seq_pos, for every element of the batch.
+
+    Args:
+    - dt: the model.
+    - cache (ActivationCache): a cache of (at least) the hooks in RESIDUAL_DECOMP_SPEC.
+    - logit_dir (t.Tensor): (d_model) the direction to project on.
+    - seq_pos (int): the position to decompose.
+
+    Returns:
+    - t.Tensor: (batch, component) contributions, with the components in the order of residual_component_names.
+    """
+    pos_embed = cache["hook_pos_embed"][:, seq_pos]
+    contributions = [
+        (cache["blocks.0.hook_resid_pre"][:, seq_pos] - pos_embed)
+        @ logit_dir,
+        pos_embed @ logit_dir,
+    ]
+    batch_size = pos_embed.shape[0]
+    for layer, block in enumerate(dt.transformer.blocks):
+        z = cache[f"blocks.{layer}.attn.hook_z"][:, seq_pos]
+        # (batch, head): each head's output projected on logit_dir
+        contributions.append(
+            t.einsum("bhd,hdm,m->bh", z, block.attn.W_O, logit_dir)
+        )
+        contributions.append(
+            (block.attn.b_O @ logit_dir).expand(batch_size)
+        )
+        contributions.append(
+            cache[f"blocks.{layer}.hook_mlp_out"][:, seq_pos] @ logit_dir
+        )
+    return t.cat(
+        [c[:, None] if c.ndim == 1 else c for c in contributions], dim=1
+    )
+
+
+def get_state_tokens(dt, dataset, state_indices, action_pad_token):
+    """
+    Returns the tokens of the windows ending at the given states, indexed
+    across all the trajectories of dataset (in its packed order).
+    """
+    traj_indices = (
+        np.searchsorted(dataset.traj_starts, state_indices, side="right") - 1
+    )
+    end_indices = state_indices - dataset.traj_starts[traj_indices]
+    s, a, r, d, rtg, ti, m = dataset.get_windows(
+        traj_indices, max_len=dataset.max_len, end_indices=end_indices
+    )
+    if dataset.preprocess_observations is not None:
+        processed = dataset.preprocess_observations(s.flatten(0, 1))
+        s = processed.reshape(*s.shape[:2], *processed.shape[1:])
+
+    if dt.transformer_config.time_embedding_type == "linear":
+        ti = ti.to(t.float32)
+    a[a == -10] = action_pad_token
+    actions = a[:, :-1].unsqueeze(-1) if a.shape[1] > 1 else None
+    if dt.model_type == "decision_transformer":
+        tokens = dt.get_window_tokens(s, actions, rtg, ti.unsqueeze(-1))
+    else:
+        tokens = dt.get_window_tokens(s, actions, ti.unsqueeze(-1))
+    return tokens, traj_indices, end_indices
+
+
+def write_chunk(output_dir, chunk, columns):
+    """Writes a chunk atomically, so a chunk file is always complete."""
+    path = chunk_path(output_dir, chunk)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **columns)
+    os.replace(tmp_path, path)
+
+
+def decompose_dataset(
+    dt,
+    dataset: TrajectoryDataset,
+    logit_dir: t.Tensor,
+    output_dir: str,
+    metadata: dict,
+    chunk_size: int = 65536,
+    batch_size: int = 1024,
+    use_tqdm: bool = True,
+):
+    """
+    Writes the residual decomposition of every state of dataset to output_dir.
+
+    Args:
+    - dt: the model, on the device of dataset.
+    - dataset (TrajectoryDataset): the states to decompose, with max_len matching the model.
+    - logit_dir (t.Tensor): (d_model) the direction to project on.
+    - output_dir (str): the chunk directory, existing chunks are kept.
+    - metadata (dict): describes the run, a rerun into the same directory must have the same metadata.
+    - chunk_size (int): the number of states per chunk.
+    - batch_size (int): the number of states per forward pass.
+    - use_tqdm (bool): show a progress bar over the chunks.
+    """
+    names = residual_component_names(dt)
+    # as read back from metadata.json
+    metadata = json.loads(
+        json.dumps(dict(metadata, chunk_size=chunk_size, components=names))
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    metadata_path = os.path.join(output_dir, METADATA)
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            existing = json.load(f)
+        assert (
+            existing == metadata
+        ), f"{output_dir} holds the decomposition of a different run"
+    else:
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f)
+
+    num_states = int(dataset.num_timesteps)
+    num_chunks = -(-num_states // chunk_size)
+    todo = [
+        c
+        for c in range(num_chunks)
+        if not os.path.exists(chunk_path(output_dir, c))
+    ]
+    action_pad_token = dt.environment_config.action_space.n
+
+    dt.eval()
+    for chunk in tqdm(todo, disable=not use_tqdm):
+        start = chunk * chunk_size
+        stop = min(start + chunk_size, num_states)
+        contributions, totals, trajs, timesteps = [], [], [], []
+        for lo in range(start, stop, batch_size):
+            state_indices = np.arange(lo, min(lo + batch_size, stop))
+            with t.no_grad():
+                tokens, traj_indices, end_indices = get_state_tokens(
+                    dt, dataset, state_indices, action_pad_token
+                )
+                x, cache = dt.transformer.run_with_cache(
+                    tokens,
+                    names_filter=lambda name: name.endswith(
+                        RESIDUAL_DECOMP_SPEC
+                    ),
+                )
+                contributions.append(
+                    residual_decomposition(dt, cache, logit_dir).cpu()
+                )
+                totals.append((x[:, -1] @ logit_dir).cpu())
+            trajs.append(traj_indices)
+            timesteps.append(end_indices)
+
+        contributions = t.cat(contributions).numpy()
+        columns = {
+            name: contributions[:, i] for i, name in enumerate(names)
+        }
+        columns["total"] = t.cat(totals).numpy()
+        columns["state_index"] = np.arange(start, stop)
+        columns["trajectory"] = np.concatenate(trajs)
+        columns["timestep"] = np.concatenate(timesteps)
+        write_chunk(output_dir, chunk, columns)
+
+
+def read_residual_decomposition(output_dir: str) -> pd.DataFrame:
+    """Reads the chunks written by decompose_dataset into one DataFrame."""
+    chunks = sorted(
+        f
+        for f in os.listdir(output_dir)
+        if f.startswith("chunk_") and f.endswith(".npz")
+    )
+    frames = []
+    for file in chunks:
+        with np.load(os.path.join(output_dir, file)) as columns:
+            frames.append(pd.DataFrame({k: columns[k] for k in columns}))
+    return pd.concat(frames, ignore_index=True)
@@ -26,8 +26,14 @@ from .offline_dataset import (
     TrajectoryVisualizer,
     one_hot_encode_observation,
 )
+from src.utils.compilation import compile_module
+
 from .train import train
-from .utils import get_max_len_from_model_type
+from .utils import (
+    get_example_inputs,
+    get_max_len_from_model_type,
+    serialize_environment_spaces,
+)
 
 
 def run_decision_transformer(
@@ -74,6 +80,7 @@ def run_decision_transformer(
         prob_go_from_end=offline_config.prob_go_from_end,
         device=device,
         preprocess_observations=preprocess_observations,
+        cache_preprocessed_observations=offline_config.cache_preprocessed_observations,
     )
 
     # ensure all the environments we need are registered
@@ -133,6 +140,14 @@ def run_decision_transformer(
             transformer_config=transformer_config,
         )
 
+    if offline_config.compile_mode != "none":
+        model = model.to(device)
+        model = compile_module(
+            model,
+            offline_config.compile_mode,
+            get_example_inputs(model, offline_config.batch_size, max_len),
+        )
+
     if run_config.track:
         wandb.watch(model, log="parameters")
 
@@ -154,6 +169,10 @@ def run_decision_transformer(
         initial_rtg=offline_config.initial_rtg,
         eval_max_time_steps=offline_config.eval_max_time_steps,
         eval_num_envs=offline_config.eval_num_envs,
+        num_workers=offline_config.num_workers,
+        persistent_workers=offline_config.persistent_workers,
+        prefetch_factor=offline_config.prefetch_factor,
+        pin_memory=offline_config.pin_memory,
     )
 
     if run_config.track:
@@ -189,6 +208,9 @@ def store_transformer_model(path, model, offline_config):
             "environment_config": json.dumps(
                 model.environment_config, cls=ConfigJsonEncoder
             ),
+            "environment_spaces": serialize_environment_spaces(
+                model.environment_config
+            ),
             "model_config": json.dumps(
                 model.transformer_config, cls=ConfigJsonEncoder
             ),
@@ -1,9 +1,10 @@
+import numpy as np
 import pytest
 import torch as t
 import torch.nn as nn
 from einops import rearrange
 from torch.utils.data import DataLoader, random_split
-from torch.utils.data.sampler import WeightedRandomSampler
+from torch.utils.data.sampler import BatchSampler, WeightedRandomSampler
 from tqdm import tqdm
 
 import wandb
@@ -18,6 +19,36 @@ from .offline_dataset import TrajectoryDataset
 from .eval import evaluate_dt_agent
 
 
+def seed_worker(worker_id):
+    """Seeds numpy in each dataloader worker, so workers sample different windows."""
+    np.random.seed(t.initial_seed() % 2**32)
+
+
+def get_dataloader_kwargs(
+    num_workers=0, persistent_workers=False, prefetch_factor=2, pin_memory=False
+):
+    """
+    Returns the DataLoader arguments of the data pipeline. With workers,
+    batches are sampled in other processes and prefetch_factor batches per
+    worker are prepared while the model trains.
+    """
+    kwargs = {"num_workers": num_workers, "pin_memory": pin_memory}
+    if num_workers > 0:
+        kwargs.update(
+            persistent_workers=persistent_workers,
+            prefetch_factor=prefetch_factor,
+            worker_init_fn=seed_worker,
+        )
+    return kwargs
+
+
+def batch_to_device(batch, device, non_blocking=False):
+    """Moves the tensors of a batch to device (a no-op if they're already there or device is None)."""
+    if device is None:
+        return tuple(batch)
+    return tuple(x.to(device, non_blocking=non_blocking) for x in batch)
+
+
 def train(
     model: TrajectoryTransformer,
     trajectory_data_set: TrajectoryDataset,
@@ -36,6 +67,10 @@ def train(
     initial_rtg=[0.0, 1.0],
     eval_max_time_steps=100,
     eval_num_envs=8,
+    num_workers=0,
+    persistent_workers=False,
+    prefetch_factor=2,
+    pin_memory=False,
 ):
     loss_fn = nn.CrossEntropyLoss()
     model = model.to(device)
@@ -43,6 +78,15 @@ def train(
         model.parameters(), lr=lr, weight_decay=weight_decay
     )
 
+    # workers and pinned memory need batches built on the cpu, they are
+    # moved to the device in the training loop instead
+    pin_memory = pin_memory and t.device(device).type == "cuda"
+    if num_workers > 0 or pin_memory:
+        trajectory_data_set.device = t.device("cpu")
+    loader_kwargs = get_dataloader_kwargs(
+        num_workers, persistent_workers, prefetch_factor, pin_memory
+    )
+
     train_dataset, test_dataset = random_split(
         trajectory_data_set, [0.90, 0.10]
     )
@@ -55,8 +99,12 @@ def train(
         num_samples=len(train_dataset),
         replacement=True,
     )
+    # the dataset gathers a whole batch of indices at once, so no collation is needed
     train_dataloader = DataLoader(
-        train_dataset, batch_size=batch_size, sampler=train_sampler
+        train_dataset,
+        batch_size=None,
+        sampler=BatchSampler(train_sampler, batch_size, drop_last=False),
+        **loader_kwargs,
     )
 
     # Create the test DataLoader
@@ -68,14 +116,20 @@ def train(
         replacement=True,
     )
     test_dataloader = DataLoader(
-        test_dataset, batch_size=batch_size, sampler=test_sampler
+        test_dataset,
+        batch_size=None,
+        sampler=BatchSampler(test_sampler, batch_size, drop_last=False),
+        **loader_kwargs,
     )
 
     train_batches_per_epoch = len(train_dataloader)
     pbar = tqdm(range(train_epochs))
     for epoch in pbar:
-        for batch, (s, a, r, d, rtg, ti, m) in enumerate(train_dataloader):
+        for batch, data in enumerate(train_dataloader):
             total_batches = epoch * train_batches_per_epoch + batch
+            s, a, r, d, rtg, ti, m = batch_to_device(
+                data, device, non_blocking=pin_memory
+            )
 
             model.train()
 
@@ -139,6 +193,8 @@ def train(
                 epochs=test_epochs,
                 track=track,
                 batch_number=total_batches,
+                device=device,
+                non_blocking=pin_memory,
             )
 
         eval_env_config = EnvironmentConfig(
@@ -186,6 +242,8 @@ def test(
     epochs=10,
     track=False,
     batch_number=0,
+    device=None,
+    non_blocking=False,
 ):
     model.eval()
 
@@ -199,7 +257,10 @@ def test(
     test_batches_per_epoch = len(dataloader)
 
     for epoch in pbar:
-        for batch, (s, a, r, d, rtg, ti, m) in enumerate(dataloader):
+        for batch, data in enumerate(dataloader):
+            s, a, r, d, rtg, ti, m = batch_to_device(
+                data, device, non_blocking=non_blocking
+            )
             if model.transformer_config.time_embedding_type == "linear":
                 ti = ti.to(t.float32)
 
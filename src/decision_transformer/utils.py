@@ -1,5 +1,6 @@
 import argparse
 import json
+import pickle
 
 import torch as t
 
@@ -11,6 +12,8 @@ from src.models.trajectory_transformer import (
     DecisionTransformer,
     CloneTransformer,
 )
+from src.utils.compilation import COMPILE_MODES
+from src.utils.space_serialization import space_from_dict, space_to_dict
 
 
 def parse_args():
@@ -56,6 +59,39 @@ def parse_args():
     parser.add_argument("--eval_frequency", type=int, default=100)
     parser.add_argument("--eval_episodes", type=int, default=10)
     parser.add_argument("--eval_num_envs", type=int, default=8)
+    parser.add_argument(
+        "--compile_mode",
+        type=str,
+        default="none",
+        choices=COMPILE_MODES,
+        help="compile the model's forward with torch.compile or TorchScript, falling back to eager if that fails",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=0,
+        help="number of dataloader worker processes sampling batches, 0 samples in the training process",
+    )
+    parser.add_argument(
+        "--persistent_workers",
+        type=bool,
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="keep the dataloader workers alive between epochs",
+    )
+    parser.add_argument(
+        "--prefetch_factor",
+        type=int,
+        default=2,
+        help="number of batches each dataloader worker prepares ahead",
+    )
+    parser.add_argument(
+        "--pin_memory",
+        type=bool,
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="sample batches into pinned memory and copy them to the gpu asynchronously",
+    )
     parser.add_argument(
         "--initial_rtg",
         action="append",
@@ -75,23 +111,73 @@ def parse_args():
         default=False,
         action=argparse.BooleanOptionalAction,
     )
+    parser.add_argument(
+        "--cache_preprocessed_observations",
+        type=bool,
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="preprocess (e.g. one-hot encode) all observations once at load instead of per batch",
+    )
     args = parser.parse_args()
     return args
 
 
+def load_checkpoint(model_path) -> dict:
+    """
+    Loads a checkpoint onto the cpu, memory mapping its tensors and
+    refusing arbitrary pickled objects where torch supports it.
+    """
+    try:
+        return t.load(
+            model_path, map_location="cpu", weights_only=True, mmap=True
+        )
+    except (TypeError, RuntimeError, pickle.UnpicklingError):
+        # older torch (no mmap), a checkpoint in the legacy format or one
+        # holding more than tensors and strings
+        return t.load(model_path, map_location="cpu")
+
+
+def serialize_environment_spaces(environment_config) -> str:
+    """
+    Returns the spaces of environment_config as JSON, so a checkpoint can be
+    loaded without making its environment (see load_decision_transformer).
+    """
+    return json.dumps(
+        {
+            "observation_space": space_to_dict(
+                environment_config.observation_space
+            ),
+            "action_space": space_to_dict(environment_config.action_space),
+        }
+    )
+
+
 # TODO Support loading Clone Transformers
 def load_decision_transformer(model_path, env=None) -> DecisionTransformer:
-    """ """
+    """
+    Loads a decision transformer checkpoint onto the cpu. If the checkpoint
+    holds its environment's spaces, no environment is made.
+    """
 
-    model_info = t.load(model_path)
+    model_info = load_checkpoint(model_path)
     state_dict = model_info["model_state_dict"]
     transformer_config = TransformerModelConfig(
         **json.loads(model_info["model_config"])
     )
 
-    environment_config = EnvironmentConfig(
-        **json.loads(model_info["environment_config"])
-    )
+    spaces = {}
+    if "environment_spaces" in model_info:
+        spaces = {
+            name: space_from_dict(description)
+            for name, description in json.loads(
+                model_info["environment_spaces"]
+            ).items()
+        }
+    environment_config = json.loads(model_info["environment_config"])
+    # ConfigJsonEncoder stores the spaces as null
+    for name in spaces:
+        environment_config.pop(name, None)
+    environment_config = EnvironmentConfig(**environment_config, **spaces)
 
     model = DecisionTransformer(
         environment_config=environment_config,
@@ -198,3 +284,37 @@ def initialize_padding_inputs(
     ).to(device)
 
     return obs, actions, reward, rtg, timesteps, mask
+
+
+def get_example_inputs(model, batch_size: int, max_len: int) -> tuple:
+    """
+    Returns zero inputs of the shapes and dtypes forward gets during training,
+    e.g. to warm up a compiled model.
+
+    Returns:
+    - tuple: (states, actions, rtgs, timesteps) for a DecisionTransformer, (states, actions, timesteps) for a CloneTransformer.
+    """
+    device = next(model.parameters()).device
+    observation_space = model.environment_config.observation_space
+    obs_shape = (
+        observation_space["image"].shape
+        if "image" in getattr(observation_space, "spaces", {})
+        else observation_space.shape
+    )
+    states = t.zeros((batch_size, max_len, *obs_shape), device=device)
+    actions = (
+        t.zeros((batch_size, max_len - 1, 1), dtype=t.long, device=device)
+        if max_len > 1
+        else None
+    )
+    timesteps = t.zeros(
+        (batch_size, max_len, 1),
+        dtype=t.float32
+        if model.transformer_config.time_embedding_type == "linear"
+        else t.long,
+        device=device,
+    )
+    if isinstance(model, DecisionTransformer):
+        rtgs = t.zeros((batch_size, max_len, 1), device=device)
+        return states, actions, rtgs, timesteps
+    return states, actions, timesteps
@@ -16,6 +16,12 @@ def make_env(config: EnvironmentConfig, seed: int, idx: int, run_name: str, targ
     ), "Can't have both fully_observed and flat_one_hot."
 
     def thunk():
+        if config.env_id not in gym.envs.registry:
+            # subprocess workers started with spawn don't inherit the registry
+            from .registration import register_envs
+
+            register_envs()
+
         kwargs = {}
         if config.render_mode:
             kwargs["render_mode"] = config.render_mode
@@ -52,3 +58,62 @@ def make_env(config: EnvironmentConfig, seed: int, idx: int, run_name: str, targ
         return env
 
     return thunk
+
+
+def make_vector_env(config: EnvironmentConfig, env_fns) -> gym.vector.VectorEnv:
+    """
+    Return a vectorized environment of the type selected by config.vector_env.
+
+    - sync: every environment is stepped serially in this process.
+    - async: every environment is stepped in its own subprocess, observations
+      are pickled back through a pipe.
+    - shared_memory: every environment is stepped in its own subprocess and
+      writes its observation into shared memory. The returned observations
+      are views of that memory (no copy), so they are only valid until the
+      next call to step or reset.
+
+    Args:
+    - config (EnvironmentConfig): the environment config.
+    - env_fns (list): thunks returning the environments, see make_env.
+    """
+    if config.vector_env == "sync":
+        return gym.vector.SyncVectorEnv(env_fns)
+    if config.vector_env == "async":
+        return gym.vector.AsyncVectorEnv(env_fns, shared_memory=False)
+    if config.vector_env == "shared_memory":
+        return gym.vector.AsyncVectorEnv(
+            env_fns, shared_memory=True, copy=False
+        )
+    raise ValueError(f"Unknown vector_env: {config.vector_env}")
+
+
+class LazyVectorEnv:
+    """
+    Stands in for make_vector_env(config, env_fns) until the environments are
+    used. The observation and action spaces are read from one environment, so
+    agents can be built (e.g. to inspect a checkpoint) without starting all
+    of them; any other attribute, like reset or step, builds the vector env
+    first.
+    """
+
+    def __init__(self, config: EnvironmentConfig, env_fns):
+        self.config = config
+        self.env_fns = env_fns
+        self.num_envs = len(env_fns)
+        self.vector_env = None
+        env = env_fns[0]()
+        self.single_observation_space = env.observation_space
+        self.single_action_space = env.action_space
+        env.close()
+
+    def __getattr__(self, name):
+        # only called for attributes not set in __init__
+        if name.startswith("__") or "env_fns" not in self.__dict__:
+            raise AttributeError(name)
+        if self.vector_env is None:
+            self.vector_env = make_vector_env(self.config, self.env_fns)
+        return getattr(self.vector_env, name)
+
+    def close(self, **kwargs):
+        if self.vector_env is not None:
+            self.vector_env.close(**kwargs)
@@ -21,7 +21,7 @@ from src.config import (
     RunConfig,
     TransformerModelConfig,
 )
-from src.environments.environments import make_env
+from src.environments.environments import make_env, make_vector_env
 from src.environments.registration import register_envs
 from src.ppo.train import train_ppo
 from src.ppo.utils import set_global_seeds
@@ -66,7 +66,8 @@ def test_runner(
     target_type = target_types[0]
     target_color = target_colors[0]
     
-    envs = gym.vector.SyncVectorEnv(
+    envs = make_vector_env(
+        environment_config,
         [
             make_env(
                 config=environment_config,
@@ -79,8 +80,7 @@ def test_runner(
         ]
     )
     
-    for env in envs.envs:
-        env.switch_target(target_type, target_color)
+    envs.call("switch_target", target_type, target_color)
     
     # evaluation rollouts here
     
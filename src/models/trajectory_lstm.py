@@ -14,6 +14,7 @@ from torch.distributions.categorical import Categorical
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 
 from src.config import EnvironmentConfig, LSTMModelConfig
+from src.utils.dictlist import DictList
 
 # This is from BabyAI, not sure why we need it yet.
 # dictionary that defines what head is required for each extra info used for auxiliary supervision
@@ -379,23 +380,7 @@ class TrajectoryLSTM(nn.Module):
             attention = F.softmax(pre_softmax, dim=1)
             instr_embedding = (instr_embedding * attention[:, :, None]).sum(1)
 
-        if "simple" not in self.arch:  # batch of 2D images
-            x = torch.transpose(torch.transpose(obs.image, 1, 3), 2, 3)
-
-            if "pixel" in self.arch:
-                x /= 256.0
-            x = self.image_conv(x)
-            if self.use_instr:
-                for controller in self.controllers:
-                    out = controller(x, instr_embedding)
-                    if self.res:
-                        out += x
-                    x = out
-
-            x = F.relu(self.film_pool(x))
-            x = x.reshape(x.shape[0], -1)
-        else:
-            x = self.simple_embedding(obs.image)
+        x = self.get_image_embedding(obs, instr_embedding)
 
         if self.use_memory:
             hidden = (
@@ -432,6 +417,84 @@ class TrajectoryLSTM(nn.Module):
             "extra_predictions": extra_predictions,
         }
 
+    def get_image_embedding(self, obs, instr_embedding=None):
+        if "simple" not in self.arch:  # batch of 2D images
+            x = torch.transpose(torch.transpose(obs.image, 1, 3), 2, 3)
+
+            if "pixel" in self.arch:
+                x /= 256.0
+            x = self.image_conv(x)
+            if self.use_instr:
+                for controller in self.controllers:
+                    out = controller(x, instr_embedding)
+                    if self.res:
+                        out += x
+                    x = out
+
+            x = F.relu(self.film_pool(x))
+            x = x.reshape(x.shape[0], -1)
+        else:
+            x = self.simple_embedding(obs.image)
+        return x
+
+    def forward_sequence(self, obs, memory, mask):
+        """
+        Runs the model over sequences of observations in sequence-major layout,
+        equivalent to calling forward once per step with the memory masked.
+
+        The image embedding, actor and critic run once on all recurrence * batch
+        observations and only the memory LSTM cell steps through the sequence.
+        The memory is reset inside a sequence wherever an episode starts, which
+        a fused nn.LSTM can't do, so the cell is kept. With instructions the
+        embedding depends on the memory, so forward is called for each step.
+
+        Args:
+            obs: A DictList with image of shape (recurrence, batch, ...).
+            memory: The memory at the start of the sequences, of shape (batch, memory_size).
+            mask: A tensor of shape (recurrence, batch), 0 where the step starts an episode.
+
+        Returns:
+            A dict with the log-softmaxed logits (recurrence, batch, num_actions),
+            the value (recurrence, batch) and the memory after the last step.
+        """
+        recurrence, batch_size = mask.shape
+        if self.use_instr:
+            logits, values = [], []
+            for i in range(recurrence):
+                results = self.forward(obs[i], memory * mask[i].unsqueeze(1))
+                logits.append(results["dist"].logits)
+                values.append(results["value"])
+                memory = results["memory"]
+            return {
+                "logits": torch.stack(logits),
+                "value": torch.stack(values),
+                "memory": memory,
+            }
+
+        x = self.get_image_embedding(
+            DictList({"image": obs.image.flatten(0, 1)})
+        )
+        x = x.view(recurrence, batch_size, -1)
+
+        if self.use_memory:
+            embeddings = []
+            for i in range(recurrence):
+                memory = memory * mask[i].unsqueeze(1)
+                hidden = (
+                    memory[:, : self.semi_memory_size],
+                    memory[:, self.semi_memory_size :],
+                )
+                hidden = self.memory_rnn(x[i], hidden)
+                embeddings.append(hidden[0])
+                memory = torch.cat(hidden, dim=1)
+            embedding = torch.stack(embeddings)
+        else:
+            embedding = x
+
+        logits = F.log_softmax(self.actor(embedding), dim=-1)
+        value = self.critic(embedding).squeeze(-1)
+        return {"logits": logits, "value": value, "memory": memory}
+
     def _get_instr_embedding(self, instr):
         lengths = (instr != 0).sum(1).long()
         if self.lang_model == "gru":
@@ -132,6 +132,26 @@ class TrajectoryTransformer(nn.Module):
     def predict_actions(self, x):
         return self.action_predictor(x)
 
+    # Incremental inference, used when rolling out the model step by step
+    # (see src.ppo.transformer_rollout).
+    #
+    # The position embedding (PosEmbedTokens) is indexed from the start of the
+    # window, so once the window slides every token changes position and the
+    # keys and values of all layers change with it. Keys and values therefore
+    # can't be reused across steps; what can be reused are the token
+    # embeddings (state/action/rtg + time embedding), which don't depend on
+    # position. Only the tokens of the new timestep are embedded each step.
+
+    def predict_next_action(
+        self, window_tokens: TT["batch", "position", "d_model"]  # noqa: F821
+    ) -> TT["batch", "action"]:  # noqa: F821
+        """
+        Returns the action logits for the last token of a window, which is always
+        a state token. Equivalent to forward(...)[action_preds][:, -1].
+        """
+        x = self.transformer(window_tokens)
+        return self.predict_actions(x[:, -1])
+
     @abstractmethod
     def get_token_embeddings(
         self, state_embeddings, time_embeddings, action_embeddings, **kwargs
@@ -366,6 +386,13 @@ class DecisionTransformer(TrajectoryTransformer):
         )
         return token_embeddings
 
+    def get_window_tokens(self, states, actions, rtgs, timesteps):
+        """
+        Returns the token embeddings of a full window (R, s, a, ..., R, s), as
+        passed to the transformer by forward.
+        """
+        return self.to_tokens(states, actions, rtgs, timesteps)
+
     def get_action(self, states, actions, rewards, timesteps):
         state_preds, action_preds, reward_preds = self.forward(
             states, actions, rewards, timesteps
@@ -625,6 +652,43 @@ class CloneTransformer(TrajectoryTransformer):
 
         return state_preds, action_preds
 
+    def get_window_tokens(self, states, actions, timesteps):
+        """
+        Returns the token embeddings of a full window (s, a, ..., s), as passed
+        to the transformer by forward.
+        """
+        token_embeddings = self.to_tokens(states, actions, timesteps)
+        if actions is not None and actions.shape[1] == states.shape[1] - 1:
+            # to_tokens repeats the last action, forward drops it again
+            token_embeddings = token_embeddings[:, :-1]
+        return token_embeddings
+
+    def get_step_tokens(
+        self,
+        states: TT[...],  # noqa: F821
+        actions: TT["batch", 1],  # noqa: F821
+        timesteps: TT["batch", 1],  # noqa: F821
+        action_timesteps: TT["batch", 1],  # noqa: F821
+    ) -> TT["batch", 2, "d_model"]:  # noqa: F821
+        """
+        Returns the token embeddings (a, s) of one new timestep per batch
+        element: the action taken at the previous state and the state that
+        followed.
+
+        Args:
+        - states: (batch, *state_dim) the new states.
+        - actions: (batch, 1) the actions taken at the previous states.
+        - timesteps: (batch, 1) the timesteps of the new states.
+        - action_timesteps: (batch, 1) the timesteps of the previous states.
+        """
+        action_embeddings = self.get_action_embedding(
+            actions[:, None]
+        ) + self.get_time_embedding(action_timesteps[:, None])
+        state_embeddings = self.get_state_embedding(
+            states[:, None]
+        ) + self.get_time_embedding(timesteps[:, None])
+        return torch.cat([action_embeddings, state_embeddings], dim=1)
+
     def get_action(self, states, actions, timesteps):
         state_preds, action_preds = self.forward(states, actions, timesteps)
 
@@ -1,14 +1,17 @@
 import abc
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import Tuple, Optional
 
 import gymnasium as gym
 import numpy as np
+import pandas as pd
 import torch as t
 from torch import nn, optim
 from torch.distributions.categorical import Categorical
+from torch.nn import functional as F
 import math
 
 from src.config import (
@@ -18,12 +21,17 @@ from src.config import (
     RunConfig,
     TransformerModelConfig,
 )
-from src.environments.environments import make_env
+from src.environments.environments import (
+    LazyVectorEnv,
+    make_env,
+    make_vector_env,
+)
 from src.models.trajectory_lstm import TrajectoryLSTM
 from src.models.trajectory_transformer import (
     ActorTransformer,
     CriticTransfomer,
 )
+from src.utils.compilation import compile_function, compile_module
 from src.utils.dictlist import DictList
 from src.utils.trajectory_writer import TrajectoryWriter
 
@@ -33,9 +41,11 @@ from src.utils.sampling_methods import sample_from_categorical
 from .loss_functions import (
     calc_clipped_surrogate_objective,
     calc_entropy_bonus,
+    calc_ppo_objective,
     calc_value_function_loss,
 )
 from .memory import Memory, process_memory_vars_to_log
+from .transformer_rollout import TransformerRolloutContext
 from .utils import get_obs_shape
 
 import sys
@@ -85,7 +95,7 @@ class PPOAgent(nn.Module):
     actor: nn.Module
 
     @abc.abstractmethod
-    def __init__(self, envs: gym.vector.SyncVectorEnv, device):
+    def __init__(self, envs: gym.vector.VectorEnv, device):
         super().__init__()
         self.envs = envs
         self.device = device
@@ -151,25 +161,95 @@ class PPOAgent(nn.Module):
         return layer
 
 
+class FusedActorCritic:
+    """
+    Computes the logits and values of FCAgent's actor and critic in one pass.
+
+    Both networks read the same observation and their first two layers have
+    the same shapes, so these run as one matmul (first layer weights
+    concatenated) and one bmm (second layer weights stacked). The remaining
+    layers (the actor's third layer and head, the critic's head) differ in
+    shape and run on their own: 5 matmuls instead of 7.
+
+    The weights stay in actor and critic, so the state dict is the same as
+    without fusing. Outside of autograd the stacked weights are cached until
+    a parameter changes (tracked by their version counters), so a rollout
+    stacks them once per update.
+    """
+
+    def __init__(self, actor: nn.Sequential, critic: nn.Sequential):
+        self.actor_layers = [m for m in actor if isinstance(m, nn.Linear)]
+        self.critic_layers = [m for m in critic if isinstance(m, nn.Linear)]
+        assert (
+            len(self.actor_layers) == 4 and len(self.critic_layers) == 3
+        ), "FusedActorCritic expects FCAgent's actor and critic"
+        self.hidden_dim = self.actor_layers[0].out_features
+        self.cache = None
+        self.cache_versions = None
+
+    def parameter_versions(self):
+        return tuple(
+            p._version
+            for layer in self.actor_layers[:2] + self.critic_layers[:2]
+            for p in (layer.weight, layer.bias)
+        )
+
+    def stack_weights(self):
+        a1, a2 = self.actor_layers[:2]
+        c1, c2 = self.critic_layers[:2]
+        w1 = t.cat([a1.weight, c1.weight])
+        b1 = t.cat([a1.bias, c1.bias])
+        # bmm weights are (in, out)
+        w2 = t.stack([a2.weight, c2.weight]).transpose(1, 2)
+        b2 = t.stack([a2.bias, c2.bias])[:, None]
+        return w1, b1, w2, b2
+
+    def get_weights(self):
+        if t.is_grad_enabled():
+            self.cache = None
+            return self.stack_weights()
+        versions = self.parameter_versions()
+        if self.cache is None or self.cache_versions != versions:
+            self.cache = self.stack_weights()
+            self.cache_versions = versions
+        return self.cache
+
+    def __call__(self, obs: t.Tensor) -> Tuple[t.Tensor, t.Tensor]:
+        """
+        Returns the logits (batch, num_actions) and values (batch,) for obs.
+        """
+        w1, b1, w2, b2 = self.get_weights()
+        x = F.relu(F.linear(obs.flatten(1), w1, b1))
+        x = x.view(-1, 2, self.hidden_dim).transpose(0, 1)
+        x = F.relu(t.baddbmm(b2, x, w2))
+        values = self.critic_layers[2](x[1]).flatten()
+        logits = self.actor_layers[3](F.relu(self.actor_layers[2](x[0])))
+        return logits, values
+
+
 class FCAgent(PPOAgent):
     critic: nn.Sequential
     actor: nn.Sequential
 
     def __init__(
         self,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         environment_config: EnvironmentConfig,
         fc_model_config=None,  # not necessary yet but keeps type signatures the same
         device: t.device = t.device("cpu"),
         hidden_dim: int = 256,
+        fused: bool = False,
+        compile_mode: str = "none",
     ):
         """
         An agent for a Proximal Policy Optimization (PPO) algorithm.
 
         Args:
-        - envs (gym.vector.SyncVectorEnv): the environment(s) to interact with.
+        - envs (gym.vector.VectorEnv): the environment(s) to interact with.
         - device (t.device): the device on which to run the agent.
         - hidden_dim (int): the number of neurons in the hidden layer.
+        - fused (bool): compute the actor and critic in one pass, see FusedActorCritic.
+        - compile_mode (str): compile the actor, critic and PPO objective, see src.utils.compilation.
         """
         super().__init__(envs=envs, device=device)
 
@@ -205,14 +285,32 @@ class FCAgent(PPOAgent):
                 nn.Linear(self.hidden_dim, self.num_actions), std=0.01
             ),
         )
+        # not a submodule, it only holds references to actor and critic
+        self.fused = FusedActorCritic(self.actor, self.critic) if fused else None
         self.device = device
         self = self.to(device)
 
+        self.ppo_objective = compile_function(calc_ppo_objective, compile_mode)
+        if compile_mode != "none":
+            example_inputs = (t.zeros((1, *self.obs_shape), device=device),)
+            self.actor = compile_module(self.actor, compile_mode, example_inputs)
+            self.critic = compile_module(
+                self.critic, compile_mode, example_inputs
+            )
+
+    def get_logits_and_values(
+        self, obs: t.Tensor
+    ) -> Tuple[t.Tensor, t.Tensor]:
+        """Returns the actor's logits and the critic's values (flattened) for obs."""
+        if self.fused is not None:
+            return self.fused(obs)
+        return self.actor(obs), self.critic(obs).flatten()
+
     def rollout(
         self,
         memory: Memory,
         num_steps: int,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         trajectory_writer=None,
         sampling_method="basic",
         target_type = "key",
@@ -224,7 +322,7 @@ class FCAgent(PPOAgent):
         Args:
             memory (Memory): The replay buffer to store the experiences.
             num_steps (int): The number of steps to collect.
-            envs (gym.vector.SyncVectorEnv): The vectorized environment to interact with.
+            envs (gym.vector.VectorEnv): The vectorized environment to interact with.
             trajectory_writer (TrajectoryWriter, optional): The writer to log the
                 collected trajectories. Defaults to None.
         """
@@ -235,8 +333,7 @@ class FCAgent(PPOAgent):
             
         for _ in range(num_steps):
             with t.inference_mode():
-                logits = self.actor(obs)
-                value = self.critic(obs).flatten()
+                logits, value = self.get_logits_and_values(obs)
             probs = Categorical(logits=logits)
             action = sample_from_categorical(probs, sampling_method, **kwargs)
             logprob = probs.log_prob(action)
@@ -306,28 +403,31 @@ class FCAgent(PPOAgent):
             scheduler (PPOScheduler): The scheduler attached to the optimizer.
             track (bool): Whether to track the training progress.
         """
+        memory.check_save_and_mix(save, mix)
+        # advantages and returns are fixed for the whole update phase
+        memory.prepare_batch()
         for k in range(args.update_epochs):
             if k!=0:
                 save = False
             minibatches = memory.get_minibatches(save = save, mix = mix, mix_frac = mix_frac)
             # Compute loss on each minibatch, and step the optimizer
             for mb in minibatches:
-                logits = self.actor(mb.obs)
-                probs = Categorical(logits=logits)
-                values = self.critic(mb.obs).squeeze()
-                clipped_surrogate_objective = calc_clipped_surrogate_objective(
-                    probs,
+                logits, values = self.get_logits_and_values(mb.obs)
+                (
+                    total_objective_function,
+                    clipped_surrogate_objective,
+                    value_loss,
+                    entropy_bonus,
+                ) = self.ppo_objective(
+                    logits,
+                    values,
                     mb.actions,
                     mb.advantages,
                     mb.logprobs,
+                    mb.returns,
                     args.clip_coef,
-                )
-                value_loss = calc_value_function_loss(
-                    values, mb.returns, args.vf_coef
-                )
-                entropy_bonus = calc_entropy_bonus(probs, args.ent_coef)
-                total_objective_function = (
-                    clipped_surrogate_objective - value_loss + entropy_bonus
+                    args.vf_coef,
+                    args.ent_coef,
                 )
                 optimizer.zero_grad()
                 total_objective_function.backward()
@@ -340,7 +440,9 @@ class FCAgent(PPOAgent):
         # Get debug variables, for just the most recent minibatch (otherwise there's too much logging!)
         if track:
             with t.inference_mode():
-                newlogprob = probs.log_prob(mb.actions)
+                newlogprob = Categorical(logits=logits.detach()).log_prob(
+                    mb.actions
+                )
                 logratio = newlogprob - mb.logprobs
                 ratio = logratio.exp()
                 approx_kl = (ratio - 1 - logratio).mean().item()
@@ -365,7 +467,7 @@ class FCAgent(PPOAgent):
 class TransformerPPOAgent(PPOAgent):
     def __init__(
         self,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         environment_config: EnvironmentConfig,
         transformer_model_config: TransformerModelConfig,
         device: t.device = t.device("cpu"),
@@ -379,7 +481,7 @@ class TransformerPPOAgent(PPOAgent):
         also just suck at online learning as is reported by at least one paper.
 
         Args:
-        - envs (gym.vector.SyncVectorEnv): the environment(s) to interact with.
+        - envs (gym.vector.VectorEnv): the environment(s) to interact with.
         - device (t.device): the device on which to run the agent.
         - environment_config (EnvironmentConfig): the configuration for the environment.
         - model_config (TransformerModelConfig): the configuration for the transformer model.
@@ -409,7 +511,7 @@ class TransformerPPOAgent(PPOAgent):
         self,
         memory: Memory,
         num_steps: int,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         trajectory_writer=None,
         sampling_method="basic",
         **kwargs,
@@ -419,98 +521,42 @@ class TransformerPPOAgent(PPOAgent):
         Args:
             memory (Memory): The replay buffer to store the experiences.
             num_steps (int): The number of steps to collect.
-            envs (gym.vector.SyncVectorEnv): The vectorized environment to interact with.
+            envs (gym.vector.VectorEnv): The vectorized environment to interact with.
             trajectory_writer (TrajectoryWriter, optional): The writer to
                 log the collected trajectories. Defaults to None.
         """
 
         device = memory.device
         obs = memory.next_obs
-        action = None  # will be set before used
         done = memory.next_done
         truncated = memory.next_done  # mem done represents done | truncated
-        context_window_size = self.actor.transformer_config.n_ctx
-        obs_timesteps = (context_window_size - 1) // 2 + 1  # (the current obs)
-        actions_timesteps = obs_timesteps - 1
-        action_pad_token = self.actor.environment_config.action_space.n
-        n_envs = envs.num_envs
         if isinstance(device, str):
             device = t.device(device)
         cuda = device.type == "cuda"
 
-        obss = t.zeros((n_envs, obs_timesteps, *obs.shape[1:]), device=device)
-        acts = (
-            t.ones((n_envs, actions_timesteps, 1), device=device).to(t.long)
-            * action_pad_token
+        # per env token windows of the actor and critic, updated in place
+        context = TransformerRolloutContext(
+            [self.actor, self.critic],
+            obs,
+            action_pad_token=self.actor.environment_config.action_space.n,
+            max_timestep=self.environment_config.max_steps,
         )
-        timesteps = t.zeros((n_envs, obs_timesteps, 1), device=device).to(
-            t.long
-        )
-        obss[:, -1] = obs
         for step in range(num_steps):
-            if len(memory.experiences) == 0:
-                with t.inference_mode():
-                    logits = self.actor(obss[:, -1:], None, timesteps[:, -1:])
-                    values = self.critic(obss[:, -1:], None, timesteps[:, -1:])
-                    value = values[:, -1].squeeze(-1)  # value is scalar
-            else:
-                # temporarily making this code worse, refactor soon.
-                if obs_timesteps - 1 == 0:
-                    obss = obs.unsqueeze(1)  # just add the current obs
-                    acts = None
-                else:
-                    # obss
-                    obss = t.cat(
-                        (obss, obs.unsqueeze(1)), dim=1
-                    )  # add current obs
-                    obss = obss[:, -obs_timesteps:]  # truncate
-                    # acts
-                    # add current action
-                    acts = t.cat(
-                        (acts, action.unsqueeze(1).unsqueeze(-1)), dim=1
-                    )
-                    acts = acts[:, -actions_timesteps:]  # truncate
-                    # timesteps
-                    # add current timestep
-                    timesteps = t.cat(
-                        (timesteps, timesteps[:, -1:] + 1), dim=1
-                    )
-                    if timesteps.max() > self.environment_config.max_steps:
-                        assert False
-                    timesteps = timesteps[:, -obs_timesteps:]  # truncate
-
-                # Generate the next set of new experiences (one for each env)
-                with t.inference_mode():
-                    # Our actor generates logits over actions which we can then sample from
-                    logits = self.actor(obss, acts, timesteps)
-                    # Our critic generates a value function (which we use in the value loss, and to estimate advantages)
-                    values = self.critic(obss, acts, timesteps)
-                    values = values[:, -1].squeeze(-1)  # value is scalar
-
-            # get the last state action prediction
-            probs = Categorical(logits=logits[:, -1])
+            # Generate the next set of new experiences (one for each env)
+            with t.inference_mode():
+                # logits over actions and the value of the current states
+                logits, value = context.predict()
+                value = value.squeeze(-1)  # value is scalar
+
+            probs = Categorical(logits=logits)
             action = sample_from_categorical(probs, sampling_method, **kwargs)
             logprob = probs.log_prob(action)
-            
+
             next_obs, reward, next_done, next_truncated, info = envs.step(
                 action.cpu().numpy()
-                )
+            )
             next_obs = memory.obs_preprocessor(next_obs)
             reward = t.from_numpy(reward).to(device)
-            print(next_obs, reward, next_done, next_truncated)
-
-            # in each case where an episode is done, we need to reset the context window
-            # this is done by setting the last obs to the current obs and the rest to 0
-            # all the actions are set to zero
-            # timesteps are also reset
-            next_done_or_truncated = next_done | next_truncated
-            for i, d in enumerate(next_done_or_truncated):
-                if d:
-                    obss[i, -1] = obs[i]
-                    obss[i, :-1] = 0
-                    if acts is not None:
-                        acts[i] = action_pad_token
-                    timesteps[i] = 0
 
             if trajectory_writer is not None:
                 obs_np = (
@@ -544,25 +590,17 @@ class TransformerPPOAgent(PPOAgent):
             done = t.from_numpy(next_done).to(device, dtype=t.float)
             truncated = t.from_numpy(next_truncated).to(device, dtype=t.float)
 
+            # slide every window by one step, then restart the windows of
+            # envs whose episode ended (obs is already their reset obs)
+            with t.inference_mode():
+                context.append(obs, action)
+                context.reset(obs, next_done | next_truncated)
+
         # Store last (obs, done, value) tuple, since we need it to compute advantages
         memory.next_obs = obs
         memory.next_done = done
         with t.inference_mode():
-            obss = t.cat((obss, obs.unsqueeze(1)), dim=1)
-            acts = (
-                t.cat((acts, action.unsqueeze(1).unsqueeze(-1)), dim=1)
-                if acts is not None
-                else None
-            )
-
-            obss = obss[:, -obs_timesteps:]
-            actions = (
-                acts[:, -actions_timesteps:] if acts is not None else None
-            )
-            timesteps = timesteps[:, -obs_timesteps:]
-
-            values = self.critic(obss, actions, timesteps)
-            memory.next_value = values[:, -1].squeeze(-1)
+            memory.next_value = context.predict()[1].squeeze(-1)
 
     def learn(
         self,
@@ -655,7 +693,7 @@ class TransformerPPOAgent(PPOAgent):
 class LSTMPPOAgent(PPOAgent):
     def __init__(
         self,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         environment_config: EnvironmentConfig,
         lstm_config: LSTMModelConfig,
         device: t.device,
@@ -667,7 +705,7 @@ class LSTMPPOAgent(PPOAgent):
         This class is currently in deverlopment.
 
         Args:
-        - envs (gym.vector.SyncVectorEnv): the environment(s) to interact with.
+        - envs (gym.vector.VectorEnv): the environment(s) to interact with.
         - device (t.device): the device on which to run the agent.
         - environment_config (EnvironmentConfig): the configuration for the environment.
         - lstm_config (LSTMModelConfig): the configuration for the LSTM model.
@@ -686,7 +724,7 @@ class LSTMPPOAgent(PPOAgent):
         self,
         memory: Memory,
         num_steps: int,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         trajectory_writer=None,
         sampling_method="basic",
         **kwargs,
@@ -745,10 +783,11 @@ class LSTMPPOAgent(PPOAgent):
                 )
 
             # Store (s_t, d_t, a_t, logpi(a_t|s_t), v(s_t), r_t+1)
+            # the image tensor is stored, learn wraps it in a DictList again
             mask = 1 - done
             memory.add(
                 info,
-                obs,
+                obs.image,
                 done,
                 action,
                 logprob,
@@ -779,77 +818,58 @@ class LSTMPPOAgent(PPOAgent):
         scheduler: PPOScheduler,
         track: bool,
     ) -> None:
+        """Performs the learning phase of the PPO algorithm on sequences of
+        recurrence steps, unrolling the model's memory through each sequence.
+
+        Minibatches are gathered in sequence-major (recurrence, batch, ...) layout
+        (see Memory.get_recurrent_minibatches) and the model runs over each one in
+        a single call (see TrajectoryLSTM.forward_sequence). The objective is
+        averaged over the steps of the sequences.
+
+        Args:
+            memory (Memory): The replay buffer containing the collected experiences.
+            args (OnlineTrainConfig): The configuration for the training.
+            optimizer (optim.Optimizer): The optimizer to update the agent's parameters.
+            scheduler (PPOScheduler): The scheduler attached to the optimizer.
+            track (bool): Whether to track the training progress.
+        """
         recurrence = self.model_config.recurrence
 
         for _ in range(args.update_epochs):
-            # minibatches = memory.get_minibatches(recurrence=recurrence)
-            starting_indexes = memory.get_minibatch_indexes(
-                memory.args.batch_size, memory.args.minibatch_size, recurrence
-            )
-
-            for inds in starting_indexes:
-                batch_entropy = 0
-                batch_value = 0
-                batch_policy_loss = 0
-                batch_value_loss = 0
-                batch_loss = 0
-
-                # now here is where she would get the memory to start off with
-                # this would be from the inds step.
-                initial_mb = memory.get_minibatches(
-                    recurrence, indexes=[inds]
-                )[0]
-                recurrence_memory = initial_mb.recurrence_memory
-
-                for i in range(recurrence):
-                    mb = memory.get_minibatches(indexes=[inds + i])[0]
-
-                    # run the model
-                    obs = self.preprocess_obs(DictList(mb.obs))
-                    results = self.model(
-                        obs, recurrence_memory * mb.mask.unsqueeze(1)
-                    )
-                    probs = results["dist"]
-                    values = results["value"]
-                    recurrence_memory = results["memory"]
-
-                    # calculate losses
-                    clipped_surrogate_objective = (
-                        calc_clipped_surrogate_objective(
-                            probs,
-                            mb.actions,
-                            mb.advantages,
-                            mb.logprobs,
-                            args.clip_coef,
-                        )
-                    )
-                    value_loss = calc_value_function_loss(
-                        values, mb.returns, args.vf_coef
-                    )
-                    entropy_bonus = calc_entropy_bonus(probs, args.ent_coef)
-                    total_objective_function = (
-                        clipped_surrogate_objective
-                        - value_loss
-                        + entropy_bonus
+            for mb in memory.get_recurrent_minibatches(recurrence):
+                obs = self.preprocess_obs(mb.obs)
+                # the memory stored with the first step of each sequence
+                results = self.model.forward_sequence(
+                    obs, mb.recurrence_memory[0], mb.mask
+                )
+                logits = results["logits"]
+                values = results["value"]
+
+                # advantages are normalized per step, as in calc_clipped_surrogate_objective
+                step_objectives = [
+                    calc_ppo_objective(
+                        logits[i],
+                        values[i],
+                        mb.actions[i],
+                        mb.advantages[i],
+                        mb.logprobs[i],
+                        mb.returns[i],
+                        args.clip_coef,
+                        args.vf_coef,
+                        args.ent_coef,
                     )
-
-                    # update batch values
-                    batch_entropy += entropy_bonus.item()
-                    batch_value += values.mean().item()
-                    batch_policy_loss += clipped_surrogate_objective.item()
-                    batch_value_loss += value_loss.item()
-                    batch_loss += total_objective_function
-
-                # Update batch values
-                batch_entropy /= self.model_config.recurrence
-                batch_value /= self.model_config.recurrence
-                batch_policy_loss /= self.model_config.recurrence
-                batch_value_loss /= self.model_config.recurrence
-                batch_loss /= self.model_config.recurrence
+                    for i in range(recurrence)
+                ]
+                (
+                    batch_loss,
+                    clipped_surrogate_objective,
+                    value_loss,
+                    entropy_bonus,
+                ) = [t.stack(terms).mean() for terms in zip(*step_objectives)]
 
                 # update actor-critic
                 optimizer.zero_grad()
-                total_objective_function.backward()
+                batch_loss.backward()
                 nn.utils.clip_grad_norm_(
                     self.model.parameters(), args.max_grad_norm
                 )
@@ -860,7 +880,9 @@ class LSTMPPOAgent(PPOAgent):
 
         if track:
             with t.inference_mode():
-                newlogprob = probs.log_prob(mb.actions)
+                newlogprob = Categorical(logits=logits.detach()).log_prob(
+                    mb.actions
+                )
                 logratio = newlogprob - mb.logprobs
                 ratio = logratio.exp()
                 approx_kl = (ratio - 1 - logratio).mean().item()
@@ -872,10 +894,10 @@ class LSTMPPOAgent(PPOAgent):
                 ]
             memory.add_vars_to_log(
                 learning_rate=optimizer.param_groups[0]["lr"],
-                avg_value=batch_value,
+                avg_value=values.mean().item(),
                 value_loss=value_loss.item(),
-                clipped_surrogate_objective=batch_policy_loss,
-                entropy=batch_entropy,
+                clipped_surrogate_objective=clipped_surrogate_objective.item(),
+                entropy=entropy_bonus.item(),
                 approx_kl=approx_kl,
                 clipfrac=np.mean(clipfracs),
             )
@@ -897,7 +919,7 @@ class LSTMPPOAgent(PPOAgent):
 
 def get_agent(
     model_config: dataclass,
-    envs: gym.vector.SyncVectorEnv,
+    envs: gym.vector.VectorEnv,
     environment_config: EnvironmentConfig,
     online_config,
 ) -> PPOAgent:
@@ -938,11 +960,24 @@ def get_agent(
             environment_config=environment_config,
             device=environment_config.device,
             hidden_dim=online_config.hidden_size,
+            fused=online_config.fused_actor_critic,
+            compile_mode=online_config.compile_mode,
         )
     return agent
 
 
-def load_saved_checkpoint(path, num_envs=10) -> PPOAgent:
+def load_saved_checkpoint(path, num_envs=10, lazy_envs=True) -> PPOAgent:
+    """
+    Loads the agent saved in a checkpoint.
+
+    Args:
+    - path (str): the path of the checkpoint.
+    - num_envs (int): the number of environments of the agent's envs.
+    - lazy_envs (bool): only start the environments when they are first used, so inspecting an agent doesn't build them.
+
+    Returns:
+    - PPOAgent: the agent, on the cpu.
+    """
     # load the config from the checkpoint
     saved_state = t.load(path, map_location=t.device("cpu"))
     # assert all the fields we need are present
@@ -963,8 +998,13 @@ def load_saved_checkpoint(path, num_envs=10) -> PPOAgent:
     environment_config = EnvironmentConfig(
         **json.loads(saved_state["environment_config"])
     )
-    envs = gym.vector.SyncVectorEnv(
-        [make_env(environment_config, 0, 0, "test") for _ in range(num_envs)]
+    env_fns = [
+        make_env(environment_config, 0, 0, "test") for _ in range(num_envs)
+    ]
+    envs = (
+        LazyVectorEnv(environment_config, env_fns)
+        if lazy_envs
+        else make_vector_env(environment_config, env_fns)
     )
 
     # create the model config
@@ -1003,8 +1043,18 @@ def load_saved_checkpoint(path, num_envs=10) -> PPOAgent:
     return agent
 
 
-def load_all_agents_from_checkpoints(checkpoint_folder_path, num_envs=10):
+def load_all_agents_from_checkpoints(
+    checkpoint_folder_path, num_envs=10, num_workers=1
+):
     """
+    Loads the agents of all the checkpoints in a folder. Their environments
+    are only started when an agent is rolled out (see load_saved_checkpoint).
+
+    Args:
+    - checkpoint_folder_path (str): the folder containing the .pt checkpoints.
+    - num_envs (int): the number of environments of each agent.
+    - num_workers (int): the number of checkpoints read at the same time.
+
         Example:
     --------
     .. code-block:: python
@@ -1017,20 +1067,72 @@ def load_all_agents_from_checkpoints(checkpoint_folder_path, num_envs=10):
         >>>  agents = load_all_agents_from_checkpoints(checkpoint_folder_path)
 
     """
+    paths = get_checkpoint_paths(checkpoint_folder_path)
+
+    # loading is mostly reading files, threads overlap it
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        agents = list(
+            executor.map(
+                lambda path: load_saved_checkpoint(path, num_envs=num_envs),
+                paths,
+            )
+        )
+
+    return agents
+
+
+def get_checkpoint_paths(checkpoint_folder_path):
+    """Returns the paths of the .pt checkpoints in a folder."""
     # Get all files in the checkpoint folder
     checkpoint_files = os.listdir(checkpoint_folder_path)
 
     # Filter out non-checkpoint files
-    checkpoint_files = [f for f in checkpoint_files if f.endswith(".pt")]
+    return [
+        os.path.join(checkpoint_folder_path, f)
+        for f in checkpoint_files
+        if f.endswith(".pt")
+    ]
 
-    # Load each checkpoint into an agent
-    agents = []
-    for checkpoint_file in checkpoint_files:
-        path = os.path.join(checkpoint_folder_path, checkpoint_file)
-        agent = load_saved_checkpoint(path, num_envs=num_envs)
-        agents.append(agent)
 
-    return agents
+def sample_from_agent(
+    agent,
+    rollout_length=2000,
+    trajectory_file=None,
+    num_envs=1,
+    sampling_method="basic",
+) -> pd.DataFrame:
+    """
+    Rolls out an agent, optionally writing the trajectories to
+    trajectory_file, and returns the length and return of its episodes.
+    """
+    memory = Memory(
+        agent.envs,
+        OnlineTrainConfig(num_envs=num_envs),
+        device=agent.device,
+    )
+    if trajectory_file:
+        trajectory_writer = TrajectoryWriter(
+            path=trajectory_file,
+            run_config=RunConfig(track=False),
+            environment_config=agent.environment_config,
+            online_config=OnlineTrainConfig(num_envs=num_envs),
+            model_config=agent.model_config,
+        )
+    else:
+        trajectory_writer = None
+    agent.rollout(
+        memory,
+        rollout_length,
+        agent.envs,
+        trajectory_writer,
+        sampling_method,
+    )
+    if trajectory_writer:
+        trajectory_writer.tag_terminated_trajectories()
+        trajectory_writer.write(upload_to_wandb=False)
+
+    # Process the episode lengths and returns
+    return process_memory_vars_to_log(memory.vars_to_log)
 
 
 def sample_from_agents(
@@ -1045,35 +1147,94 @@ def sample_from_agents(
 
     # Sample rollouts from each agent
     for i, agent in enumerate(agents):
-        memory = Memory(
-            agent.envs,
-            OnlineTrainConfig(num_envs=num_envs),
-            device=agent.device,
-        )
-        if trajectory_path:
-            trajectory_writer = TrajectoryWriter(
-                path=os.path.join(trajectory_path, f"rollouts_agent_{i}.gz"),
-                run_config=RunConfig(track=False),
-                environment_config=agent.environment_config,
-                online_config=OnlineTrainConfig(num_envs=num_envs),
-                model_config=agent.model_config,
-            )
-        else:
-            trajectory_writer = None
-        agent.rollout(
-            memory,
+        df = sample_from_agent(
+            agent,
             rollout_length,
-            agent.envs,
-            trajectory_writer,
+            os.path.join(trajectory_path, f"rollouts_agent_{i}.gz")
+            if trajectory_path
+            else None,
+            num_envs,
             sampling_method,
         )
-        if trajectory_writer:
-            trajectory_writer.tag_terminated_trajectories()
-            trajectory_writer.write(upload_to_wandb=False)
-
-        # Process the episode lengths and returns
-        df = process_memory_vars_to_log(memory.vars_to_log)
         all_episode_lengths.append(df["episode_length"])
         all_episode_returns.append(df["episode_return"])
 
     return all_episode_lengths, all_episode_returns
+
+
+def _init_sampling_worker():
+    # the workers share the cores, one torch thread each avoids oversubscription
+    t.set_num_threads(1)
+
+
+def _sample_from_checkpoint(path, trajectory_file, kwargs):
+    agent = load_saved_checkpoint(path, num_envs=kwargs["num_envs"])
+    df = sample_from_agent(agent, trajectory_file=trajectory_file, **kwargs)
+    agent.envs.close()
+    return df
+
+
+def sample_from_checkpoints(
+    checkpoint_paths,
+    rollout_length=2000,
+    trajectory_path=None,
+    num_envs=1,
+    sampling_method="basic",
+    num_workers=1,
+) -> pd.DataFrame:
+    """
+    Rolls out the agents of several checkpoints, num_workers at a time in
+    separate processes. Each agent writes its own trajectory file,
+    rollouts_agent_{i}.gz in trajectory_path, so the workers never share a
+    writer.
+
+    Args:
+    - checkpoint_paths (list of str): the checkpoints to sample from.
+    - rollout_length (int): the number of steps per agent.
+    - trajectory_path (str, optional): the folder to write the trajectories to.
+    - num_envs (int): the number of environments of each agent.
+    - sampling_method (str): how actions are sampled from the policies.
+    - num_workers (int): the number of agents rolled out at the same time.
+
+    Returns:
+    - pd.DataFrame: the episodes of all the agents, with columns checkpoint, id, episode_length and episode_return.
+    """
+    if not checkpoint_paths:
+        return pd.DataFrame(
+            columns=["checkpoint", "id", "episode_length", "episode_return"]
+        )
+    if trajectory_path:
+        os.makedirs(trajectory_path, exist_ok=True)
+    trajectory_files = [
+        os.path.join(trajectory_path, f"rollouts_agent_{i}.gz")
+        if trajectory_path
+        else None
+        for i in range(len(checkpoint_paths))
+    ]
+    kwargs = dict(
+        rollout_length=rollout_length,
+        num_envs=num_envs,
+        sampling_method=sampling_method,
+    )
+
+    if num_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=_init_sampling_worker
+        ) as executor:
+            dfs = list(
+                executor.map(
+                    _sample_from_checkpoint,
+                    checkpoint_paths,
+                    trajectory_files,
+                    [kwargs] * len(checkpoint_paths),
+                )
+            )
+    else:
+        dfs = [
+            _sample_from_checkpoint(path, trajectory_file, kwargs)
+            for path, trajectory_file in zip(checkpoint_paths, trajectory_files)
+        ]
+
+    for path, df in zip(checkpoint_paths, dfs):
+        df.insert(0, "checkpoint", os.path.basename(path))
+    return pd.concat(dfs, ignore_index=True)
@@ -1,38 +1,139 @@
 import torch as t
-from einops import rearrange, repeat
 from torchtyping import TensorType as TT
 
+GAE_BACKENDS = ["loop", "scripted", "vectorized"]
 
-def shift_rows(arr):
+
+def compute_deltas_and_coefs(
+    next_value: TT["env"],  # noqa: F821
+    next_done: TT["env"],  # noqa: F821
+    rewards: TT["T", "env"],  # noqa: F821
+    values: TT["T", "env"],  # noqa: F821
+    dones: TT["T", "env"],  # noqa: F821
+    gamma: float,
+    gae_lambda: float,
+):
+    """
+    Returns the TD errors and the per-step decay of the GAE recurrence
+    advantages[t] = deltas[t] + coefs[t] * advantages[t + 1].
+
+    coefs[-1] multiplies the (zero) advantage beyond the rollout, so it has no
+    effect on the result.
+    """
+    next_values = t.concat([values[1:], next_value.unsqueeze(0)])
+    next_dones = t.concat([dones[1:], next_done.unsqueeze(0)])
+    deltas = rewards + gamma * next_values * (1.0 - next_dones) - values
+    coefs = gamma * gae_lambda * (1.0 - next_dones)
+    return deltas, coefs
+
+
+def compute_advantages_loop(
+    next_value: TT["env"],  # noqa: F821
+    next_done: TT["env"],  # noqa: F821
+    rewards: TT["T", "env"],  # noqa: F821
+    values: TT["T", "env"],  # noqa: F821
+    dones: TT["T", "env"],  # noqa: F821
+    device: t.device,
+    gamma: float,
+    gae_lambda: float,
+) -> TT["T", "env"]:  # noqa: F821
+    """
+    Reference implementation of GAE, iterating backwards over the rollout in Python.
+    """
+    T = values.shape[0]
+    next_values = t.concat([values[1:], next_value.unsqueeze(0)])
+    next_dones = t.concat([dones[1:], next_done.unsqueeze(0)])
+    deltas = rewards + gamma * next_values * (1.0 - next_dones) - values
+    advantages = t.zeros_like(deltas).to(device)
+    advantages[-1] = deltas[-1]
+    for t_ in reversed(range(1, T)):
+        advantages[t_ - 1] = (
+            deltas[t_ - 1]
+            + gamma * gae_lambda * (1.0 - dones[t_]) * advantages[t_]
+        )
+    return advantages
+
+
+@t.jit.script
+def reverse_scan(deltas: t.Tensor, coefs: t.Tensor) -> t.Tensor:
+    """
+    Solves advantages[t] = deltas[t] + coefs[t] * advantages[t + 1] backwards
+    over the first dimension, compiled with TorchScript.
+    """
+    advantages = t.empty_like(deltas)
+    next_advantage = t.zeros_like(deltas[0])
+    for t_ in range(deltas.shape[0] - 1, -1, -1):
+        next_advantage = deltas[t_] + coefs[t_] * next_advantage
+        advantages[t_] = next_advantage
+    return advantages
+
+
+def compute_advantages_scripted(
+    next_value: TT["env"],  # noqa: F821
+    next_done: TT["env"],  # noqa: F821
+    rewards: TT["T", "env"],  # noqa: F821
+    values: TT["T", "env"],  # noqa: F821
+    dones: TT["T", "env"],  # noqa: F821
+    device: t.device,
+    gamma: float,
+    gae_lambda: float,
+) -> TT["T", "env"]:  # noqa: F821
+    """
+    Computes GAE with the TorchScript reverse scan, avoiding the Python
+    interpreter overhead of the reference loop.
+    """
+    deltas, coefs = compute_deltas_and_coefs(
+        next_value, next_done, rewards, values, dones, gamma, gae_lambda
+    )
+    return reverse_scan(deltas, coefs).to(device)
+
+
+def chunked_reverse_scan(
+    deltas: t.Tensor, coefs: t.Tensor, chunk_size: int = 64
+) -> t.Tensor:
     """
-    Returns a 2D array where the i-th row is the input array from index 0 to i.
-    If the input array has more than 1 dimension, it treats the later dimensions as batch dimensions.
+    Solves advantages[t] = deltas[t] + coefs[t] * advantages[t + 1] in blocks of
+    chunk_size steps.
+
+    Within a block of length L the recurrence is unrolled into an (L, L, ...)
+    matrix of discount products, so memory is linear in the rollout length
+    (T * chunk_size * env) and only T / chunk_size sequential steps remain.
 
     Args:
-    arr (np.ndarray): 1D array to be transformed into a 2D array.
+        deltas (torch.Tensor): TD errors of shape (T, ...).
+        coefs (torch.Tensor): per-step decay of shape (T, ...).
+        chunk_size (int): the number of steps solved together in each block.
 
     Returns:
-    np.ndarray: A 2D array where the i-th row is the input array from index 0 to i.
+        torch.Tensor: the advantages, of shape (T, ...).
+    """
+    advantages = t.empty_like(deltas)
+    carry = t.zeros_like(deltas[0])
+    T = deltas.shape[0]
+    for end in range(T, 0, -chunk_size):
+        start = max(0, end - chunk_size)
+        L = end - start
+        chunk_deltas = deltas[start:end]
+        chunk_coefs = coefs[start:end]
 
-    Example:
-        Given a 1D array like:
-            [1, 2, 3]
-        this function will return:
-            [[1, 2, 3],
-            [0, 1, 2],
-            [0, 0, 1]]
+        # products[s, k] = prod_{j=s}^{k} coefs[j] for k >= s
+        upper = t.triu(t.ones(L, L, dtype=deltas.dtype, device=deltas.device))
+        upper = upper.reshape(L, L, *([1] * (deltas.dim() - 1)))
+        factors = chunk_coefs.unsqueeze(0) * upper + (1.0 - upper)
+        products = factors.cumprod(dim=1)
 
-        If the array has >1D, it treats the later dimensions as batch dims
-    """
-    L = arr.shape[0]
-    output = t.zeros(L, 2 * L, *arr.shape[1:]).to(dtype=arr.dtype)
-    output[:, :L] = arr[None, :]
-    output = rearrange(output, "t1 t2 ... -> (t1 t2) ...")
-    output = output[: L * (2 * L - 1)]
-    output = rearrange(output, "(t1 t2) ... -> t1 t2 ...", t1=L)
-    output = output[:, :L]
+        # weights[s, k] = prod_{j=s}^{k-1} coefs[j], the discount from step k back to s
+        weights = t.cat(
+            [t.ones_like(products[:, :1]), products[:, :-1]], dim=1
+        )
+        weights = weights * upper
+
+        advantages[start:end] = (weights * chunk_deltas.unsqueeze(0)).sum(
+            dim=1
+        ) + products[:, -1] * carry.unsqueeze(0)
+        carry = advantages[start]
 
-    return output
+    return advantages
 
 
 def compute_advantages_vectorized(
@@ -44,10 +145,14 @@ def compute_advantages_vectorized(
     device: t.device,
     gamma: float,
     gae_lambda: float,
+    chunk_size: int = 64,
 ) -> TT["T", "env"]:  # noqa: F821
     """
     The compute_advantages_vectorized function computes the Generalized Advantage Estimation (GAE) advantages for a batch of environments in a vectorized manner.
 
+    The rollout is processed in blocks of chunk_size steps (see chunked_reverse_scan), so
+    memory grows linearly with the number of timesteps rather than quadratically.
+
     Args:
 
         next_value (torch.Tensor): The predicted value of the next state for each environment in the batch, of shape (num_envs,).
@@ -58,31 +163,53 @@ def compute_advantages_vectorized(
         device (torch.device): The device on which to perform computations.
         gamma (float): The discount factor to use.
         gae_lambda (float): The GAE lambda value to use.
+        chunk_size (int): The number of timesteps solved together in each block.
     Returns:
 
         advantages (torch.Tensor): The computed GAE advantages for each timestep and environment, of shape (timesteps, num_envs).
     """
-    T, num_envs = rewards.shape
-    next_values = t.concat([values[1:], next_value.unsqueeze(0)])
-    next_dones = t.concat([dones[1:], next_done.unsqueeze(0)])
-    deltas = rewards + gamma * next_values * (1.0 - next_dones) - values
-
-    deltas_repeated = repeat(deltas, "t2 env -> t1 t2 env", t1=T)
-    mask = repeat(next_dones, "t2 env -> t1 t2 env", t1=T).to(device)
-    mask_uppertri = repeat(
-        t.triu(t.ones(T, T)), "t1 t2 -> t1 t2 env", env=num_envs
-    ).to(device)
-    mask = mask * mask_uppertri
-    mask = 1 - (mask.cumsum(dim=1) > 0).float()
-    mask = t.concat([t.ones(T, 1, num_envs).to(device), mask[:, :-1]], dim=1)
-    mask = mask * mask_uppertri
-    deltas_masked = mask * deltas_repeated
-
-    discount_factors = (gamma * gae_lambda) ** t.arange(T).to(device)
-    discount_factors_repeated = repeat(
-        discount_factors, "t -> t env", env=num_envs
+    deltas, coefs = compute_deltas_and_coefs(
+        next_value, next_done, rewards, values, dones, gamma, gae_lambda
     )
-    discount_factors_shifted = shift_rows(discount_factors_repeated).to(device)
+    return chunked_reverse_scan(deltas, coefs, chunk_size).to(device)
 
-    advantages = (discount_factors_shifted * deltas_masked).sum(dim=1)
-    return advantages
+
+def compute_advantages(
+    next_value: TT["env"],  # noqa: F821
+    next_done: TT["env"],  # noqa: F821
+    rewards: TT["T", "env"],  # noqa: F821
+    values: TT["T", "env"],  # noqa: F821
+    dones: TT["T", "env"],  # noqa: F821
+    device: t.device,
+    gamma: float,
+    gae_lambda: float,
+    backend: str = "loop",
+) -> TT["T", "env"]:  # noqa: F821
+    """
+    Computes GAE advantages with the selected backend.
+
+    Args:
+        backend (str): one of "loop" (reference Python loop), "scripted"
+            (TorchScript reverse scan) or "vectorized" (chunked linear-memory scan).
+            All other arguments are as in compute_advantages_loop.
+    """
+    if backend == "loop":
+        advantages_fn = compute_advantages_loop
+    elif backend == "scripted":
+        advantages_fn = compute_advantages_scripted
+    elif backend == "vectorized":
+        advantages_fn = compute_advantages_vectorized
+    else:
+        raise ValueError(
+            f"Unknown GAE backend {backend}, expected one of {GAE_BACKENDS}"
+        )
+    return advantages_fn(
+        next_value,
+        next_done,
+        rewards,
+        values,
+        dones,
+        device,
+        gamma,
+        gae_lambda,
+    )
@@ -1,3 +1,5 @@
+from typing import Tuple
+
 import torch as t
 from torch.distributions.categorical import Categorical
 from torchtyping import TensorType as TT
@@ -7,6 +9,45 @@ from typeguard import typechecked
 patch_typeguard()
 
 
+def clipped_surrogate_objective(
+    logprob: t.Tensor,
+    mb_advantages: t.Tensor,
+    mb_logprobs: t.Tensor,
+    clip_coef: float,
+) -> t.Tensor:
+    """
+    The clipped surrogate objective from the new log probabilities of the
+    actions taken, see calc_clipped_surrogate_objective.
+    """
+    r_theta = t.exp(logprob - mb_logprobs)
+
+    mb_advantages = (mb_advantages - mb_advantages.mean()) / (
+        mb_advantages.std() + 10e-8
+    )
+
+    non_clipped = r_theta * mb_advantages
+    clipped = t.clip(r_theta, 1 - clip_coef, 1 + clip_coef) * mb_advantages
+
+    return t.minimum(non_clipped, clipped).mean()
+
+
+def value_function_loss(
+    values: t.Tensor, mb_returns: t.Tensor, vf_coef: float
+) -> t.Tensor:
+    """The value function loss, see calc_value_function_loss."""
+    return 0.5 * vf_coef * (values - mb_returns).pow(2).mean()
+
+
+def entropy_bonus(log_probs: t.Tensor, ent_coef: float) -> t.Tensor:
+    """
+    The entropy bonus from the actor's normalized log probabilities of shape
+    (minibatch, num_actions), see calc_entropy_bonus.
+    """
+    # clamped as in Categorical.entropy, so masked (-inf) actions add 0, not nan
+    log_probs = log_probs.clamp(min=t.finfo(log_probs.dtype).min)
+    return ent_coef * -(log_probs.exp() * log_probs).sum(-1).mean()
+
+
 def calc_clipped_surrogate_objective(
     probs: Categorical,
     mb_action: t.Tensor,
@@ -31,19 +72,10 @@ def calc_clipped_surrogate_objective(
         Tensor: The clipped surrogate objective computed over the minibatch, with shape ().
 
     """
-    logits_diff = probs.log_prob(mb_action) - mb_logprobs
-
-    r_theta = t.exp(logits_diff)
-
-    mb_advantages = (mb_advantages - mb_advantages.mean()) / (
-        mb_advantages.std() + 10e-8
+    return clipped_surrogate_objective(
+        probs.log_prob(mb_action), mb_advantages, mb_logprobs, clip_coef
     )
 
-    non_clipped = r_theta * mb_advantages
-    clipped = t.clip(r_theta, 1 - clip_coef, 1 + clip_coef) * mb_advantages
-
-    return t.minimum(non_clipped, clipped).mean()
-
 
 @typechecked
 def calc_value_function_loss(
@@ -64,7 +96,7 @@ def calc_value_function_loss(
         Tensor: The value function loss computed over the minibatch, with shape ().
 
     """
-    return 0.5 * vf_coef * (values - mb_returns).pow(2).mean()
+    return value_function_loss(values, mb_returns, vf_coef)
 
 
 def calc_entropy_bonus(probs: Categorical, ent_coef: float):
@@ -81,3 +113,50 @@ def calc_entropy_bonus(probs: Categorical, ent_coef: float):
         Tensor: The entropy bonus computed over the minibatch, with shape ().
     """
     return ent_coef * probs.entropy().mean()
+
+
+def calc_ppo_objective(
+    logits: t.Tensor,
+    values: t.Tensor,
+    mb_action: t.Tensor,
+    mb_advantages: t.Tensor,
+    mb_logprobs: t.Tensor,
+    mb_returns: t.Tensor,
+    clip_coef: float,
+    vf_coef: float,
+    ent_coef: float,
+) -> Tuple[t.Tensor, t.Tensor, t.Tensor, t.Tensor]:
+    """
+    Return the total PPO objective and its terms, computed from the actor's logits
+    instead of a Categorical, so that it can be compiled (see src.utils.compilation).
+
+    Equivalent to calc_clipped_surrogate_objective - calc_value_function_loss
+    + calc_entropy_bonus, which share its terms.
+
+    Args:
+        logits (Tensor): The actor's unnormalized logits of shape (minibatch, num_actions).
+        values (Tensor): The critic's values of shape (minibatch,).
+        mb_action, mb_advantages, mb_logprobs, mb_returns (Tensor): Tensors of shape
+            (minibatch,), as for the individual terms.
+        clip_coef, vf_coef, ent_coef (float): The coefficients of the individual terms.
+
+    Returns:
+        Tuple[Tensor, Tensor, Tensor, Tensor]: The total objective, clipped surrogate
+            objective, value function loss and entropy bonus, each with shape ().
+    """
+    log_probs = t.log_softmax(logits, dim=-1)
+    logprob = log_probs.gather(-1, mb_action.long().unsqueeze(-1)).squeeze(-1)
+
+    clipped_surrogate = clipped_surrogate_objective(
+        logprob, mb_advantages, mb_logprobs, clip_coef
+    )
+    value_loss = value_function_loss(values, mb_returns, vf_coef)
+    entropy = entropy_bonus(log_probs, ent_coef)
+
+    total_objective_function = clipped_surrogate - value_loss + entropy
+    return (
+        total_objective_function,
+        clipped_surrogate,
+        value_loss,
+        entropy,
+    )
@@ -12,8 +12,8 @@ from torchtyping import TensorType as TT
 
 import wandb
 from src.config import OnlineTrainConfig
-from src.utils.trajectory_utils import pad_tensor
 
+from .compute_adv_vectorized import compute_advantages as compute_gae
 from .utils import get_obs_preprocessor
 
 
@@ -50,6 +50,39 @@ class TrajectoryMinibatch:
     returns: TT["batch"]  # noqa: F821
     timesteps: TT["batch", "T"]  # noqa: F821
     rewards: TT["batch", "T"]  # noqa: F821
+    # False where the window is left padded
+    mask: Optional[TT["batch", "T"]] = None  # noqa: F821
+
+
+@dataclass
+class PreparedBatch:
+    """
+    A dataclass containing the quantities of a full rollout that the update
+    phase samples minibatches from. Quantities are flattened to (env * T, ...)
+    when flattened is True, and are (T, env, ...) views into the preallocated
+    buffers otherwise.
+    """
+
+    obs: t.Tensor
+    actions: t.Tensor
+    logprobs: t.Tensor
+    advantages: t.Tensor
+    values: t.Tensor
+    returns: t.Tensor
+    extras: List[t.Tensor]
+    flattened: bool = True
+
+    def quants(self) -> List[t.Tensor]:
+        """Returns the quantities in the order expected by Minibatch."""
+        return [
+            self.obs,
+            self.actions,
+            self.logprobs,
+            self.advantages,
+            self.values,
+            self.returns,
+            *self.extras,
+        ]
 
 
 # @dataclass
@@ -70,11 +103,15 @@ class TrajectoryMinibatch:
 class Memory:
     """
     A memory buffer for storing experiences during the rollout phase.
+
+    Experiences are either appended to a list and stacked when minibatches
+    are requested (memory_storage="list"), or written in place into
+    preallocated (num_steps, num_envs, ...) tensors (memory_storage="preallocated").
     """
 
     def __init__(
         self,
-        envs: gym.vector.SyncVectorEnv,
+        envs: gym.vector.VectorEnv,
         args: OnlineTrainConfig,
         device: t.device = t.device("cpu"),
         objective = None,
@@ -83,7 +120,7 @@ class Memory:
         Initializes the memory buffer.
 
         Args:
-        - envs (gym.vector.SyncVectorEnv): A SyncVectorEnv object representing the environment.
+        - envs (gym.vector.VectorEnv): The vectorized environment, see make_vector_env.
         - args (OnlineTrainConfig): An object containing the PPO training hyperparameters.
         - device (t.device, optional): The device for storing tensors, either "cpu" or "cuda". Defaults to "cpu".
         """
@@ -100,8 +137,17 @@ class Memory:
         self.saved_experiences = []
         self.saved_advantages = None
         self.saved_returns = None
+        self.preallocate = args.memory_storage == "preallocated"
+        self.buffers = None
+        self.prepared_batch = None
         self.reset()
 
+    def __len__(self) -> int:
+        """Returns the number of steps stored since the last reset."""
+        if self.preallocate:
+            return self.num_stored
+        return len(self.experiences)
+
     def add(self, *data: t.Tensor):
         """
         Adds an experience to storage. Called during the rollout phase.
@@ -110,7 +156,11 @@ class Memory:
         """
         info = data[0]
         experiences = data[1:]
-        self.experiences.append(experiences)
+        self.prepared_batch = None
+        if self.preallocate:
+            self.write_experience(experiences)
+        else:
+            self.experiences.append(experiences)
         if info and isinstance(info, dict):
             if "final_info" in info.keys():
                 for item in info["final_info"]:
@@ -125,6 +175,54 @@ class Memory:
 
                     self.global_step += 1
     
+    def write_experience(self, experiences) -> None:
+        """
+        Writes a single step of experiences in place into the preallocated buffers.
+
+        The buffers are allocated on the first write with shape (num_steps, *x.shape)
+        and the dtype/device of each tensor, and are reused by every later rollout.
+        If a rollout runs for more than num_steps steps (e.g. when collecting
+        demonstrations) the capacity is doubled.
+        """
+        if not all(isinstance(x, t.Tensor) for x in experiences):
+            raise ValueError(
+                "Preallocated memory storage only supports tensor experiences."
+            )
+
+        if self.buffers is None:
+            self.buffers = [
+                t.empty(
+                    (self.args.num_steps, *x.shape),
+                    dtype=x.dtype,
+                    device=x.device,
+                )
+                for x in experiences
+            ]
+        elif self.num_stored == self.buffers[0].shape[0]:
+            self.buffers = [
+                t.cat([buffer, t.empty_like(buffer)])
+                for buffer in self.buffers
+            ]
+
+        for buffer, x in zip(self.buffers, experiences):
+            buffer[self.num_stored] = x
+        self.num_stored += 1
+
+    def get_experience_tensors(self) -> list:
+        """
+        Returns the stored experiences as a list of (T, env, ...) quantities,
+        ordered as (obs, done, action, logprob, value, reward, *extras).
+
+        In preallocated mode these are views into the buffers, so callers
+        must not modify them in place.
+        """
+        if self.preallocate:
+            return [buffer[: self.num_stored] for buffer in self.buffers]
+        return [
+            t.stack(arr) if isinstance(arr[0], t.Tensor) else arr
+            for arr in zip(*self.experiences)
+        ]
+
     def switch_objective(self, objective):
         self.objective = objective
     
@@ -152,12 +250,17 @@ class Memory:
             value  : [...]
             reward : [...]
         """
-        idx = np.random.randint(0, len(self.experiences))
-        print(f"Sample {idx+1}/{len(self.experiences)}:")
+        idx = np.random.randint(0, len(self))
+        print(f"Sample {idx+1}/{len(self)}:")
+        experience = (
+            [buffer[idx] for buffer in self.buffers]
+            if self.preallocate
+            else self.experiences[idx]
+        )
         for i, n in enumerate(
             ["obs", "done", "action", "logprob", "value", "reward"]
         ):
-            print(f"{n:8}: {self.experiences[idx][i].cpu().numpy().tolist()}")
+            print(f"{n:8}: {experience[i].cpu().numpy().tolist()}")
 
     def get_minibatch_indexes(
         self,
@@ -225,44 +328,48 @@ class Memory:
         - gamma (float): the discount factor.
         - gae_lambda (float): the GAE lambda parameter.
 
+        The implementation is selected by args.gae_backend, see
+        src.ppo.compute_adv_vectorized.compute_advantages.
+
         Returns:
         - advantages (Tensor): the advantages of the states.
         """
-        T = values.shape[0]
-        next_values = t.concat([values[1:], next_value.unsqueeze(0)])
-        next_dones = t.concat([dones[1:], next_done.unsqueeze(0)])
-        deltas = rewards + gamma * next_values * (1.0 - next_dones) - values
-        advantages = t.zeros_like(deltas).to(device)
-        advantages[-1] = deltas[-1]
-        for t_ in reversed(range(1, T)):
-            advantages[t_ - 1] = (
-                deltas[t_ - 1]
-                + gamma * gae_lambda * (1.0 - dones[t_]) * advantages[t_]
-            )
-        return advantages
+        return compute_gae(
+            next_value,
+            next_done,
+            rewards,
+            values,
+            dones,
+            device,
+            gamma,
+            gae_lambda,
+            backend=self.args.gae_backend,
+        )
 
-    def get_minibatches(
-        self,
-        recurrence: Optional[int] = None,
-        indexes: Optional[List[np.array]] = None,
-        save = False,
-        mix = False,
-        mix_frac = None,
-    ) -> List[Minibatch]:
-        """Return a list of length (batch_size // minibatch_size)
-          where each element is an array of indexes into the batch.
+    def prepare_batch(self) -> PreparedBatch:
+        """
+        Computes the advantages and returns of the stored rollout, and the views
+        of every quantity used for minibatching.
 
-        Args:
-        - recurrence (int): the number of steps to take between each minibatch.
-        - indexes (List[np.array]): the indexes to use for the minibatches.
+        The result is cached until the next call to add or reset, so the GAE
+        computation and flattening happen once per rollout rather than once
+        per update epoch.
 
         Returns:
-        - List[MiniBatch]: a list of minibatches.
+        - PreparedBatch: the quantities of the full rollout.
         """
-        obs, dones, actions, logprobs, values, rewards, *extras = [
-            t.stack(arr) if isinstance(arr[0], t.Tensor) else arr
-            for arr in zip(*self.experiences)
-        ]
+        if self.prepared_batch is not None:
+            return self.prepared_batch
+
+        (
+            obs,
+            dones,
+            actions,
+            logprobs,
+            values,
+            rewards,
+            *extras,
+        ) = self.get_experience_tensors()
 
         advantages = self.compute_advantages(
             self.next_value,
@@ -274,9 +381,9 @@ class Memory:
             self.args.gamma,
             self.args.gae_lambda,
         )
-        
+
         returns = advantages + values
-        
+
         quants = [
             obs,
             actions,
@@ -286,27 +393,70 @@ class Memory:
             returns,
             *extras,
         ]
-        
-        for i, arr in enumerate(quants):
-            assert type(arr) is t.Tensor
-            quants[i] = arr.transpose(0, 1).flatten(
-                0, 1
+
+        # preallocated buffers are gathered from directly by index
+        if not self.preallocate:
+            for i, arr in enumerate(quants):
+                assert type(arr) is t.Tensor
+                quants[i] = arr.transpose(0, 1).flatten(0, 1)
+
+        self.prepared_batch = PreparedBatch(
+            *quants[:6], extras=quants[6:], flattened=not self.preallocate
+        )
+        return self.prepared_batch
+
+    def check_save_and_mix(self, save: bool, mix: bool) -> None:
+        """Raises a ValueError if saving or mixing is requested in preallocated mode."""
+        if self.preallocate and (save or mix):
+            raise ValueError(
+                "Saving and mixing experiences is not supported with memory_storage='preallocated'."
             )
-        if save:
-            print("SAVING")
-            self.saved_experiences = self.saved_experiences + self.experiences
-            if self.saved_advantages is not None:
-                self.saved_advantages = t.cat((self.saved_advantages, quants[3]))
-                self.saved_returns = t.cat((self.saved_returns, quants[5]))
-            else:
-                self.saved_advantages = quants[3]
-                self.saved_returns = quants[5]
-            
+
+    def get_minibatches(
+        self,
+        recurrence: Optional[int] = None,
+        indexes: Optional[List[np.array]] = None,
+        save = False,
+        mix = False,
+        mix_frac = None,
+    ) -> List[Minibatch]:
+        """Return a list of length (batch_size // minibatch_size)
+          where each element is an array of indexes into the batch.
+
+        Advantages and returns come from prepare_batch, so repeated calls
+        during the update phase only draw a fresh permutation.
+
+        Args:
+        - recurrence (int): the number of steps to take between each minibatch.
+        - indexes (List[np.array]): the indexes to use for the minibatches.
+
+        Returns:
+        - List[MiniBatch]: a list of minibatches.
+        """
+        self.check_save_and_mix(save, mix)
+        prepared_batch = self.prepare_batch()
+        quants = prepared_batch.quants()
 
         if indexes is None:
             indexes = self.get_minibatch_indexes(
                 self.args.batch_size, self.args.minibatch_size, recurrence
             )
+
+        if not prepared_batch.flattened:
+            return [
+                Minibatch(*self.gather_flat_indexes(quants, ind))
+                for ind in indexes
+            ]
+
+        if save:
+            print("SAVING")
+            self.saved_experiences = self.saved_experiences + self.experiences
+            if self.saved_advantages is not None:
+                self.saved_advantages = t.cat((self.saved_advantages, prepared_batch.advantages))
+                self.saved_returns = t.cat((self.saved_returns, prepared_batch.returns))
+            else:
+                self.saved_advantages = prepared_batch.advantages
+                self.saved_returns = prepared_batch.returns
         
         if mix:
             assert mix_frac is not None
@@ -321,7 +471,7 @@ class Memory:
                 self.saved_advantages,
                 s_values,
                 self.saved_returns,
-                *extras,
+                *s_extras,
             ]
             for i, arr in enumerate(saved_quants):
                 if i not in [3, 5]:
@@ -351,252 +501,198 @@ class Memory:
         for a, ind in enumerate(indexes):
             batch = []
             for b, arr in enumerate(quants):
-                if isinstance(arr, t.Tensor):
-                    batch_arr = arr[ind]
-                    if mix:
-                        s_ind = saved_indices[a]
-                        s_arr = saved_quants[b]
-                        s_batch_arr = s_arr[s_ind]
-                        batch_arr = batch_arr[:len(ind) - len(s_ind)]
-                        batch_arr = t.cat((batch_arr, s_batch_arr))
-                        
-                    batch.append(batch_arr)
-                else:
-                    # not implemented properly
-                    assert mix is False
-                    num_steps = len(arr)
-                    num_envs = len(arr[0])
-                    # in lstm, arr can be a list of attribute dictionaries with the mission statement as well.
-                    # this should flatten the obss correctly.
-                    flat_arr = [
-                        arr[i][j]
-                        for j in range(num_envs)
-                        for i in range(num_steps)
-                    ]
-                    batch.append([flat_arr[i] for i in ind])
+                batch_arr = arr[ind]
+                if mix:
+                    s_ind = saved_indices[a]
+                    s_arr = saved_quants[b]
+                    s_batch_arr = s_arr[s_ind]
+                    batch_arr = batch_arr[:len(ind) - len(s_ind)]
+                    batch_arr = t.cat((batch_arr, s_batch_arr))
+                    
+                batch.append(batch_arr)
 
             minibatches.append(Minibatch(*batch))
 
         return minibatches
 
+    def get_recurrent_minibatches(self, recurrence: int) -> List[Minibatch]:
+        """
+        Return a list of length (batch_size // minibatch_size) of minibatches of
+        sequences of recurrence consecutive steps from one env each.
+
+        Every quantity is gathered at once in sequence-major layout, with shape
+        (recurrence, minibatch_size // recurrence, ...), e.g. mb.obs[i] holds the
+        i-th step of every sequence. Advantages and returns come from prepare_batch.
+
+        Args:
+        - recurrence (int): the length of the sequences.
+
+        Returns:
+        - List[MiniBatch]: a list of minibatches.
+        """
+        assert (
+            self.args.num_steps % recurrence == 0
+        ), "num_steps must be divisible by recurrence, so that no sequence spans two envs"
+        prepared_batch = self.prepare_batch()
+        quants = prepared_batch.quants()
+
+        starting_indexes = self.get_minibatch_indexes(
+            self.args.batch_size, self.args.minibatch_size, recurrence
+        )
+        steps = np.arange(recurrence)[:, None]
+
+        minibatches = []
+        for inds in starting_indexes:
+            sequence_indexes = steps + inds[None, :]
+            if prepared_batch.flattened:
+                sequence_indexes = t.as_tensor(sequence_indexes, dtype=t.long)
+                batch = [arr[sequence_indexes] for arr in quants]
+            else:
+                batch = self.gather_flat_indexes(quants, sequence_indexes)
+            minibatches.append(Minibatch(*batch))
+        return minibatches
+
+    def gather_flat_indexes(
+        self, quants: List[t.Tensor], indexes: np.ndarray
+    ) -> List[t.Tensor]:
+        """
+        Gathers the experiences at the given indexes from (T, env, ...) tensors.
+
+        Indexes refer to the env-major flattened batch (index = env * T + step),
+        the same ordering as transposing and flattening each quantity, so no
+        copy of the full rollout is made.
+        """
+        indexes = t.as_tensor(indexes, dtype=t.long)
+        T = quants[0].shape[0]
+        steps, envs = indexes % T, indexes // T
+        return [arr[steps, envs] for arr in quants]
+
     def get_trajectory_minibatches(
         self, timesteps: int, prob_go_from_end: float = 0.1
     ) -> List[TrajectoryMinibatch]:
-        """Return a list of trajectory minibatches, where each minibatch contains
-        experiences from a single trajectory.
+        """Return a list of trajectory minibatches, where each element of a
+        minibatch is a window of up to timesteps steps ending at a sampled step
+        of a single trajectory, left padded to timesteps.
+
+        Trajectories are the pieces of each env's rollout between episode starts.
+        Advantages are computed once over the full rollout, then every window is
+        gathered at once from the env-major flattened rollout.
 
         Args:
-        - timesteps (int): the number of timesteps to include in each minibatch.
+        - timesteps (int): the number of timesteps to include in each window.
+        - prob_go_from_end (float): the probability of a window ending at the last
+            step of its trajectory, for trajectories longer than timesteps.
 
         Returns:
         - List[TrajectoryMinibatch]: a list of minibatches.
         """
-        obs, dones, actions, logprobs, values, rewards = [
-            t.stack(arr) for arr in zip(*self.experiences)
-        ]
-
-        next_values = t.cat([values[1:], self.next_value.unsqueeze(0)])
-        next_dones = t.cat([dones[1:], self.next_done.unsqueeze(0)])
-
-        # px.imshow(obs[:,1,:,:,0].transpose(-1,-2), animation_frame = 0, range_color = [0,10]).show()
-        # set last value of dones to 1
-        dones[-1] = t.ones(dones.shape[-1])
+        (
+            obs,
+            dones,
+            actions,
+            logprobs,
+            values,
+            rewards,
+        ) = self.get_experience_tensors()
 
         # hack for now.
         # will cause problems if you only have one environment
         if logprobs.shape[-1] == 1:
             logprobs = logprobs.squeeze(-1)
 
+        advantages = self.compute_advantages(
+            self.next_value,
+            self.next_done,
+            rewards,
+            values,
+            dones,
+            self.device,
+            self.args.gamma,
+            self.args.gae_lambda,
+        )
+        returns = advantages + values
+
+        # a trajectory starts at the first step of each env and wherever an
+        # episode starts (dones marks the first step after a reset)
+        starts = dones.bool().clone()
+        starts[0] = True
+
         # rearrange to flatten out the env dimension (2nd dimension)
         obs = rearrange(obs, "T E ... -> (E T) ...")
-        dones = rearrange(dones, "T E -> (E T)")
-        next_dones = rearrange(next_dones, "T E -> (E T)")
         actions = rearrange(actions, "T E ... -> (E T) ...")
-        logprobs = rearrange(logprobs, "T E -> (E T)")
-        values = rearrange(values, "T E -> (E T)")
-        next_values = rearrange(next_values, "T E -> (E T)")
-        rewards = rearrange(rewards, "T E -> (E T)")
-
-        # find the indices of the end of each trajectory
-        traj_end_idxs = (t.where(dones)[0]).tolist()
-
-        # split these trajectories on the dones
-        traj_obs = t.tensor_split(obs, traj_end_idxs)
-        traj_actions = t.tensor_split(actions, traj_end_idxs)
-        traj_logprobs = t.tensor_split(logprobs, traj_end_idxs)
-        traj_values = t.tensor_split(values, traj_end_idxs)
-        traj_rewards = t.tensor_split(rewards, traj_end_idxs)
-        traj_dones = t.tensor_split(dones, traj_end_idxs)
-        traj_next_values = t.tensor_split(next_values, traj_end_idxs)
-        traj_next_dones = t.tensor_split(next_dones, traj_end_idxs)
-        print(
-            [
-                i
-                for i, (next_val, obs) in enumerate(
-                    zip(traj_next_values, traj_obs)
-                )
-                if len(next_val) != len(obs)
-            ]
+        logprobs, values, rewards, advantages, returns = [
+            rearrange(x, "T E -> (E T)")
+            for x in (logprobs, values, rewards, advantages, returns)
+        ]
+        starts = rearrange(starts, "T E -> (E T)")
+
+        # trajectory offset index
+        traj_starts = t.where(starts)[0].cpu().numpy()
+        traj_lengths = np.diff(np.append(traj_starts, starts.shape[0]))
+
+        # sample a trajectory and the (exclusive) end of a window in it for
+        # every element of every minibatch
+        n_samples = self.args.num_minibatches * self.args.minibatch_size
+        traj_idx = np.random.randint(len(traj_starts), size=n_samples)
+        lengths = traj_lengths[traj_idx]
+        long_traj = lengths > timesteps
+        end_idx = lengths.copy()
+        random_end = long_traj
+        if prob_go_from_end is not None:
+            random_end = long_traj & (
+                np.random.random(n_samples) >= prob_go_from_end
+            )
+        end_idx[random_end] = timesteps + (
+            np.random.random(random_end.sum())
+            * (lengths[random_end] - timesteps)
+        ).astype(np.int64)
+
+        # (n_samples, timesteps) positions in the trajectories, negative positions are padding
+        positions = t.as_tensor(
+            end_idx[:, None] - timesteps + np.arange(timesteps)[None, :],
+            device=obs.device,
         )
-        # px.imshow(traj_obs[0][:,:,:,0].transpose(-1,-2), animation_frame = 0, range_color = [0,10]).show()
-
-        # so now we have lists of trajectories, what we want is to split each trajectory
-        # so for each trajectory, sample an index and go n_steps back from that.
-        # since we're encoding  states and actions, we want to go context_length//2 back
-        # if that happens to go off the end, then we
-        minibatches = []
-
-        # remove trajectories of length 0
-        traj_obs = [traj for traj in traj_obs if len(traj) > 0]
-        traj_actions = [traj for traj in traj_actions if len(traj) > 0]
-        traj_logprobs = [traj for traj in traj_logprobs if len(traj) > 0]
-        traj_values = [traj for traj in traj_values if len(traj) > 0]
-        traj_rewards = [traj for traj in traj_rewards if len(traj) > 0]
-        traj_dones = [traj for traj in traj_dones if len(traj) > 0]
-        traj_next_values = [traj for traj in traj_next_values if len(traj) > 0]
-        traj_next_dones = [traj for traj in traj_next_dones if len(traj) > 0]
-
-        n_trajectories = len(traj_obs)
-        trajectory_lengths = [len(traj) for traj in traj_obs]
-
-        for _ in range(self.args.num_minibatches):
-            minibatch_obs = []
-            minibatch_actions = []
-            minibatch_logprobs = []
-            minibatch_advantages = []
-            minibatch_values = []
-            minibatch_returns = []
-            minibatch_timesteps = []
-            minibatch_rewards = []
-
-            for _ in range(self.args.minibatch_size):
-                # randomly select a trajectory
-                traj_idx = np.random.randint(n_trajectories)
-
-                # randomly select an end index from the trajectory
-                # TODO later add a hyperparameter to oversample last step
-                traj_len = trajectory_lengths[traj_idx]
-
-                if traj_len <= timesteps:
-                    end_idx = traj_len
-                    start_idx = 0
-                else:
-                    if prob_go_from_end is not None:
-                        if random.random() < prob_go_from_end:
-                            end_idx = traj_len
-                            start_idx = end_idx - timesteps
-                        else:
-                            end_idx = np.random.randint(timesteps, traj_len)
-                            start_idx = end_idx - timesteps
-                    else:
-                        end_idx = np.random.randint(timesteps, traj_len)
-                        start_idx = end_idx - timesteps
-
-                # print('end_idx:', end_idx)
-                # print('traj_len:', traj_len)
-                # print('len(traj_next_values[traj_idx]):', len(traj_next_values[traj_idx]))
-                # if len(traj_next_values[traj_idx]) != traj_len:
-                #     print("uh oh")
-
-                # get the trajectory
-                current_traj_obs = traj_obs[traj_idx][start_idx:end_idx]
-                current_traj_actions = traj_actions[traj_idx][
-                    start_idx:end_idx
-                ]
-                current_traj_logprobs = traj_logprobs[traj_idx][
-                    start_idx:end_idx
-                ]
-                current_traj_values = traj_values[traj_idx][start_idx:end_idx]
-                current_traj_dones = traj_dones[traj_idx][start_idx:end_idx]
-                current_traj_rewards = traj_rewards[traj_idx][
-                    start_idx:end_idx
-                ]
-                current_traj_next_value = traj_next_values[traj_idx][
-                    end_idx - 1
-                ]
-                current_traj_next_done = traj_next_dones[traj_idx][end_idx - 1]
-
-                # make timesteps
-                current_traj_timesteps = t.arange(start_idx, end_idx)
-
-                # Compute the advantages and returns for this trajectory.
-                current_traj_advantages = self.compute_advantages(
-                    current_traj_next_value,
-                    current_traj_next_done,
-                    current_traj_rewards,
-                    current_traj_values,
-                    current_traj_dones,
-                    self.device,
-                    self.args.gamma,
-                    self.args.gae_lambda,
-                )
-
-                current_traj_returns = (
-                    current_traj_advantages + current_traj_values
-                )
-
-                # we need to pad current_traj_obs and current_traj_actions
-                current_traj_obs = pad_tensor(
-                    current_traj_obs,
-                    timesteps,
-                    ignore_first_dim=False,
-                    pad_token=0,
-                    pad_left=True,
-                )
-
-                current_traj_actions = pad_tensor(
-                    current_traj_actions,
-                    timesteps,
-                    ignore_first_dim=False,
-                    pad_token=0,
-                    pad_left=True,
-                )
-
-                current_traj_timesteps = pad_tensor(
-                    current_traj_timesteps,
-                    timesteps,
-                    ignore_first_dim=False,
-                    pad_token=0,
-                    pad_left=True,
-                )
-                # print([i for i, (next_val, obs) in enumerate(zip(traj_next_values, traj_obs)) if len(next_val) != len(obs)])
-                # add to minibatch
-                minibatch_obs.append(current_traj_obs)
-                minibatch_actions.append(current_traj_actions)
-                minibatch_logprobs.append(current_traj_logprobs[-1])
-                minibatch_advantages.append(current_traj_advantages[-1])
-                minibatch_values.append(current_traj_values[-1])
-                minibatch_returns.append(current_traj_returns[-1])
-                minibatch_rewards.append(current_traj_rewards[-1])
-                minibatch_timesteps.append(current_traj_timesteps)
-
-            # stack the minibatch
-            minibatch_obs = t.stack(minibatch_obs)
-            minibatch_actions = t.stack(minibatch_actions)
-
-            # only take the last values of the logprob, advantage,
-            # value and return (relevant to the last step of each trajectory)
-            minibatch_logprobs = t.stack(minibatch_logprobs)
-            minibatch_advantages = t.stack(minibatch_advantages)
-            minibatch_values = t.stack(minibatch_values)
-            minibatch_returns = t.stack(minibatch_returns)
-            minibatch_timesteps = t.stack(minibatch_timesteps)
-            minibatch_rewards = t.stack(minibatch_rewards)
-
-            minibatches.append(
-                TrajectoryMinibatch(
-                    obs=minibatch_obs,
-                    actions=minibatch_actions,
-                    logprobs=minibatch_logprobs,
-                    advantages=minibatch_advantages,
-                    values=minibatch_values,
-                    returns=minibatch_returns,
-                    timesteps=minibatch_timesteps,
-                    rewards=minibatch_rewards,
-                )
+        mask = positions >= 0
+        positions = positions.clamp(min=0)
+        flat_idx = (
+            t.as_tensor(traj_starts[traj_idx], device=obs.device)[:, None]
+            + positions
+        )
+        last_idx = flat_idx[:, -1]
+
+        window_obs = obs[flat_idx] * mask.view(
+            *mask.shape, *([1] * (obs.ndim - 1))
+        ).to(obs.dtype)
+        window_actions = actions[flat_idx] * mask.view(
+            *mask.shape, *([1] * (actions.ndim - 1))
+        ).to(actions.dtype)
+        window_timesteps = positions * mask
+
+        def split(x):
+            return x.reshape(
+                self.args.num_minibatches, self.args.minibatch_size, *x.shape[1:]
             )
 
-        return minibatches
+        # only take the last values of the logprob, advantage,
+        # value and return (relevant to the last step of each window)
+        quants = [
+            split(x)
+            for x in (
+                window_obs,
+                window_actions,
+                logprobs[last_idx],
+                advantages[last_idx],
+                values[last_idx],
+                returns[last_idx],
+                window_timesteps,
+                rewards[last_idx],
+                mask,
+            )
+        ]
+        return [
+            TrajectoryMinibatch(*[x[i] for x in quants])
+            for i in range(self.args.num_minibatches)
+        ]
 
     def get_printable_output(self) -> str:
         """Sets a new progress bar description, if any episodes have terminated.
@@ -616,6 +712,8 @@ class Memory:
         space for new experiences to be generated.
         """
         self.experiences = []
+        self.num_stored = 0
+        self.prepared_batch = None
         self.vars_to_log = defaultdict(dict)
         self.episode_lengths = []
         self.episode_returns = []
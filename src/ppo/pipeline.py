@@ -0,0 +1,131 @@
+import copy
+import queue
+import threading
+from typing import List, Tuple
+
+import torch as t
+
+from .agent import PPOAgent
+from .memory import Memory
+
+
+class PipelinedCollector:
+    """
+    Collects rollouts in a background thread while the learner updates the agent.
+
+    The collector acts with its own copy of the agent, loading the most recent
+    weights published by the learner before every rollout. Rollout n is only
+    started once the learner has finished update n - max_policy_lag, so every
+    batch is at most max_policy_lag updates stale when it is learned on.
+
+    Each target keeps max_policy_lag + 1 Memory buffers that are filled in
+    turn. The environment state (next_obs, next_done, global_step) is handed
+    over from the last filled buffer to the next one.
+    """
+
+    def __init__(
+        self,
+        agent: PPOAgent,
+        memories: List[List[Memory]],
+        envs_list: list,
+        schedule: List[int],
+        num_steps: int,
+        max_policy_lag: int = 1,
+        trajectory_writer=None,
+    ):
+        """
+        Args:
+        - agent (PPOAgent): the learner's agent, copied for acting.
+        - memories (List[List[Memory]]): max_policy_lag + 1 buffers per entry of envs_list.
+        - envs_list (list): the vectorized environments, one per target.
+        - schedule (List[int]): index into envs_list of the target of each rollout.
+        - num_steps (int): number of steps per rollout.
+        - max_policy_lag (int): maximum number of updates between acting and learning.
+        - trajectory_writer (TrajectoryWriter, optional): writer for the collected trajectories.
+        """
+        assert all(
+            len(buffers) == max_policy_lag + 1 for buffers in memories
+        ), "need max_policy_lag + 1 memory buffers per target"
+
+        # share the environments instead of copying them
+        self.collector_agent = copy.deepcopy(
+            agent, memo={id(agent.envs): agent.envs}
+        )
+        self.memories = memories
+        self.envs_list = envs_list
+        self.schedule = schedule
+        self.num_steps = num_steps
+        self.max_policy_lag = max_policy_lag
+        self.trajectory_writer = trajectory_writer
+
+        self.version = 0
+        self.snapshot = clone_state_dict(agent)
+        self.condition = threading.Condition()
+        self.ready = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def publish(self, agent: PPOAgent) -> None:
+        """Makes the weights of the agent available to the collector, called after every update."""
+        snapshot = clone_state_dict(agent)
+        with self.condition:
+            self.snapshot = snapshot
+            self.version += 1
+            self.condition.notify_all()
+
+    def get(self) -> Tuple[Memory, int]:
+        """
+        Waits for the next rollout.
+
+        Returns:
+        - memory (Memory): the buffer holding the rollout.
+        - policy_lag (int): number of updates between the acting weights and the current ones.
+        """
+        item = self.ready.get()
+        if isinstance(item, Exception):
+            raise item
+        memory, version = item
+        return memory, self.version - version
+
+    def close(self) -> None:
+        self.thread.join()
+
+    def run(self) -> None:
+        try:
+            # the last buffer was created last, so its next_obs matches the envs
+            latest = [buffers[-1] for buffers in self.memories]
+            counts = [0] * len(self.memories)
+            for n, target in enumerate(self.schedule):
+                with self.condition:
+                    self.condition.wait_for(
+                        lambda: self.version >= n - self.max_policy_lag
+                    )
+                    snapshot, version = self.snapshot, self.version
+                self.collector_agent.load_state_dict(snapshot)
+
+                memory = self.memories[target][
+                    counts[target] % len(self.memories[target])
+                ]
+                counts[target] += 1
+                if memory is not latest[target]:
+                    memory.next_obs = latest[target].next_obs
+                    memory.next_done = latest[target].next_done
+                    memory.global_step = latest[target].global_step
+
+                self.collector_agent.rollout(
+                    memory,
+                    self.num_steps,
+                    self.envs_list[target],
+                    self.trajectory_writer,
+                )
+                latest[target] = memory
+                self.ready.put((memory, version))
+        except Exception as e:
+            self.ready.put(e)
+
+
+def clone_state_dict(agent: PPOAgent) -> dict:
+    with t.no_grad():
+        return {k: v.detach().clone() for k, v in agent.state_dict().items()}
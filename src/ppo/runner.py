@@ -13,7 +13,7 @@ from src.config import (
     RunConfig,
     TransformerModelConfig,
 )
-from src.environments.environments import make_env
+from src.environments.environments import make_env, make_vector_env
 from src.environments.registration import register_envs
 from src.ppo.train import train_ppo
 from src.ppo.utils import set_global_seeds
@@ -49,6 +49,8 @@ def ppo_runner(
             environment_config=environment_config,
             online_config=online_config,
             model_config=model_config,
+            shard_size=online_config.trajectory_shard_size,
+            background_compression=online_config.trajectory_background_compression,
         )
     else:
         trajectory_writer = None
@@ -82,7 +84,8 @@ def ppo_runner(
     envs_list = []
     for i, color in enumerate(target_colors):
         
-        envs = gym.vector.SyncVectorEnv(
+        envs = make_vector_env(
+            environment_config,
             [
                 make_env(
                     config=environment_config,
@@ -94,8 +97,8 @@ def ppo_runner(
                 for i in range(online_config.num_envs)
             ]
         )
-        for env in envs.envs:
-            env.switch_target(target_types[i], color)
+        # call works for subprocess environments as well
+        envs.call("switch_target", target_types[i], color)
             
         envs_list.append(envs)
         
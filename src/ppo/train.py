@@ -1,7 +1,6 @@
 import os
 from typing import Optional, Union
 
-from gymnasium.vector import SyncVectorEnv
 from tqdm.autonotebook import tqdm
 
 import wandb
@@ -15,6 +14,7 @@ from src.config import (
 
 from .agent import PPOAgent, get_agent
 from .memory import Memory
+from .pipeline import PipelinedCollector
 from .utils import store_model_checkpoint
 
 import random
@@ -36,12 +36,18 @@ def train_ppo(
     - online_config (OnlineTrainConfig): An object containing online training configuration details.
     - environment_config (EnvironmentConfig): An object containing environment-specific configuration details.
     - model_config (Optional[Union[TransformerModelConfig, LSTMModelConfig]]): An optional object containing either Transformer or LSTM model configuration details.
-    - envs (SyncVectorEnv): The environment in which to perform training.
+    - envs_list (List[VectorEnv]): The environments in which to perform training, one per objective.
     - trajectory_writer (optional): An optional object for writing trajectories to a file.
 
     Returns:
     - agent (PPOAgent): The trained PPO agent.
     """
+    # pipelined collection fills up to max_policy_lag + 1 buffers per target while learning
+    num_buffers = (
+        online_config.max_policy_lag + 1
+        if online_config.pipeline_rollouts
+        else 1
+    )
     memories = []
     for envs in envs_list:
         target_type = envs.get_attr("target_type")
@@ -50,7 +56,12 @@ def train_ppo(
             target_type = target_type[0]
             target_color = target_color[0]
         
-        memories.append(Memory(envs, online_config, run_config.device, objective = target_type + "_" + target_color))
+        memories.append(
+            [
+                Memory(envs, online_config, run_config.device, objective = target_type + "_" + target_color)
+                for _ in range(num_buffers)
+            ]
+        )
         
     agent = get_agent(model_config, envs_list[0], environment_config, online_config)
         
@@ -96,6 +107,18 @@ def train_ppo(
             checkpoint_artifact,
         )
 
+    if online_config.pipeline_rollouts:
+        collector = PipelinedCollector(
+            agent,
+            memories,
+            envs_list,
+            schedule,
+            online_config.num_steps,
+            max_policy_lag=online_config.max_policy_lag,
+            trajectory_writer=trajectory_writer,
+        )
+        collector.start()
+
     progress_bar = tqdm(range(num_updates), position=0, leave=True)
     for n in progress_bar:
         
@@ -105,12 +128,17 @@ def train_ppo(
         mix_frac = False
         
         
-        memory = memories[schedule[n]]
         envs = envs_list[schedule[n]]
         video_path = video_paths[schedule[n]]
         videos = videos_list[schedule[n]]
         
-        agent.rollout(memory, online_config.num_steps, envs, trajectory_writer)
+        if online_config.pipeline_rollouts:
+            # collected in the background with weights at most max_policy_lag updates old
+            memory, policy_lag = collector.get()
+            memory.add_vars_to_log(policy_lag=policy_lag)
+        else:
+            memory = memories[schedule[n]][0]
+            agent.rollout(memory, online_config.num_steps, envs, trajectory_writer)
         
         agent.learn(
             memory, online_config, optimizer, scheduler, run_config.track, 
@@ -139,7 +167,11 @@ def train_ppo(
         progress_bar.set_description(output)
         
         memory.reset()
+        if online_config.pipeline_rollouts:
+            collector.publish(agent)
         
+    if online_config.pipeline_rollouts:
+        collector.close()
     
     if run_config.track:
         checkpoint_num = store_model_checkpoint(
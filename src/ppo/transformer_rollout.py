@@ -0,0 +1,118 @@
+"""
+Context windows for rolling out transformer agents step by step.
+
+Each env keeps the token embeddings of its current context window for every
+model (e.g. actor and critic) in a RingBuffer. A step embeds only the new
+action and state tokens and writes them in place, evicting the oldest ones,
+and envs whose episode ended get a fresh padded window in one masked write.
+The transformer itself still runs over the whole window each step (see the
+incremental inference notes in TrajectoryTransformer).
+"""
+from typing import List
+
+import numpy as np
+import torch as t
+
+from src.models.trajectory_transformer import CloneTransformer
+from src.utils.ring_buffer import RingBuffer
+
+
+class TransformerRolloutContext:
+    """
+    The context windows of a batch of envs for one or more CloneTransformer
+    based models sharing a transformer config (e.g. the actor and critic of
+    TransformerPPOAgent).
+
+    Windows are (s, a, ..., s) over the last (n_ctx - 1) // 2 + 1 states,
+    left padded with zero observations and action_pad_token, with timesteps
+    counted from the start of each episode.
+    """
+
+    def __init__(
+        self,
+        models: List[CloneTransformer],
+        initial_obs: t.Tensor,
+        action_pad_token: int,
+        max_timestep: int,
+    ):
+        self.models = models
+        self.action_pad_token = action_pad_token
+        self.max_timestep = max_timestep
+        self.device = initial_obs.device
+        n_ctx = models[0].transformer_config.n_ctx
+        self.obs_timesteps = (n_ctx - 1) // 2 + 1
+        self.timestep_dtype = (
+            t.float32
+            if models[0].transformer_config.time_embedding_type == "linear"
+            else t.long
+        )
+
+        num_envs = initial_obs.shape[0]
+        self.timesteps = t.zeros(
+            (num_envs, 1), dtype=self.timestep_dtype, device=self.device
+        )
+        tokens = self.initial_tokens(initial_obs)
+        self.rings = [RingBuffer(model_tokens) for model_tokens in tokens]
+
+    def initial_tokens(self, obs: t.Tensor) -> List[t.Tensor]:
+        """Returns each model's padded windows ending at obs, at timestep 0."""
+        n = obs.shape[0]
+        states = t.zeros(
+            (n, self.obs_timesteps, *obs.shape[1:]),
+            dtype=obs.dtype,
+            device=self.device,
+        )
+        states[:, -1] = obs
+        actions = (
+            t.full(
+                (n, self.obs_timesteps - 1, 1),
+                self.action_pad_token,
+                dtype=t.long,
+                device=self.device,
+            )
+            if self.obs_timesteps > 1
+            else None
+        )
+        timesteps = t.zeros(
+            (n, self.obs_timesteps, 1),
+            dtype=self.timestep_dtype,
+            device=self.device,
+        )
+        return [
+            model.get_window_tokens(states, actions, timesteps)
+            for model in self.models
+        ]
+
+    def predict(self) -> List[t.Tensor]:
+        """Returns each model's prediction (e.g. logits, value) at the last state of every window."""
+        return [
+            model.predict_next_action(ring.window())
+            for model, ring in zip(self.models, self.rings)
+        ]
+
+    def append(self, next_obs: t.Tensor, action: t.Tensor) -> None:
+        """
+        Appends the action taken at every env's current state and the
+        observation that followed.
+        """
+        next_timesteps = self.timesteps + 1
+        assert (
+            next_timesteps.max() <= self.max_timestep
+        ), "episode ran longer than the time embedding supports"
+        for model, ring in zip(self.models, self.rings):
+            ring.extend(
+                model.get_step_tokens(
+                    next_obs, action[:, None], next_timesteps, self.timesteps
+                )
+            )
+        self.timesteps = next_timesteps
+
+    def reset(self, obs: t.Tensor, dones: np.ndarray) -> None:
+        """Restarts the windows of the envs in dones at their first observation obs."""
+        if not np.any(dones):
+            return
+        rows = t.as_tensor(np.flatnonzero(dones), device=self.device)
+        tokens = self.initial_tokens(obs[rows])
+        for ring, model_tokens in zip(self.rings, tokens):
+            ring.reset(rows, model_tokens)
+        self.timesteps[rows] = 0
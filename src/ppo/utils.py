@@ -14,6 +14,8 @@ from IPython.display import display
 
 import wandb
 from src.config import ConfigJsonEncoder
+from src.ppo.compute_adv_vectorized import GAE_BACKENDS
+from src.utils.compilation import COMPILE_MODES
 
 # import syncvectorenv
 
@@ -84,6 +86,13 @@ def parse_args():
     parser.add_argument(
         "--view_size", type=int, default=7, help="the size of the view"
     )
+    parser.add_argument(
+        "--vector_env",
+        type=str,
+        default="sync",
+        choices=["sync", "async", "shared_memory"],
+        help="how the vectorized environments are stepped: serially in this process, one subprocess per env, or one subprocess per env returning observations through shared memory",
+    )
     parser.add_argument(
         "--total_timesteps",
         type=int,
@@ -165,6 +174,18 @@ def parse_args():
         default=None,
         help="the path to the trajectory file",
     )
+    parser.add_argument(
+        "--trajectory_shard_size",
+        type=int,
+        default=None,
+        help="if set, trajectories are streamed to a directory of shards of this many steps instead of written at the end",
+    )
+    parser.add_argument(
+        "--trajectory_background_compression",
+        action="store_true",
+        default=False,
+        help="if toggled, trajectory shards are compressed and written in a background thread",
+    )
     parser.add_argument(
         "--fully_observed",
         action="store_true",
@@ -183,6 +204,45 @@ def parse_args():
         default=10,
         help="how many checkpoints are stored and uploaded to wandb during training",
     )
+    parser.add_argument(
+        "--memory_storage",
+        type=str,
+        default="list",
+        choices=["list", "preallocated"],
+        help="how rollout experiences are stored, preallocated writes each step into fixed (num_steps, num_envs, ...) tensors",
+    )
+    parser.add_argument(
+        "--gae_backend",
+        type=str,
+        default="loop",
+        choices=GAE_BACKENDS,
+        help="implementation of the advantage computation: python loop, torchscript reverse scan or chunked vectorized scan",
+    )
+    parser.add_argument(
+        "--pipeline_rollouts",
+        action="store_true",
+        default=False,
+        help="if toggled, the next rollout is collected in a background thread while the agent learns",
+    )
+    parser.add_argument(
+        "--max_policy_lag",
+        type=int,
+        default=1,
+        help="maximum number of updates between the weights a pipelined rollout was collected with and the weights that learn on it",
+    )
+    parser.add_argument(
+        "--fused_actor_critic",
+        action="store_true",
+        default=False,
+        help="if toggled, the fully connected agent computes its logits and values in one fused pass",
+    )
+    parser.add_argument(
+        "--compile_mode",
+        type=str,
+        default="none",
+        choices=COMPILE_MODES,
+        help="compile the fully connected agent's networks and PPO objective with torch.compile or TorchScript, falling back to eager if that fails",
+    )
 
     args = parser.parse_args()
     return args
@@ -200,8 +260,10 @@ def set_global_seeds(seed):
 def get_obs_preprocessor(obs_space):
     # handle cases where obs space is instance of gym.spaces.Box, gym.spaces.Dict, gym.spaces
 
+    # np.array(x, dtype=...) converts in a single copy, which also detaches the
+    # observation from the shared memory of a shared_memory vector env.
     if isinstance(obs_space, gym.spaces.Box):
-        return lambda x: np.array(x).astype(np.float32)
+        return lambda x: np.array(x, dtype=np.float32)
 
     elif isinstance(obs_space, gym.spaces.Dict):
         obs_space = obs_space.spaces
@@ -211,7 +273,7 @@ def get_obs_preprocessor(obs_space):
     elif isinstance(obs_space, gym.spaces.Discrete) or isinstance(
         obs_space, gym.spaces.MultiDiscrete
     ):
-        return lambda x: np.array(x).astype(np.float32)
+        return lambda x: np.array(x, dtype=np.float32)
 
     else:
         raise NotImplementedError(
@@ -221,8 +283,7 @@ def get_obs_preprocessor(obs_space):
 
 def preprocess_images(images, device=None):
     # Bug of Pytorch: very slow if not first converted to numpy array
-    images = np.array(images)
-    images = images.astype(np.float32)
+    images = np.array(images, dtype=np.float32)
     return images
 
 
@@ -40,7 +40,6 @@ def runner(args):
     warnings.filterwarnings("ignore", category=UserWarning)
     statistics = calibration_statistics(
         dt,
-        args.env_id,
         env_func,
         initial_rtg_range=np.linspace(
             args.initial_rtg_min,
@@ -52,6 +51,9 @@ def runner(args):
         ),
         trajectories=args.n_trajectories,
         num_envs=args.num_envs,
+        results_dir=args.results_dir,
+        num_workers=args.num_workers,
+        asynchronous=args.asynchronous,
     )
 
     fig = plot_calibration_statistics(statistics, show_spread=True, CI=0.95)
@@ -109,7 +111,25 @@ if __name__ == "__main__":
         "--num_envs",
         type=int,
         default=8,
-        help="How many environments to run in parallel",
+        help="How many environments to run in parallel for each initial RTG",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help="How many processes to split the initial RTGs between",
+    )
+    parser.add_argument(
+        "--results_dir",
+        type=str,
+        default=None,
+        help="Directory the results of each initial RTG are written to as they finish, finished RTGs are skipped on rerun",
+    )
+    parser.add_argument(
+        "--asynchronous",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Step the environments in subprocesses",
     )
     args = parser.parse_args()
 
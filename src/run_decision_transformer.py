@@ -49,11 +49,17 @@ if __name__ == "__main__":
         eval_frequency=args.eval_frequency,
         eval_episodes=args.eval_episodes,
         eval_num_envs=args.eval_num_envs,
+        compile_mode=args.compile_mode,
+        num_workers=args.num_workers,
+        persistent_workers=args.persistent_workers,
+        prefetch_factor=args.prefetch_factor,
+        pin_memory=args.pin_memory,
         initial_rtg=args.initial_rtg,
         prob_go_from_end=args.prob_go_from_end,
         eval_max_time_steps=args.eval_max_time_steps,
         track=args.track,
         convert_to_one_hot=args.convert_to_one_hot,
+        cache_preprocessed_observations=args.cache_preprocessed_observations,
         device=run_config.device
     )
 
@@ -35,6 +35,7 @@ if __name__ == "__main__":
         max_steps=args.max_steps,
         capture_video=args.capture_video,
         view_size=args.view_size,
+        vector_env=args.vector_env,
         device=run_config.device,
     )
 
@@ -54,8 +55,16 @@ if __name__ == "__main__":
         vf_coef=args.vf_coef,
         max_grad_norm=args.max_grad_norm,
         trajectory_path=args.trajectory_path,
+        trajectory_shard_size=args.trajectory_shard_size,
+        trajectory_background_compression=args.trajectory_background_compression,
         fully_observed=args.fully_observed,
         num_checkpoints=args.num_checkpoints,
+        memory_storage=args.memory_storage,
+        gae_backend=args.gae_backend,
+        pipeline_rollouts=args.pipeline_rollouts,
+        max_policy_lag=args.max_policy_lag,
+        fused_actor_critic=args.fused_actor_critic,
+        compile_mode=args.compile_mode,
         device=run_config.device,
     )
 
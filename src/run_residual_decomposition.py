@@ -0,0 +1,123 @@
+import argparse
+import logging
+
+import torch as t
+
+from src.decision_transformer.offline_dataset import (
+    TrajectoryDataset,
+    one_hot_encode_observation,
+)
+from src.decision_transformer.residual_decomposition import (
+    decompose_dataset,
+)
+from src.decision_transformer.utils import (
+    get_max_len_from_model_type,
+    load_decision_transformer,
+)
+from src.streamlit_app.constants import IDX_TO_ACTION
+
+logging.basicConfig(level=logging.INFO)
+
+ACTION_TO_IDX = {v: k for k, v in IDX_TO_ACTION.items()}
+
+
+def runner(args):
+    logger = logging.getLogger(__name__)
+
+    logger.info(f"Loading model from {args.model_path}")
+    device = t.device(args.device)
+    dt = load_decision_transformer(args.model_path).to(device)
+
+    logger.info(f"Loading trajectories from {args.trajectory_path}")
+    dataset = TrajectoryDataset(
+        trajectory_path=args.trajectory_path,
+        max_len=get_max_len_from_model_type(
+            dt.model_type, dt.transformer_config.n_ctx
+        ),
+        preprocess_observations=one_hot_encode_observation
+        if args.convert_to_one_hot
+        else None,
+        device=device,
+    )
+
+    weights = dt.action_predictor.weight.detach()
+    logit_dir = weights[ACTION_TO_IDX[args.positive_action]]
+    if args.negative_action is not None:
+        logit_dir = logit_dir - weights[ACTION_TO_IDX[args.negative_action]]
+
+    logger.info(
+        f"Decomposing {dataset.num_timesteps} states into {args.output_dir}"
+    )
+    decompose_dataset(
+        dt,
+        dataset,
+        logit_dir,
+        args.output_dir,
+        metadata={
+            "model_path": args.model_path,
+            "trajectory_path": args.trajectory_path,
+            "convert_to_one_hot": args.convert_to_one_hot,
+            "positive_action": args.positive_action,
+            "negative_action": args.negative_action,
+        },
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="Residual Decomposition of a Trajectory Dataset",
+        description="Write the contribution of every residual stream component to a logit direction, for every state of a dataset",
+    )
+    parser.add_argument(
+        "--model_path", type=str, default="models/dt.pt", help="Path to model"
+    )
+    parser.add_argument(
+        "--trajectory_path",
+        type=str,
+        required=True,
+        help="Path to the trajectories to decompose",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Directory the chunks are written to, finished chunks are skipped on rerun",
+    )
+    parser.add_argument(
+        "--positive_action",
+        type=str,
+        default="forward",
+        choices=list(ACTION_TO_IDX),
+        help="Action whose logit direction is decomposed",
+    )
+    parser.add_argument(
+        "--negative_action",
+        type=str,
+        default=None,
+        choices=list(ACTION_TO_IDX),
+        help="If set, decompose the positive minus this action's logit direction",
+    )
+    parser.add_argument(
+        "--convert_to_one_hot",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="One hot encode the observations, as for models trained with --convert_to_one_hot",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=65536,
+        help="Number of states per chunk file",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1024,
+        help="Number of states per forward pass",
+    )
+    parser.add_argument("--device", type=str, default="cpu")
+    args = parser.parse_args()
+
+    runner(args)
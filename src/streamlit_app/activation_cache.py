@@ -0,0 +1,105 @@
+"""
+Selective, memoized activation caches for the analysis components.
+
+Each component declares the hooks it reads as a cache spec: a tuple of hook
+name suffixes (e.g. "attn.hook_z" matches the hook_z of every layer). Only
+those activations are stored, and a run is reused for as long as the model
+and the tokens are the same, so widget interactions that don't change the
+context don't run the model again.
+
+Models are shared by the sessions (see model_registry), which run in
+separate threads. Interventions are passed as fwd_hooks and only attached
+for their own run, under the model's lock, so they never leak into the
+runs of another session.
+"""
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import torch as t
+
+from src.decision_transformer.residual_decomposition import (  # noqa: F401
+    RESIDUAL_DECOMP_SPEC,
+)
+
+ATTENTION_PATTERN_SPEC = ("attn.hook_pattern", "attn.hook_attn_scores")
+ATTENTION_SCORES_SPEC = ("attn.hook_attn_scores",)
+
+# the runs of each model, dropped when the model is. Models are shared by
+# the sessions (see model_registry), which run in separate threads
+_MEMO = weakref.WeakKeyDictionary()
+_MEMO_LOCK = threading.Lock()
+MEMO_SIZE = 8
+_MODEL_LOCKS = weakref.WeakKeyDictionary()
+
+
+def combine_specs(*specs):
+    """Returns a spec recording the hooks of all the given specs."""
+    return tuple(sorted(set().union(*specs)))
+
+
+def hash_tokens(tokens: t.Tensor) -> str:
+    tokens = tokens.detach().cpu().contiguous()
+    digest = hashlib.sha1(tokens.numpy().tobytes()).hexdigest()
+    return f"{digest}-{tuple(tokens.shape)}-{tokens.dtype}"
+
+
+def has_hooks(dt) -> bool:
+    """Whether hooks are attached to the model (e.g. an ablation), which changes its outputs."""
+    return any(
+        hook_point.fwd_hooks or hook_point.bwd_hooks
+        for hook_point in dt.transformer.hook_dict.values()
+    )
+
+
+def model_lock(dt) -> threading.Lock:
+    """The lock held while dt runs, so hooks attached for one run see no other."""
+    with _MEMO_LOCK:
+        return _MODEL_LOCKS.setdefault(dt, threading.Lock())
+
+
+def run_with_selective_cache(dt, tokens, spec, fwd_hooks=None):
+    """
+    Runs the transformer on tokens, caching only the hooks in spec.
+
+    Results are memoized by (model, tokens, spec), except for runs with
+    fwd_hooks or while hooks are attached to the model. Memoized caches are
+    shared, so don't modify them.
+
+    Args:
+    - dt: the decision transformer.
+    - tokens (t.Tensor): (batch, position, d_model) the input token embeddings.
+    - spec (tuple of str): the suffixes of the hook names to cache.
+    - fwd_hooks (list, optional): (hook name, function) pairs attached for this run only, e.g. an ablation.
+
+    Returns:
+    - (t.Tensor, ActivationCache): the output residual stream and the cache.
+    """
+    if fwd_hooks or has_hooks(dt):
+        return _run(dt, tokens, spec, fwd_hooks or [])
+
+    key = (hash_tokens(tokens), spec)
+    with _MEMO_LOCK:
+        runs = _MEMO.setdefault(dt, OrderedDict())
+        if key in runs:
+            runs.move_to_end(key)
+            return runs[key]
+
+    run = _run(dt, tokens, spec)
+    with _MEMO_LOCK:
+        runs[key] = run
+        if len(runs) > MEMO_SIZE:
+            runs.popitem(last=False)
+    return run
+
+
+def _run(dt, tokens, spec, fwd_hooks=()):
+    with model_lock(dt), t.no_grad():
+        # the hooks are removed when the run ends, even if it fails
+        with dt.transformer.hooks(fwd_hooks=list(fwd_hooks)):
+            return dt.transformer.run_with_cache(
+                tokens,
+                names_filter=lambda name: name.endswith(spec),
+                remove_batch_dim=False,
+            )
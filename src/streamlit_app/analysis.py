@@ -1,27 +1,7 @@
-import streamlit as st
-import torch as t
-
-
-def name_residual_components(dt, cache):
-    """
-    Returns a list of keys for the residual components of the decision transformer which contribute to the final residual decomp
-    """
-    result = [
-        "input_tokens",  # this will be block.0.resid_pre - hook_pos_embed
-        "hook_pos_embed",
-    ]
-
-    n_layers = dt.transformer_config.n_layers
-
-    # start with input
-    for layer in range(n_layers):
-        # add the residual components from the attention layer
-        result.append(f"blocks.{layer}.attn.hook_z")
-        result.append(f"transformer.blocks.{layer}.attn.b_O")
-        # add the residual components from the mlp layer
-        result.append(f"blocks.{layer}.hook_mlp_out")
-
-    return result
+from src.decision_transformer.residual_decomposition import (
+    residual_component_names,
+    residual_decomposition,
+)
 
 
 def get_residual_decomp(
@@ -33,39 +13,20 @@ def get_residual_decomp(
     include_attention_bias=False,
 ):
     """
-    Returns the residual decomposition for the decision transformer
+    Returns the residual decomposition for the decision transformer, see
+    residual_decomposition.
     """
-    decomp = {}
-    n_heads = dt.transformer_config.n_heads
-    state_dict = dt.state_dict()
-    # get the residual components
-    residual_components = name_residual_components(dt, cache)
-
-    for component in residual_components:
-        if component == "hook_pos_embed":
-            decomp[component] = cache[component][:, seq_pos] @ logit_dir
-        elif component == "input_tokens":
-            decomp[component] = (
-                (cache["blocks.0.hook_resid_pre"] - cache["hook_pos_embed"])
-                @ logit_dir
-            )[:, seq_pos]
-        elif component.endswith(".hook_z"):
-            for head in range(n_heads):
-                layer = int(component.split(".")[1])
-                output = (
-                    cache[component][:, seq_pos, head, :]
-                    @ dt.transformer.blocks[layer].attn.W_O[head]
-                )
-                decomp[component + f".{head}"] = output @ logit_dir
-
-        elif component.endswith(".hook_mlp_out"):
-            decomp[component] = cache[component][:, seq_pos, :] @ logit_dir
-        elif component.endswith(".b_O"):
-            if include_attention_bias:
-                decomp[component] = state_dict[component] @ logit_dir
-
-    for k in decomp:
-        decomp[k] = decomp[k].detach().numpy()
+    contributions = (
+        residual_decomposition(dt, cache, logit_dir, seq_pos)
+        .detach()
+        .cpu()
+        .numpy()
+    )
+    decomp = {
+        component: contributions[:, i]
+        for i, component in enumerate(residual_component_names(dt))
+        if include_attention_bias or not component.endswith(".b_O")
+    }
 
     if nice_names:
         decomp = get_nice_names(decomp)
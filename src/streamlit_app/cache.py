@@ -0,0 +1,23 @@
+"""
+Caching of the app's static analysis results across Streamlit reruns.
+
+Every widget interaction reruns app.py, but the static circuits only change
+when the model does. Results are keyed on the model path, the model itself
+is passed as an unhashed (underscored) argument. The forward pass of the
+current context is memoized separately, see activation_cache.
+"""
+import streamlit as st
+
+# st.cache_data and st.cache_resource replace the experimental decorators
+# from streamlit 1.18
+cache_data = getattr(st, "cache_data", None) or st.experimental_memo
+cache_resource = (
+    getattr(st, "cache_resource", None) or st.experimental_singleton
+)
+
+# results kept per cached function, shared by every session
+MAX_ENTRIES = 16
+
+
+def get_model_path():
+    return st.session_state.get("model_path")
@@ -1,8 +1,13 @@
+import pandas as pd
+import plotly.express as px
 import streamlit as st
+import torch as t
 from torchtyping import TensorType as TT
 from transformer_lens.hook_points import HookPoint
 
+from .activation_cache import RESIDUAL_DECOMP_SPEC, model_lock
 from .analysis import get_residual_decomp
+from .constants import IDX_TO_ACTION
 from .environment import get_action_preds
 from .visualizations import (
     plot_action_preds,
@@ -28,17 +33,22 @@ def show_ablation(dt, logit_dir, original_cache):
         with columns[3]:
             ablate_to_mean = st.checkbox("Ablate to mean", value=True)
 
+        # the model is shared between sessions, so the hook is only
+        # attached for this forward pass
         if component == "HEAD":
-            ablation_func = get_ablation_function(ablate_to_mean, head)
-            dt.transformer.blocks[layer].attn.hook_z.add_hook(ablation_func)
+            ablation_hook = (
+                f"blocks.{layer}.attn.hook_z",
+                get_ablation_function(ablate_to_mean, head),
+            )
         elif component == "MLP":
-            ablation_func = get_ablation_function(
-                ablate_to_mean, layer, component="MLP"
+            ablation_hook = (
+                f"blocks.{layer}.hook_mlp_out",
+                get_ablation_function(ablate_to_mean, layer, component="MLP"),
             )
-            dt.transformer.blocks[layer].hook_mlp_out.add_hook(ablation_func)
 
-        action_preds, x, cache, tokens = get_action_preds(dt)
-        dt.transformer.reset_hooks()
+        action_preds, x, cache, tokens = get_action_preds(
+            dt, cache_spec=RESIDUAL_DECOMP_SPEC, fwd_hooks=[ablation_hook]
+        )
         if st.checkbox("show action predictions"):
             plot_action_preds(action_preds)
         if st.checkbox("show counterfactual residual contributions"):
@@ -52,6 +62,22 @@ def show_ablation(dt, logit_dir, original_cache):
                 original_residual_decomp, ablation_residual_decomp
             )
 
+        if st.checkbox("show the ablation of every component"):
+            _, _, _, tokens = get_action_preds(dt)
+            effects = get_ablation_effects(
+                dt, tokens, logit_dir, ablate_to_mean
+            )
+            fig = px.imshow(
+                effects.pivot(
+                    index="Layer", columns="Component", values="Effect"
+                ),
+                color_continuous_midpoint=0,
+                color_continuous_scale=px.colors.diverging.RdBu,
+                title="Change in Logit Direction when Ablated",
+            )
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(effects)
+
     # then, render a single residual stream contribution with the ablation
 
 
@@ -60,8 +86,6 @@ def get_ablation_function(ablate_to_mean, head_to_ablate, component="HEAD"):
         value: TT["batch", "pos", "head_index", "d_head"],  # noqa: F821
         hook: HookPoint,
     ) -> TT["batch", "pos", "head_index", "d_head"]:  # noqa: F821
-        print(f"Shape of the value tensor: {value.shape}")
-
         if ablate_to_mean:
             value[:, :, head_to_ablate, :] = value[
                 :, :, head_to_ablate, :
@@ -73,8 +97,6 @@ def get_ablation_function(ablate_to_mean, head_to_ablate, component="HEAD"):
     def mlp_ablation_hook(
         value: TT["batch", "pos", "d_model"], hook: HookPoint  # noqa: F821
     ) -> TT["batch", "pos", "d_model"]:  # noqa: F821
-        print(f"Shape of the value tensor: {value.shape}")
-
         if ablate_to_mean:
             value[:, :, :] = value[:, :, :].mean(dim=2, keepdim=True)
         else:
@@ -85,3 +107,113 @@ def get_ablation_function(ablate_to_mean, head_to_ablate, component="HEAD"):
         return head_ablation_hook
     elif component == "MLP":
         return mlp_ablation_hook
+
+
+def get_batched_ablation_hooks(ablate_to_mean, head_rows, mlp_rows):
+    """
+    Returns forward hooks which each ablate one component in some rows of
+    the batch, as get_ablation_function does for the whole batch.
+
+    Args:
+    - ablate_to_mean (bool): ablate to the mean instead of zero.
+    - head_rows (dict): layer -> (rows, heads), the head ablated in each row.
+    - mlp_rows (dict): layer -> rows in which the mlp is ablated.
+    """
+
+    def head_ablation_hook(
+        value: TT["batch", "pos", "head_index", "d_head"],  # noqa: F821
+        hook: HookPoint,
+    ) -> TT["batch", "pos", "head_index", "d_head"]:  # noqa: F821
+        rows, heads = head_rows[hook.layer()]
+        ablated = value[rows, :, heads]  # (rows, pos, d_head)
+        if ablate_to_mean:
+            mean = ablated.mean(dim=-1, keepdim=True)
+            value[rows, :, heads] = mean.expand(ablated.shape)
+        else:
+            value[rows, :, heads] = 0.0
+        return value
+
+    def mlp_ablation_hook(
+        value: TT["batch", "pos", "d_model"], hook: HookPoint  # noqa: F821
+    ) -> TT["batch", "pos", "d_model"]:  # noqa: F821
+        rows = mlp_rows[hook.layer()]
+        if ablate_to_mean:
+            value[rows] = value[rows].mean(dim=-1, keepdim=True)
+        else:
+            value[rows] = 0.0
+        return value
+
+    return [
+        (f"blocks.{layer}.attn.hook_z", head_ablation_hook)
+        for layer in head_rows
+    ] + [
+        (f"blocks.{layer}.hook_mlp_out", mlp_ablation_hook)
+        for layer in mlp_rows
+    ]
+
+
+def get_ablation_effects(dt, tokens, logit_dir, ablate_to_mean=True):
+    """
+    Ablates every head and every mlp of the model, one at a time, in a
+    single forward pass: the context is repeated along the batch, row 0 is
+    left intact and every other row has one component ablated.
+
+    Args:
+    - dt: the decision transformer.
+    - tokens (t.Tensor): (1, position, d_model) the tokens of the current context.
+    - logit_dir (t.Tensor): (d_model) the direction the effects are measured in.
+    - ablate_to_mean (bool): ablate to the mean instead of zero.
+
+    Returns:
+    - pd.DataFrame: one row per component with its layer, name, the logit direction and action logits at the last state when it is ablated, and the change in the logit direction (Effect).
+    """
+    n_layers = dt.transformer_config.n_layers
+    n_heads = dt.transformer_config.n_heads
+
+    components = [
+        (layer, f"Head {head}", head)
+        for layer in range(n_layers)
+        for head in range(n_heads)
+    ] + [(layer, "MLP", None) for layer in range(n_layers)]
+
+    head_rows, mlp_rows = {}, {}
+    for row, (layer, _, head) in enumerate(components, start=1):
+        if head is None:
+            mlp_rows.setdefault(layer, []).append(row)
+        else:
+            rows, heads = head_rows.setdefault(layer, ([], []))
+            rows.append(row)
+            heads.append(head)
+    head_rows = {
+        layer: (t.tensor(rows), t.tensor(heads))
+        for layer, (rows, heads) in head_rows.items()
+    }
+    mlp_rows = {layer: t.tensor(rows) for layer, rows in mlp_rows.items()}
+
+    batch = tokens.repeat(len(components) + 1, 1, 1)
+    # hooks are attached to the shared model for this run only
+    with model_lock(dt), t.no_grad():
+        x = dt.transformer.run_with_hooks(
+            batch,
+            fwd_hooks=get_batched_ablation_hooks(
+                ablate_to_mean, head_rows, mlp_rows
+            ),
+        )
+        # the last token is the current state
+        logit_dir_proj = x[:, -1] @ logit_dir
+        action_logits = dt.predict_actions(x[:, -1])
+
+    df = pd.DataFrame(
+        action_logits[1:].cpu().numpy(),
+        columns=[
+            IDX_TO_ACTION.get(i, str(i))
+            for i in range(action_logits.shape[1])
+        ],
+    )
+    df.insert(0, "Layer", [layer for layer, _, _ in components])
+    df.insert(1, "Component", [name for _, name, _ in components])
+    df.insert(2, "Logit Dir", logit_dir_proj[1:].cpu().numpy())
+    df.insert(
+        3, "Effect", (logit_dir_proj[1:] - logit_dir_proj[0]).cpu().numpy()
+    )
+    return df
@@ -8,6 +8,12 @@ from minigrid.core.constants import IDX_TO_COLOR, IDX_TO_OBJECT
 
 from src.decision_transformer.utils import get_max_len_from_model_type
 
+from .activation_cache import (
+    ATTENTION_SCORES_SPEC,
+    RESIDUAL_DECOMP_SPEC,
+    combine_specs,
+    run_with_selective_cache,
+)
 from .analysis import get_residual_decomp
 from .constants import (
     IDX_TO_ACTION,
@@ -74,6 +80,11 @@ def show_residual_stream_contributions_single(dt, cache, logit_dir):
     return
 
 
+RTG_SCAN_CACHE_SPEC = combine_specs(
+    RESIDUAL_DECOMP_SPEC, ATTENTION_SCORES_SPEC
+)
+
+
 def show_rtg_scan(dt, logit_dir):
     with st.expander("Scan Reward-to-Go and Show Residual Contributions"):
         batch_size = 1028
@@ -159,9 +170,7 @@ def show_rtg_scan(dt, logit_dir):
 
         # print out shape of each
         tokens = dt.to_tokens(obs, actions, rtg, timesteps)
-        x, cache = dt.transformer.run_with_cache(
-            tokens, remove_batch_dim=False
-        )
+        x, cache = run_with_selective_cache(dt, tokens, RTG_SCAN_CACHE_SPEC)
         state_preds, action_preds, reward_preds = dt.get_logits(
             x,
             batch_size=batch_size,
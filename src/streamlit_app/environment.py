@@ -1,44 +1,53 @@
 import math
 
-import json
 import gymnasium as gym
 import minigrid
 import streamlit as st
 import torch as t
 
-from src.config import EnvironmentConfig
 from src.models.trajectory_transformer import (
     DecisionTransformer,
     CloneTransformer,
 )
 
-from src.decision_transformer.utils import (
-    load_decision_transformer,
-    get_max_len_from_model_type,
-)
+from src.decision_transformer.utils import get_max_len_from_model_type
 from src.environments.environments import make_env
 
+from .activation_cache import (
+    ATTENTION_PATTERN_SPEC,
+    RESIDUAL_DECOMP_SPEC,
+    combine_specs,
+    run_with_selective_cache,
+)
+from .model_registry import get_model_registry
 
-@st.cache(allow_output_mutation=True)
-def get_env_and_dt(model_path):
-    # we need to one if the env was one hot encoded. Some tech debt here.
-    state_dict = t.load(model_path)
+# what the components reading the cache of the current context need
+DEFAULT_CACHE_SPEC = combine_specs(
+    RESIDUAL_DECOMP_SPEC, ATTENTION_PATTERN_SPEC
+)
 
-    env_config = state_dict["environment_config"]
-    env_config = EnvironmentConfig(**json.loads(env_config))
 
-    env = make_env(env_config, seed=4200, idx=0, run_name="dev")
+def get_env_and_dt(model_path):
+    """
+    Returns a new environment for this session and the model, which is
+    shared with the other sessions through the model registry.
+    """
+    dt = get_model_registry().get(model_path)
+    env = make_env(dt.environment_config, seed=4200, idx=0, run_name="dev")
     env = env()
-
-    dt = load_decision_transformer(model_path, env)
-    if not hasattr(dt, "n_ctx"):
-        dt.n_ctx = dt.transformer_config.n_ctx
-    if not hasattr(dt, "time_embedding_type"):
-        dt.time_embedding_type = dt.transformer_config.time_embedding_type
     return env, dt
 
 
-def get_action_preds(dt):
+def get_action_preds(dt, cache_spec=DEFAULT_CACHE_SPEC, fwd_hooks=None):
+    """
+    Returns the action predictions of the current context, along with the
+    output residual stream, an activation cache of the hooks in cache_spec
+    (see activation_cache) and the input tokens.
+
+    The forward pass is memoized by run_with_selective_cache, so reruns
+    with the same model and context don't run the transformer again.
+    fwd_hooks (e.g. an ablation) are attached for this forward pass only.
+    """
     # so we can ignore older models when making updates
 
     max_len = get_max_len_from_model_type(
@@ -76,7 +85,9 @@ def get_action_preds(dt):
         timesteps = timesteps.to(dtype=t.long)
 
     tokens = dt.to_tokens(obs, actions, rtg, timesteps)
-    x, cache = dt.transformer.run_with_cache(tokens, remove_batch_dim=False)
+    x, cache = run_with_selective_cache(
+        dt, tokens, cache_spec, fwd_hooks=fwd_hooks
+    )
 
     state_preds, action_preds, reward_preds = dt.get_logits(
         x, batch_size=1, seq_length=obs.shape[1], no_actions=actions is None
@@ -0,0 +1,79 @@
+"""
+The models of model_index, loaded on demand and shared by every session.
+
+Each checkpoint is loaded once (onto the cpu, see load_decision_transformer)
+and kept while the registry is under its memory budget, evicting the least
+recently used models first. Sessions still holding an evicted model keep it
+until they load another one.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+from src.decision_transformer.utils import load_decision_transformer
+
+from .cache import cache_resource
+from .model_index import model_index
+
+# the budget can be set per deployment, in MB
+DEFAULT_MEMORY_BUDGET = (
+    int(os.environ.get("DT_MODEL_CACHE_MB", 2048)) * 1024**2
+)
+
+
+def model_size(model) -> int:
+    """Returns the bytes taken by the parameters and buffers of model."""
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for tensor in list(model.parameters()) + list(model.buffers())
+    )
+
+
+class ModelRegistry:
+    def __init__(self, index=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+        """
+        Args:
+        - index (dict): model path -> name of the models that can be loaded, model_index by default.
+        - memory_budget (int): the bytes the loaded models may take, the most recently used model is always kept.
+        """
+        self.index = model_index if index is None else index
+        self.memory_budget = memory_budget
+        self.models = OrderedDict()
+        # sessions run in separate threads
+        self.lock = threading.Lock()
+
+    def get(self, model_path):
+        if model_path not in self.index:
+            raise KeyError(f"{model_path} is not in the model index")
+        with self.lock:
+            if model_path in self.models:
+                self.models.move_to_end(model_path)
+                return self.models[model_path]
+
+            dt = load_decision_transformer(model_path)
+            # so we can ignore older models when making updates
+            if not hasattr(dt, "n_ctx"):
+                dt.n_ctx = dt.transformer_config.n_ctx
+            if not hasattr(dt, "time_embedding_type"):
+                dt.time_embedding_type = (
+                    dt.transformer_config.time_embedding_type
+                )
+            self.models[model_path] = dt
+            self.evict()
+            return dt
+
+    def memory_used(self) -> int:
+        return sum(model_size(dt) for dt in self.models.values())
+
+    def evict(self):
+        """Drops the least recently used models until the rest fit the budget."""
+        while (
+            len(self.models) > 1
+            and self.memory_used() > self.memory_budget
+        ):
+            self.models.popitem(last=False)
+
+
+@cache_resource
+def get_model_registry() -> ModelRegistry:
+    return ModelRegistry()
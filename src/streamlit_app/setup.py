@@ -45,6 +45,7 @@ def initialize_playground(model_path, initial_rtg):
         st.session_state.a = actions
         st.session_state.timesteps = timesteps
         st.session_state.dt = dt
+        st.session_state.model_path = model_path
 
     else:
         env = st.session_state.env
@@ -4,6 +4,7 @@ import torch as t
 from fancy_einsum import einsum
 from minigrid.core.constants import IDX_TO_COLOR, IDX_TO_OBJECT, STATE_TO_IDX
 
+from .cache import MAX_ENTRIES, cache_data, get_model_path
 from .constants import (
     IDX_TO_ACTION,
     IDX_TO_STATE,
@@ -13,6 +14,73 @@ from .constants import (
 from .utils import fancy_histogram, fancy_imshow
 
 
+@cache_data(max_entries=MAX_ENTRIES)
+def get_qk_circuit(model_path, _dt):
+    """Returns the QK circuit from the state to the RTG embedding of each head."""
+    W_E_rtg = _dt.reward_embedding[0].weight
+    W_E_state = _dt.state_embedding.weight
+    W_Q = _dt.transformer.blocks[0].attn.W_Q
+    W_K = _dt.transformer.blocks[0].attn.W_K
+
+    W_QK = einsum(
+        "head d_mod_Q d_head, head d_mod_K d_head -> head d_mod_Q d_mod_K",
+        W_Q,
+        W_K,
+    )
+
+    # W_QK_full = W_E_rtg.T @ W_QK @ W_E_state
+    W_QK_full = W_E_state.T @ W_QK @ W_E_rtg
+
+    n_heads = _dt.transformer_config.n_heads
+    height, width, channels = _dt.environment_config.observation_space[
+        "image"
+    ].shape
+    return (
+        W_QK_full.reshape(n_heads, 1, channels, height, width)
+        .detach()
+        .numpy()
+    )
+
+
+@cache_data(max_entries=MAX_ENTRIES)
+def get_ov_circuit(model_path, _dt):
+    """Returns the OV circuit from the state embedding to the action logits of each head."""
+    W_U = _dt.action_predictor.weight
+    W_O = _dt.transformer.blocks[0].attn.W_O
+    W_V = _dt.transformer.blocks[0].attn.W_V
+    W_E = _dt.state_embedding.weight
+    W_OV = W_V @ W_O
+
+    OV_circuit_full = W_E.T @ W_OV @ W_U.T
+
+    height, width, channels = _dt.environment_config.observation_space[
+        "image"
+    ].shape
+    n_actions = W_U.shape[0]
+    n_heads = _dt.transformer_config.n_heads
+    return (
+        OV_circuit_full.reshape(n_heads, channels, height, width, n_actions)
+        .detach()
+        .numpy()
+    )
+
+
+@cache_data(max_entries=MAX_ENTRIES)
+def get_time_embedding_similarity(model_path, _dt):
+    """Returns the cosine similarity of every pair of time embeddings."""
+    if _dt.time_embedding_type == "linear":
+        time_steps = t.arange(100).unsqueeze(0).unsqueeze(-1).to(t.float32)
+        time_embeddings = _dt.get_time_embeddings(time_steps).squeeze(0)
+    else:
+        time_embeddings = _dt.time_embedding.weight
+
+    # normalize the embeddings, their dot products are the similarities
+    normalized = time_embeddings / t.norm(
+        time_embeddings, dim=1, keepdim=True
+    )
+    return (normalized @ normalized.T).detach().numpy()
+
+
 def show_qk_circuit(dt):
     with st.expander("show QK circuit"):
         st.write(
@@ -26,28 +94,11 @@ def show_qk_circuit(dt):
             """
         )
 
-        W_E_rtg = dt.reward_embedding[0].weight
-        W_E_state = dt.state_embedding.weight
-        W_Q = dt.transformer.blocks[0].attn.W_Q
-        W_K = dt.transformer.blocks[0].attn.W_K
-
-        W_QK = einsum(
-            "head d_mod_Q d_head, head d_mod_K d_head -> head d_mod_Q d_mod_K",
-            W_Q,
-            W_K,
-        )
-        # st.write(W_QK.shape)
-
-        # W_QK_full = W_E_rtg.T @ W_QK @ W_E_state
-        W_QK_full = W_E_state.T @ W_QK @ W_E_rtg
-
         n_heads = dt.transformer_config.n_heads
         height, width, channels = dt.environment_config.observation_space[
             "image"
         ].shape
-        W_QK_full_reshaped = W_QK_full.reshape(
-            n_heads, 1, channels, height, width
-        )
+        W_QK_full_reshaped = get_qk_circuit(get_model_path(), dt)
 
         selection_columns = st.columns(2)
 
@@ -89,9 +140,7 @@ def show_qk_circuit(dt):
             for i, channel in enumerate(selected_channels):
                 with columns[i]:
                     fancy_imshow(
-                        W_QK_full_reshaped[head, 0, channel]
-                        .T.detach()
-                        .numpy(),
+                        W_QK_full_reshaped[head, 0, channel].T,
                         color_continuous_midpoint=0,
                     )
 
@@ -106,23 +155,12 @@ def show_ov_circuit(dt):
             """
         )
 
-        W_U = dt.action_predictor.weight
-        W_O = dt.transformer.blocks[0].attn.W_O
-        W_V = dt.transformer.blocks[0].attn.W_V
-        W_E = dt.state_embedding.weight
-        W_OV = W_V @ W_O
-
-        # st.plotly_chart(px.imshow(W_OV.detach().numpy(), facet_col=0), use_container_width=True)
-        OV_circuit_full = W_E.T @ W_OV @ W_U.T
-
         height, width, channels = dt.environment_config.observation_space[
             "image"
         ].shape
-        n_actions = W_U.shape[0]
+        n_actions = dt.action_predictor.weight.shape[0]
         n_heads = dt.transformer_config.n_heads
-        OV_circuit_full_reshaped = OV_circuit_full.reshape(
-            n_heads, channels, height, width, n_actions
-        )
+        OV_circuit_full_reshaped = get_ov_circuit(get_model_path(), dt)
 
         if channels == 3:
 
@@ -176,9 +214,7 @@ def show_ov_circuit(dt):
                         fancy_imshow(
                             OV_circuit_full_reshaped[
                                 head, channel, :, :, action
-                            ]
-                            .T.detach()
-                            .numpy(),
+                            ].T,
                             color_continuous_midpoint=0,
                         )
 
@@ -221,23 +257,10 @@ def show_time_embeddings(dt, logit_dir):
             )
         st.plotly_chart(fig, use_container_width=True)
 
-        def calc_cosine_similarity_matrix(matrix: t.Tensor) -> t.Tensor:
-            # Check if the input matrix is square
-            # assert matrix.shape[0] == matrix.shape[1], "The input matrix must be square."
-
-            # Normalize the column vectors
-            norms = t.norm(
-                matrix, dim=0
-            )  # Compute the norms of the column vectors
-            normalized_matrix = (
-                matrix / norms
-            )  # Normalize the column vectors by dividing each element by the corresponding norm
-
-            # Compute the cosine similarity matrix using matrix multiplication
-            return t.matmul(normalized_matrix.t(), normalized_matrix)
-
-        similarity_matrix = calc_cosine_similarity_matrix(time_embeddings.T)
-        st.plotly_chart(px.imshow(similarity_matrix.detach().numpy()))
+        similarity_matrix = get_time_embedding_similarity(
+            get_model_path(), dt
+        )[: max_timestep + 1, : max_timestep + 1]
+        st.plotly_chart(px.imshow(similarity_matrix))
 
 
 def show_rtg_embeddings(dt, logit_dir):
@@ -0,0 +1,110 @@
+"""
+Columnar on-disk format for trajectories.
+
+A trajectory directory (path ending in .traj) holds one .npy file per field,
+with the timesteps of each episode stored contiguously:
+
+    observations.npy      (num_timesteps, *obs_shape), uint8 when lossless
+    actions.npy           (num_timesteps,) int64
+    rewards.npy           (num_timesteps,) float32
+    dones.npy             (num_timesteps,) bool
+    truncated.npy         (num_timesteps,) bool
+    episode_offsets.npy   (num_episodes + 1,) int64, episode i is [offsets[i], offsets[i + 1])
+    metadata.json         the writer's metadata and the dtype/shape of every column
+
+The columns can be memory mapped, so nothing is loaded until it is indexed.
+Infos are not stored.
+"""
+import json
+import os
+
+import numpy as np
+
+from src.config import ConfigJsonEncoder
+
+from .trajectory_utils import compact_observations
+
+COLUMNAR_SUFFIX = ".traj"
+COLUMNS = ["observations", "actions", "rewards", "dones", "truncated"]
+
+
+def is_columnar_path(path: str) -> bool:
+    return path.rstrip("/").endswith(COLUMNAR_SUFFIX)
+
+
+def to_episode_major(data: dict) -> dict:
+    """
+    Reorders (t, b, ...) rollout arrays into the columnar layout.
+
+    Every env's timesteps are made contiguous ((t, b) -> (b t)) and episodes
+    end wherever an env is done or truncated.
+
+    Args:
+    - data (dict): the arrays (or lists of arrays) accumulated by TrajectoryWriter, indexed by time t and env b.
+
+    Returns:
+    - dict: the columns and their episode_offsets.
+    """
+    columns = {}
+    for name in COLUMNS:
+        column = np.asarray(data[name])
+        columns[name] = np.swapaxes(column, 0, 1).reshape(-1, *column.shape[2:])
+
+    observations = compact_observations(columns["observations"])
+    if observations.dtype != np.uint8:
+        observations = observations.astype(np.float32)
+    columns["observations"] = observations
+    columns["actions"] = columns["actions"].astype(np.int64)
+    columns["rewards"] = columns["rewards"].astype(np.float32)
+    columns["dones"] = columns["dones"].astype(bool)
+    columns["truncated"] = columns["truncated"].astype(bool)
+
+    num_timesteps = columns["actions"].shape[0]
+    episode_ends = np.flatnonzero(columns["dones"] | columns["truncated"]) + 1
+    columns["episode_offsets"] = np.unique(
+        np.concatenate([[0], episode_ends, [num_timesteps]])
+    ).astype(np.int64)
+    return columns
+
+
+def write_columnar_trajectories(path: str, columns: dict, metadata: dict):
+    """
+    Writes columns (see to_episode_major) and metadata to a trajectory directory.
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(path, f"{name}.npy"), column)
+
+    sidecar = {
+        "metadata": metadata,
+        "columns": {
+            name: {"dtype": str(column.dtype), "shape": list(column.shape)}
+            for name, column in columns.items()
+        },
+    }
+    with open(os.path.join(path, "metadata.json"), "w") as f:
+        json.dump(sidecar, f, cls=ConfigJsonEncoder)
+
+
+def read_columnar_trajectories(path: str, mmap: bool = True) -> dict:
+    """
+    Reads a trajectory directory.
+
+    Args:
+    - path (str): the trajectory directory.
+    - mmap (bool): if True the columns are memory mapped (copy on write, so they can back tensors) instead of loaded.
+
+    Returns:
+    - dict: {"data": columns including episode_offsets, "metadata": metadata}.
+    """
+    with open(os.path.join(path, "metadata.json")) as f:
+        sidecar = json.load(f)
+
+    data = {
+        name: np.load(
+            os.path.join(path, f"{name}.npy"),
+            mmap_mode="c" if mmap else None,
+        )
+        for name in sidecar["columns"]
+    }
+    return {"data": data, "metadata": sidecar["metadata"]}
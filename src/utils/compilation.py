@@ -0,0 +1,138 @@
+"""
+Optional compilation of models and step functions.
+
+compile_mode is one of:
+- "none": run eagerly.
+- "compile": torch.compile, compiled on the first call (or the warm-up).
+- "script": TorchScript, only works for scriptable modules and functions.
+
+Compilation never stops a run: if a model can't be compiled, here or when
+torch.compile traces it on a later call, a warning is emitted and the
+eager version is used from then on.
+"""
+import functools
+import os
+import types
+import warnings
+from typing import Callable, Optional
+
+import torch as t
+
+COMPILE_MODES = ["none", "compile", "script"]
+
+
+def enable_compile_cache(cache_dir: Optional[str] = None) -> None:
+    """
+    Keeps torch.compile's compiled graphs on disk, so later runs with the
+    same models skip most of the compilation.
+    """
+    if cache_dir is not None:
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", cache_dir)
+    try:
+        import torch._inductor.config as inductor_config
+
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+
+
+def with_fallback(compiled: Callable, eager: Callable, name: str) -> Callable:
+    """Calls compiled, switching to eager for good once it raises."""
+    failed = False
+
+    @functools.wraps(eager)
+    def call(*args, **kwargs):
+        nonlocal failed
+        if not failed:
+            try:
+                return compiled(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                warnings.warn(
+                    f"Compiled {name} failed ({type(e).__name__}: {e}), running it eagerly."
+                )
+        return eager(*args, **kwargs)
+
+    return call
+
+
+def compile_function(
+    fn: Callable, compile_mode: str, name: Optional[str] = None
+) -> Callable:
+    """
+    Returns fn compiled with compile_mode, or fn itself if it can't be.
+    """
+    assert compile_mode in COMPILE_MODES, f"compile_mode must be one of {COMPILE_MODES}"
+    name = name or getattr(fn, "__name__", "function")
+    if compile_mode == "none":
+        return fn
+    try:
+        if compile_mode == "script":
+            return t.jit.script(fn)
+        enable_compile_cache()
+        compiled = t.compile(fn)
+    except Exception as e:
+        warnings.warn(
+            f"Could not {compile_mode} {name} ({type(e).__name__}: {e}), running it eagerly."
+        )
+        return fn
+    return with_fallback(compiled, fn, name)
+
+
+def compile_module(
+    module: t.nn.Module,
+    compile_mode: str,
+    example_inputs: Optional[tuple] = None,
+) -> t.nn.Module:
+    """
+    Compiles the forward of module and warms it up on example_inputs.
+
+    With "compile" the module itself is returned with its forward replaced,
+    so its parameters, state dict and submodules are unchanged and copies
+    (e.g. deepcopy) run their own weights through the compiled code. With
+    "script" a ScriptModule sharing the module's parameters is returned,
+    which has the same state dict for plain nn.Sequential models.
+
+    Args:
+    - module (nn.Module): the module to compile.
+    - compile_mode (str): one of COMPILE_MODES.
+    - example_inputs (tuple): positional inputs of forward. If given, forward is run on them in inference mode and with gradients, so compilation doesn't happen during the first rollout or training step.
+
+    Returns:
+    - nn.Module: the compiled module, or module itself if it couldn't be compiled.
+    """
+    assert compile_mode in COMPILE_MODES, f"compile_mode must be one of {COMPILE_MODES}"
+    name = type(module).__name__
+    if compile_mode == "none":
+        return module
+
+    if compile_mode == "script":
+        try:
+            compiled_module = t.jit.script(module)
+        except Exception as e:
+            warnings.warn(
+                f"Could not script {name} ({type(e).__name__}: {e}), running it eagerly."
+            )
+            return module
+    else:
+        # compile the unbound forward and bind it, so deepcopy rebinds it
+        eager_forward = type(module).forward
+        compiled_forward = compile_function(
+            eager_forward, compile_mode, name=f"{name}.forward"
+        )
+        module.forward = types.MethodType(compiled_forward, module)
+        compiled_module = module
+
+    if example_inputs is not None:
+        try:
+            # graphs are specialized on the grad mode, warm up both
+            with t.inference_mode():
+                compiled_module(*example_inputs)
+            compiled_module(*example_inputs)
+        except Exception as e:
+            warnings.warn(
+                f"Warm-up of the compiled {name} failed ({type(e).__name__}: {e}), running it eagerly."
+            )
+            module.__dict__.pop("forward", None)
+            return module
+    return compiled_module
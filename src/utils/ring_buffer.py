@@ -0,0 +1,64 @@
+import torch as t
+
+
+class RingBuffer:
+    """
+    The last length steps of a batch of sequences, written in place.
+
+    Every step is written twice in a buffer of 2 * length steps, at head
+    and head + length, so the window of the last length steps is always the
+    contiguous slice [head + 1, head + 1 + length) and is read as a view,
+    without copying or reallocating as the sequences go on.
+    """
+
+    def __init__(self, initial: t.Tensor):
+        """
+        Args:
+        - initial (t.Tensor): (batch, length, ...) the initial windows.
+        """
+        batch, self.length = initial.shape[:2]
+        self.buffer = initial.new_empty(
+            (batch, 2 * self.length, *initial.shape[2:])
+        )
+        self.buffer[:, : self.length] = initial
+        self.buffer[:, self.length :] = initial
+        self.head = self.length - 1
+
+    def window(self) -> t.Tensor:
+        """Returns a (batch, length, ...) view of the last length steps."""
+        start = self.head + 1
+        return self.buffer[:, start : start + self.length]
+
+    def last(self) -> t.Tensor:
+        """Returns a (batch, ...) view of the newest step."""
+        return self.buffer[:, self.head]
+
+    def write_last(self, values) -> None:
+        """Overwrites the newest step with (batch, ...) values."""
+        self.buffer[:, self.head] = values
+        self.buffer[:, self.head + self.length] = values
+
+    def append(self, values) -> None:
+        """Appends one (batch, ...) step, evicting the oldest."""
+        self.head = (self.head + 1) % self.length
+        self.write_last(values)
+
+    def extend(self, values: t.Tensor) -> None:
+        """Appends (batch, k, ...) steps, evicting the oldest k."""
+        for j in range(values.shape[1]):
+            self.append(values[:, j])
+
+    def reset(self, rows: t.Tensor, windows) -> None:
+        """
+        Replaces the windows of rows.
+
+        Args:
+        - rows (t.Tensor): (n,) the indices of the sequences to replace.
+        - windows: (n, length, ...) the new windows, or anything that broadcasts to them.
+        """
+        slots = (
+            self.head + 1 + t.arange(self.length, device=self.buffer.device)
+        ) % self.length
+        rows = rows[:, None]
+        self.buffer[rows, slots] = windows
+        self.buffer[rows, slots + self.length] = windows
@@ -0,0 +1,90 @@
+"""
+Sharded on-disk format for trajectories, written while collecting.
+
+A sharded trajectory directory holds the collected (t, b) arrays split along
+time into shards, each a pickle with the same layout as a single-file
+trajectory, plus a manifest:
+
+    shard_00000.pkl.gz
+    shard_00001.pkl.gz
+    ...
+    manifest.json   metadata, compression and the shards written so far
+
+The manifest is rewritten after every shard, so a crashed run still leaves
+a readable prefix. Concatenating the shards along time gives back exactly
+the arrays an unsharded writer would have written; episodes can continue
+from one shard into the next.
+"""
+import gzip
+import json
+import lzma
+import os
+import pickle
+from typing import Iterator
+
+import numpy as np
+
+from src.config import ConfigJsonEncoder
+
+MANIFEST = "manifest.json"
+COMPRESSIONS = ["none", "gz", "xz"]
+
+
+def is_sharded_path(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def shard_file_name(index: int, compression: str) -> str:
+    suffix = "" if compression == "none" else f".{compression}"
+    return f"shard_{index:05d}.pkl{suffix}"
+
+
+def open_shard(path: str, mode: str):
+    if path.endswith(".xz"):
+        return lzma.open(path, mode)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def write_shard(path: str, file_name: str, data: dict) -> None:
+    with open_shard(os.path.join(path, file_name), "wb") as f:
+        pickle.dump(data, f)
+
+
+def write_manifest(path: str, manifest: dict) -> None:
+    """Writes the manifest atomically, so readers never see a partial file."""
+    tmp_path = os.path.join(path, MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, cls=ConfigJsonEncoder)
+    os.replace(tmp_path, os.path.join(path, MANIFEST))
+
+
+def read_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def iter_shards(path: str) -> Iterator[dict]:
+    """Yields the data of each shard listed in the manifest, in order."""
+    for shard in read_manifest(path)["shards"]:
+        with open_shard(os.path.join(path, shard["file"]), "rb") as f:
+            yield pickle.load(f)
+
+
+def read_sharded_trajectories(path: str) -> dict:
+    """
+    Reads every shard and concatenates them along time.
+
+    Returns:
+    - dict: {"data": arrays in (t, b, ...) layout, "metadata": metadata}, as for a single-file trajectory.
+    """
+    manifest = read_manifest(path)
+    shards = list(iter_shards(path))
+    if not shards:
+        raise ValueError(f"No shards have been written to {path}")
+    data = {
+        name: np.concatenate([shard[name] for shard in shards], axis=0)
+        for name in shards[0]
+    }
+    return {"data": data, "metadata": manifest["metadata"]}
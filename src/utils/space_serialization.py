@@ -0,0 +1,72 @@
+"""
+JSON serialization of gymnasium spaces, so checkpoints can carry the spaces
+of their environment and be loaded without constructing it.
+
+Box, Discrete and Dict spaces are supported. Other subspaces of a Dict
+(e.g. MiniGrid's mission space, which holds a function) are left out; the
+models only read the image and the number of actions.
+"""
+from typing import Optional
+
+import numpy as np
+from gymnasium import spaces
+
+
+def bound_to_json(bound: np.ndarray):
+    # bounds are usually constant, store them as one number when they are
+    if np.all(bound == bound.flat[0]):
+        return bound.flat[0].item()
+    return bound.tolist()
+
+
+def space_to_dict(space: spaces.Space) -> Optional[dict]:
+    """Returns a JSON serializable description of space, or None if it isn't supported."""
+    if isinstance(space, spaces.Box):
+        return {
+            "type": "Box",
+            "low": bound_to_json(space.low),
+            "high": bound_to_json(space.high),
+            "shape": list(space.shape),
+            "dtype": str(space.dtype),
+        }
+    if isinstance(space, spaces.Discrete):
+        return {
+            "type": "Discrete",
+            "n": int(space.n),
+            "start": int(space.start),
+        }
+    if isinstance(space, spaces.Dict):
+        subspaces = {
+            key: space_to_dict(subspace)
+            for key, subspace in space.spaces.items()
+        }
+        return {
+            "type": "Dict",
+            "spaces": {k: v for k, v in subspaces.items() if v is not None},
+        }
+    return None
+
+
+def space_from_dict(description: dict) -> spaces.Space:
+    """Inverse of space_to_dict."""
+    if description["type"] == "Box":
+        dtype = np.dtype(description["dtype"])
+        shape = tuple(description["shape"])
+        return spaces.Box(
+            low=np.broadcast_to(np.asarray(description["low"], dtype), shape),
+            high=np.broadcast_to(
+                np.asarray(description["high"], dtype), shape
+            ),
+            shape=shape,
+            dtype=dtype,
+        )
+    if description["type"] == "Discrete":
+        return spaces.Discrete(description["n"], start=description["start"])
+    if description["type"] == "Dict":
+        return spaces.Dict(
+            {
+                key: space_from_dict(subspace)
+                for key, subspace in description["spaces"].items()
+            }
+        )
+    raise ValueError(f"Unknown space type {description['type']}")
@@ -1,3 +1,4 @@
+import numpy as np
 import torch as t
 
 
@@ -30,3 +31,24 @@ def pad_tensor(
                 tensor = t.cat([tensor, pad], dim=0)
 
         return tensor
+
+
+def compact_observations(observations):
+    """
+    Returns observations as uint8 if that is lossless, otherwise unchanged.
+
+    MiniGrid grid observations are small integer codes (object, color, state)
+    or one hot encodings, so they fit in uint8 instead of 4-8 byte floats.
+    Converting to float is left to the model input.
+    """
+    if isinstance(observations, t.Tensor):
+        compact = observations.to(t.uint8)
+        return compact if t.equal(compact.to(observations.dtype), observations) else observations
+
+    observations = np.asarray(observations)
+    if observations.dtype == np.uint8:
+        return observations
+    compact = observations.astype(np.uint8)
+    if np.array_equal(compact, observations):
+        return compact
+    return observations
@@ -5,7 +5,8 @@ import lzma
 import os
 import pickle
 import time
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
 
 import numpy as np
 from typeguard import typechecked
@@ -13,6 +14,19 @@ from typeguard import typechecked
 import wandb
 from src.config import ConfigJsonEncoder
 
+from .columnar_trajectories import (
+    is_columnar_path,
+    to_episode_major,
+    write_columnar_trajectories,
+)
+from .sharded_trajectories import (
+    COMPRESSIONS,
+    shard_file_name,
+    write_manifest,
+    write_shard,
+)
+from .trajectory_utils import compact_observations
+
 
 class TrajectoryWriter:
     """
@@ -24,8 +38,16 @@ class TrajectoryWriter:
         - the dones
         - the infos
     And store them in a set of lists, indexed by batch b and time t.
+
+    If shard_size is set, the lists are flushed to a new shard in the
+    directory path every shard_size steps (see sharded_trajectories), so
+    memory stays bounded however long the collection runs. Shards can be
+    pickled and compressed in a background thread.
     """
 
+    # shards queued for the background thread before accumulate blocks
+    max_pending_shards = 2
+
     def __init__(
         self,
         path,
@@ -33,6 +55,9 @@ class TrajectoryWriter:
         environment_config,
         online_config,
         model_config=None,
+        shard_size: Optional[int] = None,
+        compression: str = "gz",
+        background_compression: bool = False,
     ):
         self.observations = []
         self.actions = []
@@ -52,6 +77,22 @@ class TrajectoryWriter:
 
         self.args = args
 
+        self.shard_size = shard_size
+        self.compression = compression
+        self.shards = []
+        self.pending_shards = []
+        self.executor = None
+        if shard_size is not None:
+            assert compression in COMPRESSIONS, f"compression must be one of {COMPRESSIONS}"
+            if is_columnar_path(path):
+                raise ValueError(
+                    "Sharded writing is only supported for the pickle formats."
+                )
+            os.makedirs(path, exist_ok=True)
+            if background_compression:
+                # a single worker keeps the shards and manifest in order
+                self.executor = ThreadPoolExecutor(max_workers=1)
+
     @typechecked
     def accumulate_trajectory(
         self,
@@ -62,7 +103,15 @@ class TrajectoryWriter:
         action: np.ndarray,
         info: Dict,
     ):
-        self.observations.append(next_obs)
+        # flush before appending, so the last step stays available for tag_terminated_trajectories
+        if (
+            self.shard_size is not None
+            and len(self.observations) >= self.shard_size
+        ):
+            self.flush_shard()
+
+        # rollouts pass float32 observations, kept as uint8 when lossless
+        self.observations.append(compact_observations(next_obs))
         self.actions.append(action)
         self.rewards.append(reward)
         self.dones.append(done)
@@ -82,32 +131,137 @@ class TrajectoryWriter:
         for i in range(n_envs):
             self.truncated[-1][i] = True
 
-    def write(self, upload_to_wandb: bool = False):
-        data = {
-            "observations": np.array(self.observations, dtype=np.float),
+    def get_data(self) -> dict:
+        return {
+            # uint8 unless some step couldn't be compacted
+            "observations": np.array(self.observations),
             "actions": np.array(self.actions, dtype=np.int64),
-            "rewards": np.array(self.rewards, dtype=np.float),
+            "rewards": np.array(self.rewards, dtype=np.float64),
             "dones": np.array(self.dones, dtype=bool),
             "truncated": np.array(self.truncated, dtype=bool),
             "infos": np.array(self.infos, dtype=object),
         }
+
+    def get_metadata(self) -> dict:
         if dataclasses.is_dataclass(self.args):
-            metadata = {
+            return {
                 # Args such as ppo args
                 "args": json.dumps(self.args, cls=ConfigJsonEncoder),
                 "time": time.time(),  # Time of writing
             }
+        return {
+            "args": self.args,  # Args such as ppo args
+            "time": time.time(),  # Time of writing
+        }
+
+    def flush_shard(self) -> None:
+        """Moves the accumulated steps into a new shard and clears the lists."""
+        data = self.get_data()
+        file_name = shard_file_name(len(self.shards), self.compression)
+        self.shards.append(
+            {
+                "file": file_name,
+                "num_steps": data["actions"].shape[0],
+            }
+        )
+        shards = list(self.shards)
+
+        self.observations = []
+        self.actions = []
+        self.rewards = []
+        self.dones = []
+        self.truncated = []
+        self.infos = []
+
+        if self.executor is None:
+            self.write_shard(data, file_name, shards)
+            return
+
+        # bound the memory held by shards waiting for the background thread
+        self.pending_shards = [f for f in self.pending_shards if not f.done()]
+        while len(self.pending_shards) >= self.max_pending_shards:
+            self.pending_shards.pop(0).result()
+        self.pending_shards.append(
+            self.executor.submit(self.write_shard, data, file_name, shards)
+        )
+
+    def write_shard(self, data, file_name, shards, complete=False) -> None:
+        write_shard(self.path, file_name, data)
+        write_manifest(
+            self.path,
+            {
+                "metadata": self.get_metadata(),
+                "compression": self.compression,
+                "shards": shards,
+                "complete": complete,
+            },
+        )
+
+    def write_sharded(self) -> None:
+        """Flushes the remaining steps and marks the manifest as complete."""
+        if self.observations:
+            self.flush_shard()
+        if self.executor is not None:
+            for future in self.pending_shards:
+                future.result()
+            self.pending_shards = []
+            self.executor.shutdown()
+            self.executor = None
+        write_manifest(
+            self.path,
+            {
+                "metadata": self.get_metadata(),
+                "compression": self.compression,
+                "shards": self.shards,
+                "complete": True,
+            },
+        )
+
+    def write(self, upload_to_wandb: bool = False):
+        if self.shard_size is not None:
+            print(f"Writing the last shard to {self.path}")
+            self.write_sharded()
         else:
-            metadata = {
-                "args": self.args,  # Args such as ppo args
-                "time": time.time(),  # Time of writing
+            self.write_file()
+
+        if upload_to_wandb:
+            artifact = wandb.Artifact(
+                self.path.split("/")[-1], type="trajectory"
+            )
+            if os.path.isdir(self.path):
+                artifact.add_dir(self.path)
+            else:
+                artifact.add_file(self.path)
+            wandb.log_artifact(artifact)
+
+        print(f"Trajectory written to {self.path}")
+
+    def write_file(self):
+        """Writes everything accumulated to a single file (or columnar directory)."""
+        if is_columnar_path(self.path):
+            # converted column by column, without the float64 copy of get_data
+            data = {
+                "observations": self.observations,
+                "actions": self.actions,
+                "rewards": self.rewards,
+                "dones": self.dones,
+                "truncated": self.truncated,
             }
+        else:
+            data = self.get_data()
+        metadata = self.get_metadata()
 
         if not os.path.exists(os.path.dirname(self.path)):
             os.makedirs(os.path.dirname(self.path))
 
+        # one .npy column per field, can be memory mapped by TrajectoryReader
+        if is_columnar_path(self.path):
+            print(f"Writing to {self.path}, using the columnar format")
+            write_columnar_trajectories(
+                self.path, to_episode_major(data), metadata
+            )
         # use lzma to compress the file
-        if self.path.endswith(".xz"):
+        elif self.path.endswith(".xz"):
             print(f"Writing to {self.path}, using lzma compression")
             with lzma.open(self.path, "wb") as f:
                 pickle.dump({"data": data, "metadata": metadata}, f)
@@ -119,12 +273,3 @@ class TrajectoryWriter:
             print(f"Writing to {self.path}")
             with open(self.path, "wb") as f:
                 pickle.dump({"data": data, "metadata": metadata}, f)
-
-        if upload_to_wandb:
-            artifact = wandb.Artifact(
-                self.path.split("/")[-1], type="trajectory"
-            )
-            artifact.add_file(self.path)
-            wandb.log_artifact(artifact)
-
-        print(f"Trajectory written to {self.path}")
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import torch
+from gymnasium import spaces
+
+from src.config import (
+    EnvironmentConfig,
+    OfflineTrainConfig,
+    TransformerModelConfig,
+)
+from src.decision_transformer.runner import store_transformer_model
+from src.decision_transformer.utils import load_decision_transformer
+from src.models.trajectory_transformer import DecisionTransformer
+
+
+@pytest.fixture
+def model():
+    environment_config = EnvironmentConfig(
+        env_id="MiniGrid-Dynamic-Obstacles-8x8-v0",
+        observation_space=spaces.Dict(
+            {"image": spaces.Box(0, 255, (7, 7, 3), dtype=np.uint8)}
+        ),
+        action_space=spaces.Discrete(3),
+    )
+    transformer_config = TransformerModelConfig(
+        d_model=32, n_heads=2, d_mlp=64, n_layers=1, n_ctx=5
+    )
+    return DecisionTransformer(
+        environment_config=environment_config,
+        transformer_config=transformer_config,
+    )
+
+
+def test_store_and_load(model, tmp_path, monkeypatch):
+    path = tmp_path / "dt.pt"
+    store_transformer_model(
+        path=path,
+        model=model,
+        offline_config=OfflineTrainConfig(trajectory_path="trajectories"),
+    )
+
+    # the spaces come from the checkpoint, not from a new environment
+    def make(*args, **kwargs):
+        raise AssertionError("the environment should not be made")
+
+    monkeypatch.setattr("src.config.gym.make", make)
+    loaded = load_decision_transformer(path)
+
+    assert (
+        loaded.environment_config.observation_space
+        == model.environment_config.observation_space
+    )
+    assert (
+        loaded.environment_config.action_space
+        == model.environment_config.action_space
+    )
+    assert loaded.transformer_config == model.transformer_config
+    for name, tensor in model.state_dict().items():
+        torch.testing.assert_close(loaded.state_dict()[name], tensor)
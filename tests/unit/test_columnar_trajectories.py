@@ -0,0 +1,103 @@
+import json
+import os
+import pickle
+
+import numpy as np
+import torch
+
+from src.decision_transformer.offline_dataset import TrajectoryDataset
+from src.utils.columnar_trajectories import (
+    is_columnar_path,
+    read_columnar_trajectories,
+    to_episode_major,
+    write_columnar_trajectories,
+)
+
+METADATA = {"env_id": "MiniGrid-Empty-5x5-v0", "n_envs": 2}
+
+
+def make_rollout(num_steps=6, num_envs=2):
+    """(t, b) arrays as accumulated by TrajectoryWriter."""
+    rng = np.random.default_rng(0)
+    dones = np.zeros((num_steps, num_envs), dtype=bool)
+    truncated = np.zeros((num_steps, num_envs), dtype=bool)
+    dones[2, 0] = True
+    truncated[3, 1] = True
+    # the rollouts end mid episode
+    return {
+        "observations": rng.integers(
+            0, 10, size=(num_steps, num_envs, 7, 7, 3)
+        ).astype(np.float32),
+        "actions": rng.integers(0, 7, size=(num_steps, num_envs)),
+        "rewards": rng.random((num_steps, num_envs)),
+        "dones": dones,
+        "truncated": truncated,
+        "infos": np.array(
+            [[{} for _ in range(num_envs)] for _ in range(num_steps)]
+        ),
+    }
+
+
+def test_round_trip(tmp_path):
+    data = make_rollout()
+    path = os.path.join(tmp_path, "trajectories.traj")
+    write_columnar_trajectories(path, to_episode_major(data), METADATA)
+
+    assert is_columnar_path(path)
+    read = read_columnar_trajectories(path, mmap=True)
+    columns = read["data"]
+    assert read["metadata"] == METADATA
+
+    # split where an env is done or truncated, as the pickle formats are
+    np.testing.assert_array_equal(columns["episode_offsets"], [0, 3, 10, 12])
+    assert columns["observations"].dtype == np.uint8
+    np.testing.assert_array_equal(
+        columns["observations"],
+        np.concatenate(
+            [data["observations"][:, 0], data["observations"][:, 1]]
+        ),
+    )
+    for name in ["actions", "rewards", "dones", "truncated"]:
+        np.testing.assert_allclose(
+            columns[name],
+            np.concatenate([data[name][:, 0], data[name][:, 1]]),
+            rtol=1e-6,
+        )
+
+    with open(os.path.join(path, "metadata.json")) as f:
+        sidecar = json.load(f)
+    assert sidecar["columns"]["observations"] == {
+        "dtype": "uint8",
+        "shape": [12, 7, 7, 3],
+    }
+
+
+def test_dataset_matches_pickle(tmp_path):
+    data = make_rollout()
+    columnar_path = os.path.join(tmp_path, "trajectories.traj")
+    write_columnar_trajectories(
+        columnar_path, to_episode_major(data), METADATA
+    )
+    pickle_path = os.path.join(tmp_path, "trajectories.pkl")
+    with open(pickle_path, "wb") as f:
+        pickle.dump({"data": data, "metadata": METADATA}, f)
+
+    columnar = TrajectoryDataset(columnar_path, max_len=3)
+    pickled = TrajectoryDataset(pickle_path, max_len=3)
+
+    assert columnar.num_trajectories == pickled.num_trajectories == 3
+    np.testing.assert_array_equal(columnar.traj_lens, pickled.traj_lens)
+    for field in ["states", "actions", "dones"]:
+        for a, b in zip(getattr(columnar, field), getattr(pickled, field)):
+            # both formats yield tensors
+            assert isinstance(a, torch.Tensor)
+            assert isinstance(b, torch.Tensor)
+            assert torch.equal(a, b)
+
+    indices = np.arange(columnar.num_trajectories)
+    end_indices = columnar.traj_lens - 1
+    for x, y in zip(
+        columnar.get_windows(indices, max_len=3, end_indices=end_indices),
+        pickled.get_windows(indices, max_len=3, end_indices=end_indices),
+    ):
+        assert torch.allclose(x.float(), y.float())
@@ -0,0 +1,96 @@
+import pytest
+import torch as t
+
+from src.ppo.compute_adv_vectorized import (
+    GAE_BACKENDS,
+    compute_advantages,
+    compute_advantages_loop,
+    compute_advantages_vectorized,
+)
+
+GAMMA = 0.99
+GAE_LAMBDA = 0.95
+
+
+def make_rollout(num_steps, num_envs, done_prob, next_done, seed=0):
+    generator = t.Generator().manual_seed(seed)
+    rewards = t.randn(num_steps, num_envs, generator=generator)
+    values = t.randn(num_steps, num_envs, generator=generator)
+    dones = (
+        t.rand(num_steps, num_envs, generator=generator) < done_prob
+    ).float()
+    next_value = t.randn(num_envs, generator=generator)
+    next_done = t.full((num_envs,), float(next_done))
+    return next_value, next_done, rewards, values, dones
+
+
+@pytest.mark.parametrize("backend", GAE_BACKENDS)
+@pytest.mark.parametrize("num_steps", [1, 7, 64, 130])
+@pytest.mark.parametrize("done_prob", [0.0, 0.1, 1.0])
+@pytest.mark.parametrize("next_done", [False, True])
+def test_backends_match_loop(backend, num_steps, done_prob, next_done):
+    rollout = make_rollout(num_steps, 5, done_prob, next_done)
+    device = t.device("cpu")
+
+    reference = compute_advantages_loop(*rollout, device, GAMMA, GAE_LAMBDA)
+    advantages = compute_advantages(
+        *rollout, device, GAMMA, GAE_LAMBDA, backend=backend
+    )
+
+    assert advantages.shape == reference.shape
+    assert t.allclose(advantages, reference, atol=1e-5, rtol=1e-5)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 16, 17, 50, 200])
+def test_vectorized_matches_loop_across_chunk_boundaries(chunk_size):
+    # 50 steps: chunks that divide it, don't, and are longer than the rollout
+    rollout = make_rollout(50, 4, 0.1, next_done=False, seed=1)
+    device = t.device("cpu")
+
+    reference = compute_advantages_loop(*rollout, device, GAMMA, GAE_LAMBDA)
+    advantages = compute_advantages_vectorized(
+        *rollout, device, GAMMA, GAE_LAMBDA, chunk_size=chunk_size
+    )
+
+    assert t.allclose(advantages, reference, atol=1e-5, rtol=1e-5)
+
+
+@pytest.mark.parametrize("backend", GAE_BACKENDS)
+def test_next_done_cuts_bootstrap(backend):
+    next_value, _, rewards, values, dones = make_rollout(10, 3, 0.0, False)
+    device = t.device("cpu")
+
+    done_advantages = compute_advantages(
+        next_value,
+        t.ones(3),
+        rewards,
+        values,
+        dones,
+        device,
+        GAMMA,
+        GAE_LAMBDA,
+        backend=backend,
+    )
+    # the next value is ignored once the episode is done
+    other_done_advantages = compute_advantages(
+        next_value + 100,
+        t.ones(3),
+        rewards,
+        values,
+        dones,
+        device,
+        GAMMA,
+        GAE_LAMBDA,
+        backend=backend,
+    )
+
+    assert t.allclose(done_advantages[-1], rewards[-1] - values[-1])
+    assert t.allclose(done_advantages, other_done_advantages)
+
+
+def test_unknown_backend_raises():
+    rollout = make_rollout(4, 2, 0.1, False)
+    with pytest.raises(ValueError):
+        compute_advantages(
+            *rollout, t.device("cpu"), GAMMA, GAE_LAMBDA, backend="unknown"
+        )
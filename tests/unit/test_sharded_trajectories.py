@@ -0,0 +1,105 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.decision_transformer.offline_dataset import TrajectoryReader
+from src.utils.sharded_trajectories import (
+    is_sharded_path,
+    read_manifest,
+    read_sharded_trajectories,
+)
+from src.utils.trajectory_writer import TrajectoryWriter
+
+NUM_ENVS = 2
+
+
+def make_writer(path, shard_size=None, **kwargs):
+    return TrajectoryWriter(
+        path,
+        SimpleNamespace(exp_name="test"),
+        SimpleNamespace(env_id="MiniGrid-Empty-5x5-v0"),
+        SimpleNamespace(num_envs=NUM_ENVS),
+        shard_size=shard_size,
+        **kwargs,
+    )
+
+
+def accumulate(writer, num_steps, seed=0):
+    rng = np.random.default_rng(seed)
+    for step in range(num_steps):
+        writer.accumulate_trajectory(
+            next_obs=rng.integers(0, 10, size=(NUM_ENVS, 7, 7, 3)).astype(
+                np.float32
+            ),
+            reward=rng.random(NUM_ENVS),
+            done=np.array([step % 3 == 2, False]),
+            truncated=np.array([False, step % 4 == 3]),
+            action=rng.integers(0, 7, size=NUM_ENVS),
+            info={},
+        )
+
+
+@pytest.mark.parametrize("compression", ["none", "gz", "xz"])
+@pytest.mark.parametrize("background_compression", [False, True])
+def test_shards_concatenate_to_unsharded(
+    tmp_path, compression, background_compression
+):
+    path = os.path.join(tmp_path, "sharded")
+    writer = make_writer(
+        path,
+        shard_size=4,
+        compression=compression,
+        background_compression=background_compression,
+    )
+    accumulate(writer, 10)
+    writer.write()
+
+    unsharded = make_writer(os.path.join(tmp_path, "trajectories.pkl"))
+    accumulate(unsharded, 10)
+    expected = unsharded.get_data()
+
+    assert is_sharded_path(path)
+    manifest = read_manifest(path)
+    assert manifest["complete"]
+    assert manifest["compression"] == compression
+    assert [shard["num_steps"] for shard in manifest["shards"]] == [4, 4, 2]
+    for shard in manifest["shards"]:
+        assert os.path.isfile(os.path.join(path, shard["file"]))
+
+    data = read_sharded_trajectories(path)["data"]
+    for name in ["observations", "actions", "rewards", "dones", "truncated"]:
+        np.testing.assert_array_equal(data[name], expected[name])
+
+    shards = list(TrajectoryReader(path).iter_shards())
+    assert [len(shard["actions"]) for shard in shards] == [4, 4, 2]
+
+
+def test_manifest_lists_flushed_shards_before_write(tmp_path):
+    path = os.path.join(tmp_path, "sharded")
+    writer = make_writer(path, shard_size=4, compression="none")
+    # the fifth step flushes the first four
+    accumulate(writer, 5)
+
+    manifest = read_manifest(path)
+    assert not manifest["complete"]
+    assert [shard["num_steps"] for shard in manifest["shards"]] == [4]
+    assert read_sharded_trajectories(path)["data"]["actions"].shape == (
+        4,
+        NUM_ENVS,
+    )
+
+
+def test_no_shards_raises(tmp_path):
+    path = os.path.join(tmp_path, "sharded")
+    make_writer(path, shard_size=4).write()
+
+    assert read_manifest(path)["shards"] == []
+    with pytest.raises(ValueError):
+        read_sharded_trajectories(path)
+
+
+def test_columnar_path_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        make_writer(os.path.join(tmp_path, "sharded.traj"), shard_size=4)
@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pytest
+from gymnasium import spaces
+
+from src.utils.space_serialization import space_from_dict, space_to_dict
+
+
+def round_trip(space):
+    # through JSON, as stored in checkpoints
+    return space_from_dict(json.loads(json.dumps(space_to_dict(space))))
+
+
+def test_box_with_constant_bounds():
+    space = spaces.Box(low=0, high=255, shape=(7, 7, 3), dtype=np.uint8)
+    description = space_to_dict(space)
+
+    assert description["low"] == 0 and description["high"] == 255
+    assert round_trip(space) == space
+
+
+def test_box_with_varying_bounds():
+    low = np.array([-1.0, 0.0, -2.5], dtype=np.float32)
+    high = np.array([1.0, 3.0, 2.5], dtype=np.float32)
+    space = spaces.Box(low=low, high=high, dtype=np.float32)
+
+    loaded = round_trip(space)
+    assert loaded == space
+    np.testing.assert_array_equal(loaded.low, low)
+    np.testing.assert_array_equal(loaded.high, high)
+
+
+@pytest.mark.parametrize("start", [0, 2])
+def test_discrete(start):
+    space = spaces.Discrete(7, start=start)
+    assert round_trip(space) == space
+
+
+def test_dict_drops_unsupported_subspaces():
+    space = spaces.Dict(
+        {
+            "image": spaces.Box(0, 255, (7, 7, 3), dtype=np.uint8),
+            "direction": spaces.Discrete(4),
+            "mission": spaces.Text(max_length=10),
+        }
+    )
+
+    loaded = round_trip(space)
+    assert set(loaded.spaces) == {"image", "direction"}
+    assert loaded["image"] == space["image"]
+    assert loaded["direction"] == space["direction"]
+
+
+def test_unsupported_space():
+    assert space_to_dict(spaces.Text(max_length=10)) is None
+    with pytest.raises(ValueError):
+        space_from_dict({"type": "Text"})